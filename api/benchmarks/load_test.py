@@ -0,0 +1,97 @@
+"""
+Starts the api on an empty data folder with a given number of workers and has concurrent clients
+read and add payments across several projects for a while, then reports throughput and latency.
+
+    poetry run python benchmarks/load_test.py --workers 1 2 4 --clients 32 --seconds 10
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+PAYMENT = {"name": "load test", "date": "2024-01-01", "asset": 100, "currency": "USD"}
+
+
+async def wait_until_up(client: httpx.AsyncClient):
+    for _ in range(100):
+        try:
+            await client.get("/projects")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise SystemExit("server did not start")
+
+
+async def run_clients(base_url: str, clients: int, seconds: float, projects: int) -> tuple[int, list[float]]:
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await wait_until_up(client)
+        targets = []
+        for i in range(projects):
+            project_id = (await client.post("/projects", json={"name": f"load {i}"})).json()["id"]
+            group_id = (await client.post(f"/projects/{project_id}/paygroups", json={"name": "load"})).json()["id"]
+            targets.append((project_id, group_id))
+
+        latencies = []
+        errors = 0
+        deadline = time.monotonic() + seconds
+
+        async def user(n: int):
+            nonlocal errors
+            project_id, group_id = targets[n % len(targets)]
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                if len(latencies) % 4:
+                    resp = await client.get(f"/projects/{project_id}")
+                else:
+                    resp = await client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=PAYMENT)
+                latencies.append(time.perf_counter() - start)
+                errors += resp.status_code != 200
+
+        await asyncio.gather(*(user(n) for n in range(clients)))
+        return errors, latencies
+
+
+def measure(workers: int, clients: int, seconds: float, projects: int, port: int) -> str:
+    with tempfile.TemporaryDirectory() as base:
+        env = {**os.environ, "PYTHONPATH": os.getcwd(), "BIL_WORKERS": str(workers), "BIL_PORT": str(port)}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "bil.main", "--host", "127.0.0.1"],
+            cwd=base,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            errors, latencies = asyncio.run(run_clients(f"http://127.0.0.1:{port}", clients, seconds, projects))
+        finally:
+            server.terminate()
+            server.wait()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return f"{workers:<9}{len(latencies) / seconds:>10.0f}{p50:>10.1f}{p99:>10.1f}{errors:>8}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--projects", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients, {args.projects} projects, 3 reads per write, {os.cpu_count()} cpus")
+    print(f"{'workers':<9}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for workers in args.workers:
+        print(measure(workers, args.clients, args.seconds, args.projects, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Counts how many times payments.json is parsed per DBAdaptor call, starting from a cold cache,
+and how long each call takes on a project with many payments.
+
+    poetry run python benchmarks/parse_count.py --payments 20000
+"""
+
+from datetime import date
+import argparse
+import tempfile
+import time
+from bil import dbfile
+from bil.datamodels import Payment, PaymentInput, Paygroup
+from bil.dbfile import DBAdaptor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=20000)
+    args = parser.parse_args()
+
+    parses = 0
+    original = dbfile._parse_paygroups
+
+    def counting_parser(path):
+        nonlocal parses
+        parses += 1
+        return original(path)
+
+    dbfile._parse_paygroups = counting_parser
+
+    with tempfile.TemporaryDirectory() as base:
+        db = DBAdaptor(base, keep_history=False)
+        project_id = db.add_project("bench")
+        payments = [
+            Payment(id=i, name=f"payment {i}", date=date(2024, 1, 1), currency="USD") for i in range(1, args.payments)
+        ]
+        db._save_paygroups(project_id, {1: Paygroup(id=1, name="bench", payments=payments)})
+        deletable_ids = iter(range(args.payments - 1, 0, -1))
+        new_payment = PaymentInput(name="new", date=date(2024, 1, 2), currency="USD")
+        calls = {
+            "add_payment": lambda: db.add_payment(project_id, 1, new_payment),
+            "update_payment": lambda: db.update_payment(project_id, 1, payments[0]),
+            "delete_payment": lambda: db.delete_payment(project_id, 1, next(deletable_ids)),
+            "update_paygroup": lambda: db.update_paygroup(project_id, 1, "renamed"),
+            "get_project": lambda: db.get_project(project_id),
+        }
+        print(f"{'call':<16}{'cold parses':>12}{'cold ms':>10}{'warm parses':>12}{'warm ms':>10}")
+        for name, call in calls.items():
+            row = []
+            for cold in (True, False):
+                if cold:
+                    dbfile._payments_cache.clear()
+                parses = 0
+                start = time.perf_counter()
+                call()
+                row += [parses, (time.perf_counter() - start) * 1000]
+            print(f"{name:<16}{row[0]:>12}{row[1]:>10.1f}{row[2]:>12}{row[3]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
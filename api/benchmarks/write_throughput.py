@@ -0,0 +1,45 @@
+"""
+Measures how many payment updates per second a project sustains under each fsync policy,
+with payments.json rewritten on every change and with the journal.
+
+    poetry run python benchmarks/write_throughput.py --payments 5000 --writes 200
+"""
+
+from datetime import date
+import argparse
+import tempfile
+import time
+from bil.atomic import SYNC_MODES, SyncPolicy
+from bil.datamodels import Payment, Paygroup
+from bil.dbfile import DBAdaptor
+
+
+def measure(mode: str, journal: bool, payments: int, writes: int) -> float:
+    with tempfile.TemporaryDirectory(dir=".") as base:
+        sync = SyncPolicy(mode, interval_ms=1000)
+        db = DBAdaptor(base, keep_history=False, journal=journal, sync=sync)
+        project_id = db.add_project("bench")
+        rows = [Payment(id=i, name=f"payment {i}", date=date(2024, 1, 1), currency="USD") for i in range(1, payments)]
+        db._save_paygroups(project_id, {1: Paygroup(id=1, name="bench", payments=rows)})
+        start = time.perf_counter()
+        for i in range(writes):
+            db.update_payment(project_id, 1, rows[i % len(rows)].model_copy(update={"name": f"edit {i}"}))
+        sync.flush()
+        return writes / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=5000)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'fsync':<10}{'snapshot writes/s':>20}{'journal writes/s':>20}")
+    for mode in SYNC_MODES:
+        snapshot = measure(mode, False, args.payments, args.writes)
+        journal = measure(mode, True, args.payments, args.writes)
+        print(f"{mode:<10}{snapshot:>20.0f}{journal:>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
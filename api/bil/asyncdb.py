@@ -0,0 +1,32 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+from bil.dbfile import DBAdaptor
+import asyncio
+import os
+
+# storage calls block on file and database I/O, locks and history commits; this bounds how many run at once
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("BIL_DB_THREADS", 8)), thread_name_prefix="bil-db")
+
+
+async def run_blocking(func: Callable, *args, pool: Executor = executor, **kwargs) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(pool, partial(func, *args, **kwargs))
+
+
+class AsyncDBAdaptor:
+    """
+    Awaitable view of a DBAdaptor for async route handlers: `await adb.add_payment(...)` runs the adaptor's
+    method on the storage thread pool, so the event loop keeps serving other requests meanwhile.
+    """
+
+    def __init__(self, db: DBAdaptor, pool: Executor = executor):
+        self.db = db
+        self._pool = pool
+
+    def __getattr__(self, name: str) -> Callable:
+        method = getattr(self.db, name)
+
+        async def call(*args, **kwargs) -> Any:
+            return await run_blocking(method, *args, pool=self._pool, **kwargs)
+
+        return call
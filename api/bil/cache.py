@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import hashlib
+import os
+import threading
+
+
+def file_signature(path: str) -> Optional[tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def files_signature(path: str, also: tuple[str, ...] = ()) -> Optional[tuple]:
+    """Signature of `path` together with files it is read with; None if `path` itself does not exist."""
+    signature = file_signature(path)
+    if signature is None or not also:
+        return signature
+    return (signature, *(file_signature(other) for other in also))
+
+
+def state_tag(state: Any) -> str:
+    """Short stable digest of a signature-like value, for use as an ETag."""
+    return hashlib.sha1(repr(state).encode()).hexdigest()[:20]
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+
+class FileCache:
+    """
+    Keeps parsed contents of files in memory, keyed by path.
+    Every lookup stats the file and re-parses it only if it changed on disk since it was cached.
+    Files listed in `also` are read together with the main one, and a change to any of them counts too.
+    """
+
+    def __init__(self, max_files: int):
+        self._entries = LRUCache(max_files)
+
+    def load(self, path: str, parser: Callable[[str], Any], also: tuple[str, ...] = ()) -> Any:
+        signature = files_signature(path, also)
+        if signature is None:
+            self._entries.pop(path)
+            return None
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        value = parser(path)
+        self._entries.put(path, (signature, value))
+        return value
+
+    def get(self, path: str, also: tuple[str, ...] = ()) -> Any:
+        """Returns the cached value if it is still current, without parsing the file otherwise."""
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == files_signature(path, also):
+            return entry[1]
+        return None
+
+    def store(self, path: str, value: Any, also: tuple[str, ...] = ()):
+        signature = files_signature(path, also)
+        if signature is None:
+            self._entries.pop(path)
+            return
+        self._entries.put(path, (signature, value))
+
+    def invalidate(self, path: str):
+        self._entries.pop(path)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,57 @@
+"""
+Command line tools working directly on a data folder:
+
+    poetry run bil import PROJECT_ID PAYGROUP_ID statement.csv
+    poetry run bil import PROJECT_ID PAYGROUP_ID - --format ndjson < statement.ndjson
+"""
+
+from bil.dbfile import ItemNotFoundError
+from bil.importer import ImportFailedError, import_payments
+from bil.main import STORAGE
+import argparse
+import os
+import sys
+
+
+def run_import(args: argparse.Namespace) -> int:
+    fmt = args.format or {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}.get(os.path.splitext(args.file)[1])
+    if fmt is None:
+        print("cannot tell the format from the file name, pass --format", file=sys.stderr)
+        return 2
+    db = STORAGE(args.data)
+    stream = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8-sig", newline="")
+    try:
+        ids = import_payments(db, args.project_id, args.paygroup_id, stream, fmt)
+    except ItemNotFoundError:
+        print(f"no paygroup {args.paygroup_id} in project {args.project_id}", file=sys.stderr)
+        return 1
+    except ImportFailedError as e:
+        for error in e.errors:
+            print(f"line {error['line']}: {'; '.join(error['errors'])}", file=sys.stderr)
+        print("nothing was imported", file=sys.stderr)
+        return 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        db.flush_history()
+        db.flush_writes()
+    print(f"imported {len(ids)} payment(s)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bil")
+    parser.add_argument("--data", default="data/", help="data folder (default: data/)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="add payments from a CSV or JSON-lines file to a paygroup")
+    importer.add_argument("project_id", type=int)
+    importer.add_argument("paygroup_id", type=int)
+    importer.add_argument("file", help="file to read, or - for stdin")
+    importer.add_argument("--format", choices=["csv", "ndjson"])
+    importer.set_defaults(run=run_import)
+    args = parser.parse_args()
+    sys.exit(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
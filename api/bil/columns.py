@@ -0,0 +1,179 @@
+from array import array
+from datetime import date
+from typing import Iterable, Iterator, Optional
+from bil.datamodels import Change, Payment, Paygroup, TagModel
+
+# stands in for an amount of None, which int64 columns cannot hold
+NULL_AMOUNT = -(2**63)
+
+
+def _amount(value: Optional[int]) -> int:
+    return NULL_AMOUNT if value is None else value
+
+
+class PaymentColumns:
+    """
+    A project's payments as columns: arrays of paygroup ids, payment ids, day ordinals, amounts and currency ids,
+    a list of names and, per payment, a shared tuple of tag ids. Currencies and tags are interned, so a project
+    holds one copy of each. Views and queries read the columns directly and only the payments they return are
+    turned into Payment models. Kept current by applying changes: changed rows are dropped and re-added at the end.
+    """
+
+    def __init__(self):
+        self.paygroup_ids = array("q")
+        self.ids = array("q")
+        self.days = array("q")
+        self.assets = array("q")
+        self.liabilities = array("q")
+        self.currency_ids = array("l")
+        self.tag_ids: list[tuple[int, ...]] = []
+        self.names: list[str] = []
+        self.alive = bytearray()
+        self.currencies: list[str] = []
+        self.tags: list[tuple[str, str]] = []
+        self._currency_lookup: dict[str, int] = {}
+        self._tag_lookup: dict[tuple[str, str], int] = {}
+        self._tag_sets: dict[tuple[int, ...], tuple[int, ...]] = {(): ()}
+        self._rows: dict[tuple[int, int], int] = {}
+
+    @classmethod
+    def build(cls, paygroups: dict[int, Paygroup]) -> "PaymentColumns":
+        columns = cls()
+        for group in paygroups.values():
+            for pay in group.payments:
+                columns.add(group.id, pay)
+        return columns
+
+    @classmethod
+    def from_records(cls, records: Iterable[tuple[int, dict]]) -> "PaymentColumns":
+        """Builds the columns from (paygroup id, payment) pairs in their json form, without validating them."""
+        columns = cls()
+        for paygroup_id, record in records:
+            columns._append(
+                paygroup_id,
+                record["id"],
+                record["name"],
+                date.fromisoformat(record["date"]).toordinal(),
+                _amount(record.get("asset", 0)),
+                _amount(record.get("liability", 0)),
+                record["currency"],
+                [(tag["name"], tag["color"]) for tag in record.get("tags") or []],
+            )
+        return columns
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _intern_tags(self, tags: Iterable[tuple[str, str]]) -> tuple[int, ...]:
+        ids = []
+        for tag in tags:
+            if tag not in self._tag_lookup:
+                self._tag_lookup[tag] = len(self.tags)
+                self.tags.append(tag)
+            ids.append(self._tag_lookup[tag])
+        key = tuple(ids)
+        return self._tag_sets.setdefault(key, key)
+
+    def _append(
+        self,
+        paygroup_id: int,
+        id: int,
+        name: str,
+        day: int,
+        asset: int,
+        liability: int,
+        currency: str,
+        tags: Iterable[tuple[str, str]],
+    ):
+        if currency not in self._currency_lookup:
+            self._currency_lookup[currency] = len(self.currencies)
+            self.currencies.append(currency)
+        self._rows[(paygroup_id, id)] = len(self.ids)
+        self.paygroup_ids.append(paygroup_id)
+        self.ids.append(id)
+        self.names.append(name)
+        self.days.append(day)
+        self.assets.append(asset)
+        self.liabilities.append(liability)
+        self.currency_ids.append(self._currency_lookup[currency])
+        self.tag_ids.append(self._intern_tags(tags))
+        self.alive.append(1)
+
+    def add(self, paygroup_id: int, pay: Payment):
+        self._append(
+            paygroup_id,
+            pay.id,
+            pay.name,
+            pay.date.toordinal(),
+            _amount(pay.asset),
+            _amount(pay.liability),
+            pay.currency,
+            [(tag.name, tag.color) for tag in pay.tags or []],
+        )
+
+    def _remove(self, paygroup_id: int, id: int):
+        row = self._rows.pop((paygroup_id, id), None)
+        if row is not None:
+            self.alive[row] = 0
+
+    def apply(self, changes: Iterable[Change]):
+        for change in changes:
+            if change.payment_id is None:
+                continue
+            if change.before is not None:
+                self._remove(change.paygroup_id, change.payment_id)
+            if change.after is not None:
+                self.add(change.paygroup_id, change.after)
+        if len(self.alive) > 2 * len(self._rows) + 1024:
+            self._compact()
+
+    def _compact(self):
+        """Drops the rows of changed and deleted payments once they outnumber the live ones."""
+        keep = list(self.rows())
+        for name in ("paygroup_ids", "ids", "days", "assets", "liabilities", "currency_ids"):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[row] for row in keep)))
+        self.names = [self.names[row] for row in keep]
+        self.tag_ids = [self.tag_ids[row] for row in keep]
+        self.alive = bytearray(b"\x01" * len(keep))
+        self._rows = {(self.paygroup_ids[row], self.ids[row]): row for row in range(len(keep))}
+
+    def rows(self) -> Iterator[int]:
+        """Positions of current payments, in the order they were added."""
+        return (row for row, alive in enumerate(self.alive) if alive)
+
+    def find_row(self, paygroup_id: int, id: int) -> Optional[int]:
+        return self._rows.get((paygroup_id, id))
+
+    def asset(self, row: int) -> Optional[int]:
+        value = self.assets[row]
+        return None if value == NULL_AMOUNT else value
+
+    def liability(self, row: int) -> Optional[int]:
+        value = self.liabilities[row]
+        return None if value == NULL_AMOUNT else value
+
+    def currency(self, row: int) -> str:
+        return self.currencies[self.currency_ids[row]]
+
+    def tag_names(self, row: int) -> set[str]:
+        return {self.tags[tag_id][0] for tag_id in self.tag_ids[row]}
+
+    def day_labels(self) -> list[str]:
+        """Iso dates of all rows, formatting each distinct day once."""
+        labels: dict[int, str] = {}
+        return [labels.get(day) or labels.setdefault(day, date.fromordinal(day).isoformat()) for day in self.days]
+
+    def payment(self, row: int) -> Payment:
+        """Materializes one row; the values were validated when they were saved, so they are not checked again."""
+        tags = [self.tags[tag_id] for tag_id in self.tag_ids[row]]
+        return Payment.model_construct(
+            id=self.ids[row],
+            name=self.names[row],
+            date=date.fromordinal(self.days[row]),
+            asset=self.asset(row),
+            liability=self.liability(row),
+            currency=self.currency(row),
+            tags=[TagModel.model_construct(name=name, color=color) for name, color in tags],
+            attachment="",
+        )
@@ -1,5 +1,5 @@
 from datetime import date
-from typing import Optional
+from typing import Optional, Union
 from pydantic import BaseModel, Field
 import json
 
@@ -9,11 +9,19 @@ class TagModel(BaseModel):
     color: str
 
 
+class TagUsage(TagModel):
+    count: int = Field(description="Number of payments with this tag")
+
+
+# amounts are kept as signed 64-bit integers, whose lowest value stands for a missing amount
+MAX_AMOUNT = 2**63 - 1
+
+
 class PaymentInput(BaseModel):
     name: str = Field(min_length=1, max_length=255)
     date: date
-    asset: Optional[int] = Field(default=0, description="Amount in microcents")
-    liability: Optional[int] = Field(default=0, description="Amount in microcents")
+    asset: Optional[int] = Field(default=0, ge=-MAX_AMOUNT, le=MAX_AMOUNT, description="Amount in microcents")
+    liability: Optional[int] = Field(default=0, ge=-MAX_AMOUNT, le=MAX_AMOUNT, description="Amount in microcents")
     currency: str = Field(min_length=1, max_length=3, json_schema_extra={"example": "USD"})
     tags: Optional[list[TagModel]] = Field(default_factory=list)
 
@@ -23,6 +31,42 @@ class Payment(PaymentInput):
     attachment: str = ""
 
 
+class PaymentInGroup(Payment):
+    paygroup_id: int
+
+
+class PaymentPage(BaseModel):
+    payments: list[PaymentInGroup]
+    next_cursor: Optional[str] = Field(default=None, description="Pass as `cursor` to get the next page")
+
+
+class Totals(BaseModel):
+    count: int
+    asset: int = Field(description="Sum in microcents")
+    liability: int = Field(description="Sum in microcents")
+
+
+class ProjectTotals(BaseModel):
+    currencies: dict[str, Totals]
+    paygroups: dict[int, dict[str, Totals]] = Field(description="Per paygroup id, then per currency")
+    tags: dict[str, dict[str, Totals]] = Field(description="Per tag name, then per currency")
+    months: dict[str, dict[str, Totals]] = Field(description="Per YYYY-MM, then per currency")
+
+
+class ReportRow(BaseModel):
+    period: str = Field(description="YYYY-MM-DD, YYYY-MM or YYYY")
+    currency: str
+    tag: Optional[str] = Field(default=None, description="Set when rows are broken down by tag")
+    count: int
+    asset: int = Field(description="Sum in microcents")
+    liability: int = Field(description="Sum in microcents")
+
+
+class Report(BaseModel):
+    granularity: str
+    rows: list[ReportRow]
+
+
 class PaygroupInput(BaseModel):
     name: str = Field(min_length=1, max_length=255, json_schema_extra={"example": "Renovation Expenses"})
 
@@ -32,6 +76,36 @@ class Paygroup(PaygroupInput):
     payments: list[Payment] = []
 
 
+class PaygroupInfo(PaygroupInput):
+    id: int
+
+
+class PaymentRef(BaseModel):
+    paygroup_id: int
+    id: int
+
+
+class ProjectChanges(BaseModel):
+    version: int = Field(description="Pass as `since` to get the changes made after this response")
+    reset: bool = Field(description="The changes cannot be told; fetch the whole project again")
+    paygroups: list[PaygroupInfo] = Field(description="Paygroups added or renamed, without their payments")
+    payments: list[PaymentInGroup] = Field(description="Payments added or changed, as they are now")
+    deleted_paygroups: list[int]
+    deleted_payments: list[PaymentRef] = Field(description="Payments deleted from paygroups that still exist")
+
+
+class Change(BaseModel):
+    """
+    One change made to a project's paygroups: an item was added (no `before`), deleted (no `after`) or updated.
+    Changes to a paygroup itself have no payment_id and carry the paygroup without its payments.
+    """
+
+    paygroup_id: int
+    payment_id: Optional[int] = None
+    before: Optional[Union[Payment, Paygroup]] = None
+    after: Optional[Union[Payment, Paygroup]] = None
+
+
 class ProjectInput(BaseModel):
     name: str = Field(min_length=1, max_length=255, json_schema_extra={"example": "Household Budget"})
 
@@ -48,6 +122,13 @@ class ProjectWithPayments(ProjectResponse):
     paygroups: list[Paygroup]
 
 
+class ProjectState(BaseModel):
+    """A past state of a project; it holds only what history keeps, so it never changes."""
+
+    id: int
+    paygroups: list[Paygroup]
+
+
 class ProjectEncoder(json.JSONEncoder):
     def default(self, obj):
         if issubclass(type(obj), BaseModel):
@@ -59,3 +140,14 @@ class ProjectEncoder(json.JSONEncoder):
 
 class NewItemResponse(BaseModel):
     id: int
+
+
+class ImportResponse(BaseModel):
+    imported: int
+    ids: list[int]
+
+
+class AttachmentResponse(BaseModel):
+    file_name: str
+    size: int = Field(description="Size of the stored file in bytes")
+    sha256: str = Field(description="Hex SHA-256 of the stored file")
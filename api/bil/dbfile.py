@@ -1,15 +1,175 @@
-from bil.datamodels import Payment, PaymentInput, Paygroup, Project, ProjectEncoder, ProjectWithPayments, TagModel
+from bil.atomic import SyncPolicy, atomic_write
+from bil.cache import FileCache, LRUCache, file_signature, files_signature, state_tag
+from bil.columns import PaymentColumns
+from bil.events import attachment_event, broadcaster, change_event, sync_event
+from bil.history import History, get_history
+from bil.locks import FileLocks
+from bil.search import PaymentIndex, decode_cursor, encode_cursor
+from bil.rollups import PaymentRollups
+from bil.tags import TagCatalog
+from bil.totals import PaymentTotals
+from bil.uploads import stage_upload
+from bil.datamodels import (
+    Change,
+    Payment,
+    PaymentInGroup,
+    PaymentInput,
+    PaymentPage,
+    Paygroup,
+    Project,
+    ProjectEncoder,
+    ProjectResponse,
+    ProjectState,
+    ProjectWithPayments,
+)
 import os
-import shutil
 import json
-from typing import Mapping
+import re
+import threading
+import time
+from contextlib import ExitStack
+from datetime import date
+from typing import Any, Callable, ContextManager, Iterable, Iterator, Mapping, Optional
 from fastapi import UploadFile
-import glob
+
+_attachment_pattern = re.compile(r"^(\d+_\d+)\.")
+
+# shared by all adaptor instances in the process, so per-request adaptors still hit warm data
+_projects_cache = FileCache(max_files=8)
+_payments_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+_search_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+_columns_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+_totals_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+_rollups_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+_tags_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+# in-memory views built from a project's payments and kept current with `apply(changes)`
+_view_caches = (_columns_cache, _totals_cache, _rollups_cache, _tags_cache)
+_attachments_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+_change_log_cache = FileCache(max_files=int(os.environ.get("BIL_CACHED_PROJECTS", 32)))
+# past states never change, so they stay valid for as long as they are kept
+_states_cache = LRUCache(max_size=int(os.environ.get("BIL_CACHED_STATES", 16)))
+_locks = FileLocks()
+_journal_compact_bytes = int(os.environ.get("BIL_JOURNAL_COMPACT_BYTES", 1024 * 1024))
+_change_log_entries = int(os.environ.get("BIL_CHANGE_LOG_ENTRIES", 1000))
+_max_upload_bytes = int(os.environ.get("BIL_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+_index_save_interval = int(os.environ.get("BIL_INDEX_SAVE_INTERVAL_MS", 5000)) / 1000
+# search indexes changed in memory since they were last saved: index path -> (first change time, project id)
+_unsaved_indexes: dict[str, tuple[float, int]] = {}
+_unsaved_indexes_lock = threading.Lock()
+_default_sync = SyncPolicy(
+    os.environ.get("BIL_FSYNC", "always"), interval_ms=int(os.environ.get("BIL_FSYNC_INTERVAL_MS", 1000))
+)
+_default_history = get_history(
+    os.environ.get("BIL_HISTORY", "snapshot"),
+    interval_ms=int(os.environ.get("BIL_COMMIT_INTERVAL_MS", 0)),
+    commit_every=int(os.environ.get("BIL_COMMIT_EVERY", 0)),
+)
+
+
+def _parse_projects(path: str) -> dict[int, Project]:
+    with open(path, "r") as f:
+        return {int(k): Project(**v) for k, v in json.load(f).items()}
+
+
+def _parse_paygroups(path: str) -> dict[int, Paygroup]:
+    with open(path, "r") as f:
+        return {int(k): Paygroup(**v) for k, v in json.load(f).items()}
+
+
+def _parse_columns(path: str) -> PaymentColumns:
+    with open(path, "r") as f:
+        groups = json.load(f).values()
+    return PaymentColumns.from_records((group["id"], pay) for group in groups for pay in group["payments"])
+
+
+def _apply_changes(paygroups: dict[int, Paygroup], changes: list[dict]):
+    """
+    Replays changes recorded by ProjectTransaction, in their json form, onto freshly parsed paygroups.
+    Replaying changes the paygroups already include leaves them as they are, which is what happens
+    when a crash interrupts compaction after payments.json was replaced but before the journal was removed.
+    """
+    for change in changes:
+        paygroup_id, payment_id, after = change["paygroup_id"], change["payment_id"], change["after"]
+        if payment_id is None and after is None:
+            paygroups.pop(paygroup_id, None)
+        elif payment_id is None and paygroup_id in paygroups:
+            paygroups[paygroup_id].name = after["name"]
+        elif payment_id is None:
+            paygroups[paygroup_id] = Paygroup(**after)
+        elif paygroup_id in paygroups:
+            payments = paygroups[paygroup_id].payments
+            position = next((i for i, p in enumerate(payments) if p.id == payment_id), None)
+            if after is None and position is not None:
+                del payments[position]
+            elif after is None:
+                continue
+            elif position is None:
+                payments.append(Payment(**after))
+            else:
+                payments[position] = Payment(**after)
+
+
+def _replay_journal(paygroups: dict[int, Paygroup], lines: Iterable[str]) -> dict[int, Paygroup]:
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            changes = json.loads(line)
+        except ValueError:
+            # only the last record can be torn, by a crash while it was being appended
+            break
+        _apply_changes(paygroups, changes)
+    return paygroups
+
+
+# a paygroup (no payment id) or payment touched by a change
+ItemKey = tuple[int, Optional[int]]
+# (version, items touched by it), where None means anything may have changed
+ChangeLogEntry = tuple[int, Optional[list[ItemKey]]]
+
+
+def _parse_change_log(path: str) -> list[ChangeLogEntry]:
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                items = entry["items"]
+                entries.append((entry["version"], None if items is None else [tuple(item) for item in items]))
+            except ValueError:
+                # a record torn by a crash; whatever it named is unknown
+                entries.append((entries[-1][0] + 1 if entries else 1, None))
+    return entries
+
+
+def _scan_attachments(path: str) -> dict[str, str]:
+    """Maps "<group id>_<payment id>" to the attachment's file name; the newest file wins if there are several."""
+    attachments: dict[str, os.DirEntry] = {}
+    for entry in os.scandir(path):
+        match = _attachment_pattern.match(entry.name)
+        if not match or not entry.is_file():
+            continue
+        key = match.group(1)
+        current = attachments.get(key)
+        if current is None or entry.stat().st_mtime_ns >= current.stat().st_mtime_ns:
+            attachments[key] = entry
+    return {key: entry.name for key, entry in attachments.items()}
 
 
 class DBAdaptor:
-    def __init__(self, path, keep_history=True):
-        self.__keep_history = keep_history
+    def __init__(
+        self,
+        path,
+        keep_history=True,
+        history: Optional[History] = None,
+        journal: Optional[bool] = None,
+        sync: Optional[SyncPolicy] = None,
+    ):
+        self._history = (history or _default_history) if keep_history else History()
+        self._sync = sync or _default_sync
+        self._journal = journal if journal is not None else os.environ.get("BIL_JOURNAL", "") == "1"
         self._base = path
         self._db_path = os.path.join(self._base, "projects.json")
 
@@ -17,12 +177,8 @@ class DBAdaptor:
         return os.path.join(self._base, f"projects/{project_id}")
 
     def _get_projects_dict(self, include_deleted: bool = False) -> dict[int, Project]:
-        projects = {}
-        if os.path.exists(self._db_path):
-            with open(self._db_path, "r") as f:
-                projects = json.load(f)
-                projects = {int(k): Project(**v) for k, v in projects.items() if not v["is_deleted"] or include_deleted}
-        return projects
+        projects = _projects_cache.load(self._db_path, _parse_projects) or {}
+        return {k: v for k, v in projects.items() if not v.is_deleted or include_deleted}
 
     @property
     def _projects_dict(self) -> dict[int, Project]:
@@ -35,9 +191,33 @@ class DBAdaptor:
     def _get_payfile_path(self, project_id: int) -> str:
         return os.path.join(self._get_project_path(project_id), "payments.json")
 
+    def _get_journal_path(self, project_id: int) -> str:
+        return os.path.join(self._get_project_path(project_id), "payments.journal")
+
+    def _get_payments_signature(self, project_id: int) -> list:
+        journal_path = self._get_journal_path(project_id)
+        return json.loads(json.dumps(files_signature(self._get_payfile_path(project_id), (journal_path,))))
+
+    def _lock(self, name: str, exclusive: bool = False) -> ContextManager[None]:
+        """Reader/writer lock on a project (by id) or on the project list (`projects`), across threads and workers."""
+        return _locks.hold(os.path.join(self._base, "locks", f"{name}.lock"), exclusive)
+
+    def _read_paygroups_file(self, project_id: int) -> dict[int, Paygroup]:
+        paygroups = _parse_paygroups(self._get_payfile_path(project_id))
+        journal_path = self._get_journal_path(project_id)
+        if not os.path.exists(journal_path):
+            return paygroups
+        with open(journal_path, "r") as f:
+            return _replay_journal(paygroups, f)
+
     def _save_projects(self, projects: dict[int, Project]):
-        with open(self._db_path, "w") as f:
-            json.dump(projects, f, cls=ProjectEncoder, indent=4)
+        try:
+            with atomic_write(self._db_path, self._sync) as f:
+                json.dump(projects, f, cls=ProjectEncoder, indent=4)
+        except Exception:
+            _projects_cache.invalidate(self._db_path)
+            raise
+        _projects_cache.store(self._db_path, dict(projects))
 
     def _get_next_id(self, items: Mapping[int, Project | Paygroup]) -> int:
         if not items:
@@ -50,46 +230,147 @@ class DBAdaptor:
         self.__repo_init(project_id)
 
     def __repo_init(self, project_id: int):
-        if not self.__keep_history:
-            return
-        project_path = self._get_project_path(project_id)
-        os.system(f"git -C {project_path} init")
+        self._history.init(self._get_project_path(project_id))
 
     def __repo_commit(self, project_id: int):
-        if not self.__keep_history:
-            return
-        project_path = self._get_project_path(project_id)
-        os.system(f"git -C {project_path} add .")
-        os.system(f"git -C {project_path} commit -m 'updated'")
-
-    def __repo_checkout(self, project_id: int, commit_id: str):
-        if not self.__keep_history:
-            return
-        project_path = self._get_project_path(project_id)
-        os.system(f"git -C {project_path} checkout {commit_id}")
+        self._history.commit(self._get_project_path(project_id))
 
-    def __repo_list(self, project_id: int) -> list[dict]:
-        if not self.__keep_history:
-            return []
-        project_path = self._get_project_path(project_id)
-        resp = os.popen(f'git -C {project_path} log --format="%h|%ad"').read().splitlines()
-        return [{"id": x.split("|")[0], "date": x.split("|")[1]} for x in resp]
+    def _attachments_changed(self, project_id: int, paygroup_id: int, payment_id: int):
+        version = self._log_changes(project_id, [(paygroup_id, payment_id)])
+        if broadcaster.has_subscribers(project_id):
+            attachment = self._get_attachment(project_id, paygroup_id, payment_id)
+            broadcaster.publish(project_id, version, attachment_event(version, [(paygroup_id, payment_id, attachment)]))
+        self.__repo_commit(project_id)
 
-    def _save_paygroups(self, project_id: int, paygroups: dict[int, Paygroup]):
+    def _publish_changes(self, project_id: int, version: int, changes: Optional[list[Change]]):
+        """Pushes saved changes to the project's live subscribers; a full save only tells them to catch up."""
+        if broadcaster.has_subscribers(project_id):
+            event = sync_event(version) if changes is None else change_event(version, changes)
+            broadcaster.publish(project_id, version, event)
+
+    def _get_change_log_path(self, project_id: int) -> str:
+        return os.path.join(self._base, "changes", f"{project_id}.log")
+
+    def _get_change_log(self, project_id: int) -> list[ChangeLogEntry]:
+        return _change_log_cache.load(self._get_change_log_path(project_id), _parse_change_log) or []
+
+    def _log_changes(self, project_id: int, items: Optional[list[ItemKey]]) -> int:
+        """
+        Records the next project version in the change log, with the paygroups and payments it touched
+        (None if it could have touched anything). A new log starts with such an entry, since the project
+        may predate it. Once the log holds twice BIL_CHANGE_LOG_ENTRIES versions, the older half is dropped.
+        """
+        path = self._get_change_log_path(project_id)
+        entries = self._get_change_log(project_id)
+        new_entries = [] if entries else [(1, None)]
+        version = (entries or new_entries)[-1][0] + 1
+        new_entries.append((version, None if items is None else list(dict.fromkeys(items))))
+        entries = entries + new_entries
+        try:
+            if len(entries) > 2 * _change_log_entries:
+                entries = entries[-_change_log_entries:]
+                with atomic_write(path, self._sync) as f:
+                    f.writelines(json.dumps({"version": v, "items": i}) + "\n" for v, i in entries)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                records = "".join(json.dumps({"version": v, "items": i}) + "\n" for v, i in new_entries)
+                with open(path, "ab+") as f:
+                    if f.seek(0, os.SEEK_END):
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            # start after a torn record rather than on the same line
+                            records = "\n" + records
+                    f.write(records.encode())
+                    self._sync.written(path, f)
+                self._sync.committed(path, new_entry=len(entries) == len(new_entries))
+        except Exception:
+            _change_log_cache.invalidate(path)
+            raise
+        _change_log_cache.store(path, entries)
+        return version
+
+    def get_version(self, project_id: int) -> int:
+        """The project's current version, as counted by its change log."""
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        entries = self._get_change_log(project_id)
+        return entries[-1][0] if entries else 0
+
+    def _changed_items(self, project_id: int, since: int) -> tuple[int, Optional[set[ItemKey]]]:
+        """The current version and the items touched after version `since`, or None if that cannot be told."""
+        entries = self._get_change_log(project_id)
+        version = entries[-1][0] if entries else 0
+        if not entries or since > version or since < entries[0][0] - 1:
+            return version, None
+        items = set()
+        for entry_version, entry_items in reversed(entries):
+            if entry_version <= since:
+                break
+            if entry_items is None:
+                return version, None
+            items.update(entry_items)
+        return version, items
+
+    def _get_attachments(self, project_id: int) -> dict[str, str]:
+        return _attachments_cache.load(self._get_project_path(project_id), _scan_attachments) or {}
+
+    def _get_attachment(self, project_id: int, group_id: int, pay_id: int) -> str:
+        return self._get_attachments(project_id).get(f"{group_id}_{pay_id}", "")
+
+    def _get_index_path(self, project_id: int) -> str:
+        return os.path.join(self._base, "indexes", f"{project_id}.json")
+
+    def _save_paygroups(self, project_id: int, paygroups: dict[int, Paygroup], changes: Optional[list[Change]] = None):
+        """
+        Persists paygroups after `changes` were made to them. In journal mode the changes are appended to
+        payments.journal, until the journal outgrows BIL_JOURNAL_COMPACT_BYTES and is folded into payments.json.
+        """
         payfile_path = self._get_payfile_path(project_id)
-        with open(payfile_path, "w") as f:
-            json.dump(paygroups, f, cls=ProjectEncoder, indent=2)
+        journal = (self._get_journal_path(project_id),)
+        index = _search_cache.get(payfile_path, journal)
+        views = [(cache, cache.get(payfile_path, journal)) for cache in _view_caches]
+        journal_size = os.path.getsize(journal[0]) if os.path.exists(journal[0]) else 0
+        append = self._journal and changes is not None and journal_size < _journal_compact_bytes
+        try:
+            if append and os.path.exists(payfile_path):
+                record = json.dumps([change.model_dump(mode="json") for change in changes])
+                with open(journal[0], "a") as f:
+                    f.write(record + "\n")
+                    self._sync.written(journal[0], f)
+                self._sync.committed(journal[0], new_entry=not journal_size)
+            else:
+                with atomic_write(payfile_path, self._sync) as f:
+                    json.dump(paygroups, f, cls=ProjectEncoder, indent=2)
+                if journal_size:
+                    os.remove(journal[0])
+        except Exception:
+            _payments_cache.invalidate(payfile_path)
+            raise
+        _payments_cache.store(payfile_path, dict(paygroups), journal)
+        version = self._log_changes(
+            project_id, None if changes is None else [(c.paygroup_id, c.payment_id) for c in changes]
+        )
+        self._publish_changes(project_id, version, changes)
+        for cache, view in views:
+            if view is not None and changes is not None:
+                view.apply(changes)
+                cache.store(payfile_path, view, journal)
+        if index is not None and changes is not None:
+            index.apply(changes)
+            _search_cache.store(payfile_path, index, journal)
+            # saving rewrites the whole index, so it is left to `flush_writes` rather than done on every change
+            with _unsaved_indexes_lock:
+                _unsaved_indexes.setdefault(self._get_index_path(project_id), (time.monotonic(), project_id))
         self.__repo_commit(project_id)
 
     def _get_paygroups_dict(self, project_id: int) -> dict[int, Paygroup]:
         if project_id not in self._projects_dict:
             raise ItemNotFoundError
-        groups = {}
         payfile_path = self._get_payfile_path(project_id)
-        if os.path.exists(payfile_path):
-            with open(self._get_payfile_path(project_id), "r") as f:
-                groups = json.load(f)
-        return {int(k): Paygroup(**v) for k, v in groups.items()}
+        journal = (self._get_journal_path(project_id),)
+        with self._lock(project_id):
+            paygroups = _payments_cache.load(payfile_path, lambda _: self._read_paygroups_file(project_id), journal)
+        return dict(paygroups or {})
 
     def _get_paygroup(self, project_id: int, group_id: int) -> Paygroup:
         groups = self._get_paygroups_dict(project_id)
@@ -107,159 +388,527 @@ class DBAdaptor:
         return list(self._projects_dict.values())
 
     def add_project(self, name: str) -> int:
-        projects = self._all_projects_dict
-        new_id = self._get_next_id(projects)
-        new_project = Project(name=name, id=new_id)
-        self._mk_project_dir(new_id)
-        projects[new_id] = new_project
-        self._save_projects(projects)
+        with self._lock("projects", exclusive=True):
+            projects = self._all_projects_dict
+            new_id = self._get_next_id(projects)
+            new_project = Project(name=name, id=new_id)
+            self._mk_project_dir(new_id)
+            projects[new_id] = new_project
+            self._save_projects(projects)
         return new_id
 
-    def delete_project(self, project_id: int):
-        projects = self._projects_dict
-        if project_id not in projects:
+    def _update_project(self, project_id: int, include_deleted: bool = False, **fields):
+        """Saves a copy of the project with `fields` changed; the cached one may be in use by other threads."""
+        projects = self._all_projects_dict
+        if project_id not in self._get_projects_dict(include_deleted):
             raise ItemNotFoundError
-        projects[project_id].is_deleted = True
+        projects[project_id] = projects[project_id].model_copy(update=fields)
         self._save_projects(projects)
 
+    def delete_project(self, project_id: int):
+        with self._lock("projects", exclusive=True):
+            self._update_project(project_id, is_deleted=True)
+
     def restore_project(self, project_id: int):
-        projects = self._get_projects_dict(include_deleted=True)
-        if project_id not in projects:
-            raise ItemNotFoundError
-        projects[project_id].is_deleted = False
-        self._save_projects(projects)
+        with self._lock("projects", exclusive=True):
+            self._update_project(project_id, include_deleted=True, is_deleted=False)
 
-    def get_project(self, project_id: int) -> ProjectWithPayments:
-        def find_attachments(project_id: int, group_id: int, pay_id: int) -> str:
-            attachments = glob.glob(os.path.join(self._get_project_path(project_id), f"{group_id}_{pay_id}.*"))
-            file_name = ""
-            if attachments:
-                file_name = os.path.basename(attachments[0])
-            return file_name
+    def _with_attachments(
+        self, groups: dict[int, Paygroup], find_attachment: Callable[[int, int], str]
+    ) -> list[Paygroup]:
+        paygroups = []
+        for group in groups.values():
+            payments = [
+                pay.model_copy(update={"attachment": find_attachment(group.id, pay.id)}) for pay in group.payments
+            ]
+            paygroups.append(group.model_copy(update={"payments": payments}))
+        return paygroups
+
+    def get_state_tag(self, project_id: Optional[int] = None) -> str:
+        """
+        Opaque tag of the stored state behind the project list or, given `project_id`, behind one project and its
+        history. It changes whenever that state does and comes from file metadata alone, without reading the data.
+        """
+        state = [file_signature(self._db_path)]
+        if project_id is not None:
+            if project_id not in self._projects_dict:
+                raise ItemNotFoundError
+            project_path = self._get_project_path(project_id)
+            state += [
+                files_signature(self._get_payfile_path(project_id), (self._get_journal_path(project_id),)),
+                # attachments are files in the project folder, so adding or removing one changes the folder
+                file_signature(project_path),
+                self._history.version(project_path),
+            ]
+        return state_tag(state)
 
+    def get_project(self, project_id: int) -> ProjectWithPayments:
         projects = self._projects_dict
         if project_id not in projects:
             raise ItemNotFoundError
-        project = ProjectWithPayments(**projects[project_id].model_dump(), paygroups=[])
-        groups = {}
-        payfile_path = self._get_payfile_path(project_id)
-        if os.path.exists(payfile_path):
-            with open(payfile_path, "r") as f:
-                groups = json.load(f)
-        for group in groups.values():
-            for pay in group["payments"]:
-                pay["attachment"] = find_attachments(project_id, group["id"], pay["id"])
-        project.paygroups = [Paygroup(**v) for v in groups.values()]
-        return project
-
-    def update_project(self, project_id: int, name: str):
+        attachments = self._get_attachments(project_id)
+        paygroups = self._with_attachments(
+            self._get_paygroups_dict(project_id),
+            lambda group_id, pay_id: attachments.get(f"{group_id}_{pay_id}", ""),
+        )
+        return ProjectWithPayments(**projects[project_id].model_dump(), paygroups=paygroups)
+
+    def stream_project(self, project_id: int, chunk_size: int = 500) -> Iterator[str]:
+        """
+        Same document as `get_project`, serialized piece by piece so the whole project never has to be
+        built or held as one JSON string. Raises ItemNotFoundError right away rather than mid-stream.
+        """
         projects = self._projects_dict
         if project_id not in projects:
             raise ItemNotFoundError
-        projects[project_id].name = name
-        self._save_projects(projects)
+        project = ProjectResponse(**projects[project_id].model_dump())
+        groups = self._get_paygroups_dict(project_id)
+        attachments = self._get_attachments(project_id)
+
+        def generate() -> Iterator[str]:
+            yield project.model_dump_json()[:-1] + ',"paygroups":['
+            for group_index, group in enumerate(groups.values()):
+                yield ("," if group_index else "") + group.model_dump_json(exclude={"payments"})[:-1] + ',"payments":['
+                for start in range(0, len(group.payments), chunk_size):
+                    end = start + chunk_size
+                    yield ("," if start else "") + ",".join(
+                        pay.model_copy(
+                            update={"attachment": attachments.get(f"{group.id}_{pay.id}", "")}
+                        ).model_dump_json()
+                        for pay in group.payments[start:end]
+                    )
+                yield "]}"
+            yield "]}"
+
+        return generate()
+
+    def iter_payments(self, project_id: int, paygroup_id: Optional[int] = None) -> Iterator[tuple[Paygroup, Payment]]:
+        """
+        (paygroup, payment) pairs of a whole project, or of one paygroup, in storage order.
+        Raises ItemNotFoundError right away rather than on the first `next`.
+        """
+        groups = self._get_paygroups_dict(project_id)
+        if paygroup_id is not None:
+            groups = {paygroup_id: self._get_paygroup(project_id, paygroup_id)}
+        return ((group, pay) for group in groups.values() for pay in group.payments)
+
+    def update_project(self, project_id: int, name: str):
+        with self._lock("projects", exclusive=True):
+            self._update_project(project_id, name=name)
+
+    def _get_columns(self, project_id: int) -> PaymentColumns:
+        """
+        The project's payments as columns, read straight from payments.json unless the paygroups are loaded
+        already or there is a journal to replay, so read-only requests never build a model per payment.
+        """
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        payfile_path = self._get_payfile_path(project_id)
+        journal = (self._get_journal_path(project_id),)
+
+        def load(path: str) -> PaymentColumns:
+            if _payments_cache.get(path, journal) is None and not os.path.exists(journal[0]):
+                return _parse_columns(path)
+            return PaymentColumns.build(self._get_paygroups_dict(project_id))
+
+        with self._lock(project_id):
+            return _columns_cache.load(payfile_path, load, journal) or PaymentColumns()
+
+    def _get_payment_index(self, project_id: int) -> PaymentIndex:
+        columns = self._get_columns(project_id)
+        with self._lock(project_id):
+            return self._load_payment_index(project_id, columns)
+
+    def _load_payment_index(self, project_id: int, columns: PaymentColumns) -> PaymentIndex:
+        index_path = self._get_index_path(project_id)
+
+        def load(payfile_path: str) -> PaymentIndex:
+            signature = self._get_payments_signature(project_id)
+            index = PaymentIndex.load(index_path, signature)
+            if index is None:
+                index = PaymentIndex.build(columns)
+                index.save(index_path, signature)
+            return index
 
-    def get_tags(self, project_id: int) -> list[TagModel]:
-        project = self.get_project(project_id)
-        tags = []
-        for group in project.paygroups:
-            for payment in group.payments:
-                if payment.tags:
-                    tags.extend(payment.tags)
-        return tags
+        journal = (self._get_journal_path(project_id),)
+        return _search_cache.load(self._get_payfile_path(project_id), load, journal) or PaymentIndex()
+
+    def _get_view(self, cache: FileCache, build: Callable[[PaymentColumns], Any], project_id: int) -> Any:
+        payfile_path = self._get_payfile_path(project_id)
+        journal = (self._get_journal_path(project_id),)
+        columns = self._get_columns(project_id)
+        return cache.load(payfile_path, lambda _: build(columns), journal) or build(PaymentColumns())
+
+    def _get_totals(self, project_id: int) -> PaymentTotals:
+        return self._get_view(_totals_cache, PaymentTotals.build, project_id)
+
+    def _get_rollups(self, project_id: int) -> PaymentRollups:
+        return self._get_view(_rollups_cache, PaymentRollups.build, project_id)
+
+    def _get_tag_catalog(self, project_id: int) -> TagCatalog:
+        return self._get_view(_tags_cache, TagCatalog.build, project_id)
+
+    def get_totals(self, project_id: int) -> dict:
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        with self._lock(project_id):
+            return self._get_totals(project_id).as_dict()
+
+    def get_report(
+        self,
+        project_id: int,
+        granularity: str,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        currency: Optional[str] = None,
+        tag: Optional[str] = None,
+        by_tag: bool = False,
+    ) -> list[dict]:
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        with self._lock(project_id):
+            return self._get_rollups(project_id).query(granularity, date_from, date_to, currency, tag, by_tag)
+
+    def find_payments(
+        self,
+        project_id: int,
+        name: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        tag: Optional[str] = None,
+        currency: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+    ) -> PaymentPage:
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        with self._lock(project_id):
+            columns = self._get_columns(project_id)
+            found, next_key = self._get_payment_index(project_id).find(
+                name=name,
+                date_from=date_from,
+                date_to=date_to,
+                tag=tag,
+                currency=currency,
+                after=decode_cursor(cursor) if cursor else None,
+                limit=limit,
+            )
+            found = [(group_id, columns.payment(columns.find_row(group_id, pay_id))) for _, group_id, pay_id in found]
+        attachments = self._get_attachments(project_id)
+        payments = [
+            PaymentInGroup(
+                **pay.model_dump(exclude={"attachment"}),
+                paygroup_id=group_id,
+                attachment=attachments.get(f"{group_id}_{pay.id}", ""),
+            )
+            for group_id, pay in found
+        ]
+        return PaymentPage(payments=payments, next_cursor=encode_cursor(next_key) if next_key else None)
+
+    def get_changes(self, project_id: int, since: int) -> dict:
+        """
+        What changed in a project after version `since`: the current state of every paygroup (without payments)
+        and payment added or changed since, the ids of the ones deleted, and the version to ask from next time.
+        With `reset` the changes cannot be told, because `since` is unknown or too old, and the whole project
+        has to be fetched again.
+        """
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        with self._lock(project_id):
+            version, items = self._changed_items(project_id, since)
+            paygroups = self._get_paygroups_dict(project_id) if items else {}
+            attachments = self._get_attachments(project_id) if items else {}
+        changes = {"version": version, "reset": items is None, "paygroups": [], "payments": []}
+        changes.update(deleted_paygroups=[], deleted_payments=[])
+        payments: dict[int, dict[int, Payment]] = {}
+        for paygroup_id, payment_id in sorted(items or (), key=lambda item: (item[0], item[1] or 0)):
+            group = paygroups.get(paygroup_id)
+            if payment_id is None and group is None:
+                changes["deleted_paygroups"].append(paygroup_id)
+            elif payment_id is None:
+                changes["paygroups"].append({"id": group.id, "name": group.name})
+            elif group is None:
+                # deleting the paygroup covers its payments
+                continue
+            elif payment_id not in payments.setdefault(paygroup_id, {p.id: p for p in group.payments}):
+                changes["deleted_payments"].append({"paygroup_id": paygroup_id, "id": payment_id})
+            else:
+                pay = payments[paygroup_id][payment_id]
+                attachment = attachments.get(f"{paygroup_id}_{payment_id}", "")
+                changes["payments"].append(
+                    PaymentInGroup(
+                        **pay.model_dump(exclude={"attachment"}), paygroup_id=paygroup_id, attachment=attachment
+                    )
+                )
+        return changes
+
+    def get_tags(self, project_id: int, prefix: Optional[str] = None) -> list[dict]:
+        """Distinct tags with the number of payments using each, sorted by name and optionally by name prefix."""
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        with self._lock(project_id):
+            return self._get_tag_catalog(project_id).find(prefix)
+
+    def _transaction(self, project_id: int) -> "ProjectTransaction":
+        return ProjectTransaction(self, project_id)
 
     def add_paygroup(self, project_id: int, name: str) -> int:
-        paygroups = self._get_paygroups_dict(project_id)
-        new_id = self._get_next_id(paygroups)
-        new_paygroup = Paygroup(id=new_id, name=name)
-        paygroups[new_id] = new_paygroup
-        self._save_paygroups(project_id, paygroups)
-        return new_id
+        with self._transaction(project_id) as tx:
+            return tx.add_paygroup(name)
 
     def get_paygroups(self, project_id: int) -> list[Paygroup]:
         return list(self._get_paygroups_dict(project_id).values())
 
     def delete_paygroup(self, project_id: int, paygroup_id: int):
-        groups = self._get_paygroups_dict(project_id)
-        if paygroup_id not in groups:
-            raise ItemNotFoundError
-        del groups[paygroup_id]
-        self._save_paygroups(project_id, groups)
+        with self._transaction(project_id) as tx:
+            tx.delete_paygroup(paygroup_id)
 
     def update_paygroup(self, project_id: int, paygroup_id: int, name: str):
-        groups = self._get_paygroups_dict(project_id)
-        if paygroup_id not in groups:
-            raise ItemNotFoundError
-        groups[paygroup_id].name = name
-        self._save_paygroups(project_id, groups)
+        with self._transaction(project_id) as tx:
+            tx.update_paygroup(paygroup_id, name)
 
     def add_payment(self, project_id: int, paygroup_id: int, payment: PaymentInput) -> int:
-        paygroup = self._get_paygroup(project_id, paygroup_id)
-        payments = self._get_payments_dict(project_id, paygroup_id)
-        new_id = self._get_next_id(payments)
-        paygroup.payments.append(Payment(**payment.model_dump(), id=new_id))
-        groups = {**self._get_paygroups_dict(project_id), paygroup_id: paygroup}
-        self._save_paygroups(project_id, groups)
-        return new_id
+        with self._transaction(project_id) as tx:
+            return tx.add_payment(paygroup_id, payment)
+
+    def add_payments(self, project_id: int, paygroup_id: int, payments: list[PaymentInput]) -> list[int]:
+        """Adds all payments with one write and one history commit, returning their ids in order."""
+        with self._transaction(project_id) as tx:
+            return tx.add_payments(paygroup_id, payments)
 
     def delete_payment(self, project_id: int, paygroup_id: int, pay_id: int):
-        groups = self._get_paygroups_dict(project_id)
-        payments = self._get_payments_dict(project_id, paygroup_id)
-        if pay_id not in payments:
-            raise ItemNotFoundError
-        del payments[pay_id]
-        groups[paygroup_id].payments = list(payments.values())
-        self._save_paygroups(project_id, groups)
+        with self._transaction(project_id) as tx:
+            tx.delete_payment(paygroup_id, pay_id)
 
     def update_payment(self, project_id: int, paygroup_id: int, payment: Payment):
-        groups = self._get_paygroups_dict(project_id)
-        payments = self._get_payments_dict(project_id, paygroup_id)
-        if payment.id not in payments:
-            raise ItemNotFoundError
-        payments[payment.id] = payment
-        groups[paygroup_id].payments = list(payments.values())
-        self._save_paygroups(project_id, groups)
-
-    def add_file_to_payment(self, project_id: int, paygroup_id: int, payment_id: int, file: UploadFile):
+        with self._transaction(project_id) as tx:
+            tx.update_payment(paygroup_id, payment)
+
+    def add_file_to_payment(self, project_id: int, paygroup_id: int, payment_id: int, file: UploadFile) -> dict:
+        """
+        Stores the upload as the payment's attachment and returns its file name, size and SHA-256. The upload is
+        copied to a temporary file outside the project first, so the project is only locked to move it into place;
+        one over BIL_MAX_UPLOAD_BYTES raises UploadTooLargeError and leaves nothing behind.
+        """
         payments = self._get_payments_dict(project_id, paygroup_id)
         if payment_id not in payments:
             raise ItemNotFoundError
         project_folder = self._get_project_path(project_id)
         extension = os.path.splitext(file.filename)[1]
-        file_name = os.path.join(project_folder, f"{paygroup_id}_{payment_id}{extension}")
-        with open(file_name, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-        self.__repo_commit(project_id)
+        file_name = f"{paygroup_id}_{payment_id}{extension}"
+        file_path = os.path.join(project_folder, file_name)
+        # staged outside the project folder, where history commits would pick up a half-copied file
+        uploads = os.path.join(self._base, "uploads")
+        staged = stage_upload(file.file, uploads, file_path, self._sync, _max_upload_bytes)
+        try:
+            with self._lock(project_id, exclusive=True):
+                if payment_id not in self._get_payments_dict(project_id, paygroup_id):
+                    raise ItemNotFoundError
+                attachments = self._get_attachments(project_id)
+                os.replace(staged["path"], file_path)
+                self._sync.committed(file_path)
+                _attachments_cache.store(project_folder, {**attachments, f"{paygroup_id}_{payment_id}": file_name})
+                self._attachments_changed(project_id, paygroup_id, payment_id)
+        finally:
+            if os.path.exists(staged["path"]):
+                os.remove(staged["path"])
+        return {"file_name": file_name, "size": staged["size"], "sha256": staged["sha256"]}
 
     def get_files_from_payment(self, project_id: int, paygroup_id: int, payment_id: int) -> str:
         payments = self._get_payments_dict(project_id, paygroup_id)
         if payment_id not in payments:
             raise ItemNotFoundError
-        project_folder = self._get_project_path(project_id)
-        file_list = glob.glob(os.path.join(project_folder, f"{paygroup_id}_{payment_id}*"))
-        if len(file_list) == 0:
+        file_name = self._get_attachment(project_id, paygroup_id, payment_id)
+        if not file_name:
             raise ItemNotFoundError
-        return file_list[0]
+        return os.path.join(self._get_project_path(project_id), file_name)
 
     def delete_file_from_payment(self, project_id: int, paygroup_id: int, payment_id: int):
         payments = self._get_payments_dict(project_id, paygroup_id)
         if payment_id not in payments:
             raise ItemNotFoundError
-        project_folder = self._get_project_path(project_id)
-        file_list = glob.glob(os.path.join(project_folder, f"{paygroup_id}_{payment_id}*"))
-        if len(file_list) == 0:
-            raise ItemNotFoundError
-        os.remove(file_list[0])
-        self.__repo_commit(project_id)
+        with self._lock(project_id, exclusive=True):
+            file_name = self._get_attachment(project_id, paygroup_id, payment_id)
+            if not file_name:
+                raise ItemNotFoundError
+            os.remove(os.path.join(self._get_project_path(project_id), file_name))
+            # another file may be left for the same payment, so rescan rather than patching the index
+            _attachments_cache.invalidate(self._get_project_path(project_id))
+            self._attachments_changed(project_id, paygroup_id, payment_id)
+
+    def flush_history(self, due_only: bool = False):
+        self._history.flush(due_only)
+
+    def flush_writes(self, due_only: bool = False):
+        self._sync.flush(due_only)
+        self._save_indexes(due_only)
+
+    def _save_indexes(self, due_only: bool = False):
+        """
+        Saves the search indexes changed since they were last saved, or with `due_only` those first changed
+        BIL_INDEX_SAVE_INTERVAL_MS ago. One that was dropped from memory meanwhile is not saved; its stale
+        file gets rebuilt when it is next needed.
+        """
+        now = time.monotonic()
+        with _unsaved_indexes_lock:
+            due = [
+                (path, project_id)
+                for path, (since, project_id) in _unsaved_indexes.items()
+                if path == self._get_index_path(project_id) and (not due_only or now - since >= _index_save_interval)
+            ]
+            for path, _ in due:
+                del _unsaved_indexes[path]
+        for path, project_id in due:
+            journal = (self._get_journal_path(project_id),)
+            with self._lock(project_id):
+                index = _search_cache.get(self._get_payfile_path(project_id), journal)
+                if index is not None:
+                    index.save(path, self._get_payments_signature(project_id))
 
     def get_project_history(self, project_id: int) -> list[dict]:
-        return self.__repo_list(project_id)
+        return self._history.log(self._get_project_path(project_id))
+
+    def _load_state_paygroups(self, project_path: str, commit_id: str) -> list[Paygroup]:
+        files = self._history.list_files(project_path, commit_id) or []
+        content = self._history.read_file(project_path, commit_id, "payments.json")
+        groups = {int(k): Paygroup(**v) for k, v in json.loads(content).items()} if content else {}
+        journal = (
+            self._history.read_file(project_path, commit_id, "payments.journal") if "payments.journal" in files else b""
+        )
+        _replay_journal(groups, (journal or b"").decode().splitlines())
+        attachments = {}
+        for file_name in files:
+            match = _attachment_pattern.match(file_name)
+            if match:
+                attachments.setdefault(match.group(1), file_name)
+        return self._with_attachments(groups, lambda group_id, pay_id: attachments.get(f"{group_id}_{pay_id}", ""))
+
+    def get_state_id(self, project_id: int, history_id: str) -> str:
+        """
+        Full id of a listed past state of the project, which names that state's contents and nothing else.
+        The full commit id hashes the files of the state, so it is not reused for other contents.
+        """
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        commit_id = self._history.resolve(self._get_project_path(project_id), history_id)
+        if commit_id is None:
+            raise ItemNotFoundError
+        return commit_id
+
+    def get_project_state(self, project_id: int, history_id: str) -> ProjectState:
+        commit_id = self.get_state_id(project_id, history_id)
+        project_path = self._get_project_path(project_id)
+        key = (os.path.abspath(project_path), commit_id)
+        paygroups = _states_cache.get(key)
+        if paygroups is None:
+            paygroups = self._load_state_paygroups(project_path, commit_id)
+            _states_cache.put(key, paygroups)
+        return ProjectState(id=project_id, paygroups=paygroups)
+
+
+class ProjectTransaction:
+    """
+    Unit of work over a single project's paygroups: loads them once, applies any number of mutations
+    in memory and persists them with one write (and one history commit) when the block exits cleanly.
+    Touched paygroups are copied before being changed, so an aborted transaction leaves cached data intact.
+    The project is write-locked from loading to saving, so concurrent transactions cannot lose each other's changes.
+    """
+
+    def __init__(self, db: DBAdaptor, project_id: int):
+        self._db = db
+        self.project_id = project_id
+        self.paygroups: dict[int, Paygroup] = {}
+        self.changes: list[Change] = []
+
+    def __enter__(self) -> "ProjectTransaction":
+        if self.project_id not in self._db._projects_dict:
+            raise ItemNotFoundError
+        with ExitStack() as stack:
+            stack.enter_context(self._db._lock(self.project_id, exclusive=True))
+            self.paygroups = self._db._get_paygroups_dict(self.project_id)
+            self._unlock = stack.pop_all()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._unlock:
+            if exc_type is None:
+                self.save()
+
+    def save(self):
+        if not self.changes:
+            return
+        self._db._save_paygroups(self.project_id, self.paygroups, self.changes)
+        self.changes = []
+
+    def get_paygroup(self, paygroup_id: int) -> Paygroup:
+        if paygroup_id not in self.paygroups:
+            raise ItemNotFoundError
+        return self.paygroups[paygroup_id]
+
+    def get_payment(self, paygroup_id: int, payment_id: int) -> Payment:
+        for payment in self.get_paygroup(paygroup_id).payments:
+            if payment.id == payment_id:
+                return payment
+        raise ItemNotFoundError
+
+    def _set_payments(self, paygroup_id: int, payments: list[Payment], *changes: Change):
+        self.paygroups[paygroup_id] = self.paygroups[paygroup_id].model_copy(update={"payments": payments})
+        self.changes.extend(changes)
+
+    def _set_paygroup(self, paygroup_id: int, paygroup: Optional[Paygroup]):
+        before = self.paygroups.get(paygroup_id)
+        if paygroup is None:
+            del self.paygroups[paygroup_id]
+        else:
+            self.paygroups[paygroup_id] = paygroup
+        self.changes.append(
+            Change(
+                paygroup_id=paygroup_id,
+                before=before.model_copy(update={"payments": []}) if before else None,
+                after=paygroup.model_copy(update={"payments": []}) if paygroup else None,
+            )
+        )
+
+    def add_paygroup(self, name: str) -> int:
+        new_id = self._db._get_next_id(self.paygroups)
+        self._set_paygroup(new_id, Paygroup(id=new_id, name=name))
+        return new_id
 
-    def get_project_state(self, project_id: int, history_id: str) -> ProjectWithPayments:
-        self.__repo_checkout(project_id, history_id)
-        project_state = self.get_project(project_id)
-        self.__repo_checkout(project_id, "master")
-        return project_state
+    def update_paygroup(self, paygroup_id: int, name: str):
+        self._set_paygroup(paygroup_id, self.get_paygroup(paygroup_id).model_copy(update={"name": name}))
+
+    def delete_paygroup(self, paygroup_id: int):
+        for payment in self.get_paygroup(paygroup_id).payments:
+            self.changes.append(Change(paygroup_id=paygroup_id, payment_id=payment.id, before=payment))
+        self._set_paygroup(paygroup_id, None)
+
+    def add_payment(self, paygroup_id: int, payment: PaymentInput) -> int:
+        return self.add_payments(paygroup_id, [payment])[0]
+
+    def add_payments(self, paygroup_id: int, payments: list[PaymentInput]) -> list[int]:
+        current = self.get_paygroup(paygroup_id).payments
+        first_id = max((p.id for p in current), default=0) + 1
+        new_payments = [Payment(**payment.model_dump(), id=first_id + i) for i, payment in enumerate(payments)]
+        self._set_payments(
+            paygroup_id,
+            [*current, *new_payments],
+            *(Change(paygroup_id=paygroup_id, payment_id=p.id, after=p) for p in new_payments),
+        )
+        return [p.id for p in new_payments]
+
+    def update_payment(self, paygroup_id: int, payment: Payment):
+        current = self.get_payment(paygroup_id, payment.id)
+        payments = [payment if p is current else p for p in self.paygroups[paygroup_id].payments]
+        self._set_payments(
+            paygroup_id, payments, Change(paygroup_id=paygroup_id, payment_id=payment.id, before=current, after=payment)
+        )
+
+    def delete_payment(self, paygroup_id: int, payment_id: int):
+        current = self.get_payment(paygroup_id, payment_id)
+        payments = [p for p in self.paygroups[paygroup_id].payments if p is not current]
+        self._set_payments(
+            paygroup_id, payments, Change(paygroup_id=paygroup_id, payment_id=payment_id, before=current)
+        )
 
 
 class ItemNotFoundError(Exception):
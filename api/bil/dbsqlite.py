@@ -0,0 +1,457 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Iterator, Optional
+from bil.cache import LRUCache, state_tag
+from bil.columns import PaymentColumns
+from bil.datamodels import Change, Payment, Paygroup, Project, ProjectState
+from bil.dbfile import DBAdaptor, ItemNotFoundError
+from bil.events import attachment_event, broadcaster
+from bil.history import format_date
+from bil.rollups import PaymentRollups
+from bil.search import PaymentIndex
+from bil.tags import TagCatalog
+from bil.totals import PaymentTotals
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    project_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (project_id, version)
+);
+CREATE TABLE IF NOT EXISTS paygroups (
+    project_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    valid_from INTEGER NOT NULL,
+    valid_to INTEGER
+);
+CREATE INDEX IF NOT EXISTS paygroups_by_version ON paygroups (project_id, valid_to, valid_from, id);
+CREATE TABLE IF NOT EXISTS payments (
+    project_id INTEGER NOT NULL,
+    paygroup_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    asset INTEGER,
+    liability INTEGER,
+    currency TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    valid_from INTEGER NOT NULL,
+    valid_to INTEGER
+);
+CREATE INDEX IF NOT EXISTS payments_by_version ON payments (project_id, valid_to, valid_from, paygroup_id, id);
+CREATE INDEX IF NOT EXISTS payments_by_id ON payments (project_id, paygroup_id, id) WHERE valid_to IS NULL;
+CREATE INDEX IF NOT EXISTS payments_by_date ON payments (project_id, date) WHERE valid_to IS NULL;
+CREATE TABLE IF NOT EXISTS attachments (
+    project_id INTEGER NOT NULL,
+    paygroup_id INTEGER NOT NULL,
+    payment_id INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    valid_from INTEGER NOT NULL,
+    valid_to INTEGER
+);
+CREATE INDEX IF NOT EXISTS attachments_by_version ON attachments (project_id, valid_to, valid_from);
+"""
+
+PAYMENT_COLUMNS = "id, name, date, asset, liability, currency, tags"
+_payment_fields = PAYMENT_COLUMNS.split(", ")
+EXPORT_PAGE_SIZE = 1000
+
+# rows of a project current at a version: (project id, version, version)
+AT_VERSION = "project_id = ? AND valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)"
+# rows of a project added or replaced after a version: (project id, version, version)
+CHANGED_SINCE = "project_id = ? AND (valid_from > ? OR valid_to > ?)"
+
+_cached_projects = int(os.environ.get("BIL_CACHED_PROJECTS", 32))
+_cached_states = int(os.environ.get("BIL_CACHED_STATES", 16))
+_connections = threading.local()
+# keyed by (database instance, project id) and holding (version, value), so a version check is all it takes
+_paygroups_cache = LRUCache(max_size=_cached_projects)
+_columns_cache = LRUCache(max_size=_cached_projects)
+_index_cache = LRUCache(max_size=_cached_projects)
+_totals_cache = LRUCache(max_size=_cached_projects)
+_rollups_cache = LRUCache(max_size=_cached_projects)
+_tags_cache = LRUCache(max_size=_cached_projects)
+# views built from a project's payments and kept current with `apply(changes)`
+_view_caches = (_columns_cache, _index_cache, _totals_cache, _rollups_cache, _tags_cache)
+_states_cache = LRUCache(max_size=_cached_states)
+
+
+def _connect(path: str) -> tuple[sqlite3.Connection, str]:
+    """
+    One connection per thread and database file, reopened if the file was replaced.
+    Returns the connection and the database's instance id, which keys all in-process caches.
+    """
+    connections = _connections.__dict__.setdefault("by_path", {})
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        inode = None
+    if path in connections and connections[path][0] == inode:
+        return connections[path][1:]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', ?)", (uuid.uuid4().hex,))
+    instance = conn.execute("SELECT value FROM meta WHERE key = 'instance'").fetchone()[0]
+    connections[path] = (os.stat(path).st_ino, conn, instance)
+    return conn, instance
+
+
+def _payment_from_row(row: list) -> Payment:
+    id, name, day, asset, liability, currency, tags = row
+    return Payment(
+        id=id, name=name, date=day, asset=asset, liability=liability, currency=currency, tags=json.loads(tags)
+    )
+
+
+class SQLiteDBAdaptor(DBAdaptor):
+    """
+    Keeps projects, paygroups and payments in one SQLite database (`bil.sqlite3` under the data path), so
+    changing a payment writes a row instead of the whole project. Attachments stay as files in project folders.
+
+    Rows are versioned instead of overwritten: every saved set of changes is a new project version, each row
+    records the versions it was current for, and past states are read straight from the tables.
+    """
+
+    def __init__(self, path, keep_history=True):
+        super().__init__(path, keep_history=False)
+        self._keep_history = keep_history
+        self._sqlite_path = os.path.join(path, "bil.sqlite3")
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        return _connect(self._sqlite_path)[0]
+
+    @property
+    def _instance(self) -> str:
+        return _connect(self._sqlite_path)[1]
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _get_projects_dict(self, include_deleted: bool = False) -> dict[int, Project]:
+        rows = self._conn.execute("SELECT id, name, is_deleted FROM projects ORDER BY id")
+        return {
+            id: Project(id=id, name=name, is_deleted=bool(is_deleted))
+            for id, name, is_deleted in rows
+            if not is_deleted or include_deleted
+        }
+
+    def _save_projects(self, projects: dict[int, Project]):
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT INTO projects (id, name, is_deleted) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET name = excluded.name, is_deleted = excluded.is_deleted",
+                [(p.id, p.name, int(p.is_deleted)) for p in projects.values()],
+            )
+
+    def get_state_tag(self, project_id: Optional[int] = None) -> str:
+        """Project versions already count every change, including attachments; the list is small enough to hash."""
+        if project_id is None:
+            state = self._conn.execute("SELECT id, name, is_deleted FROM projects ORDER BY id").fetchall()
+        else:
+            state = self._conn.execute(
+                "SELECT name, version FROM projects WHERE id = ? AND is_deleted = 0", (project_id,)
+            ).fetchone()
+            if state is None:
+                raise ItemNotFoundError
+        return state_tag((self._instance, state))
+
+    def _get_version(self, project_id: int) -> int:
+        row = self._conn.execute("SELECT version FROM projects WHERE id = ? AND is_deleted = 0", (project_id,))
+        row = row.fetchone()
+        if row is None:
+            raise ItemNotFoundError
+        return row[0]
+
+    def _bump_version(self, conn: sqlite3.Connection, project_id: int) -> int:
+        version = conn.execute("SELECT version FROM projects WHERE id = ?", (project_id,)).fetchone()[0] + 1
+        conn.execute("UPDATE projects SET version = ? WHERE id = ?", (version, project_id))
+        if self._keep_history:
+            moment = datetime.now().astimezone()
+            conn.execute(
+                "INSERT INTO revisions (project_id, version, date) VALUES (?, ?, ?)",
+                (project_id, version, format_date(moment)),
+            )
+        return version
+
+    def _retire(self, conn: sqlite3.Connection, table: str, where: str, params: tuple, version: int):
+        if self._keep_history:
+            conn.execute(f"UPDATE {table} SET valid_to = ? WHERE valid_to IS NULL AND {where}", (version, *params))
+        else:
+            conn.execute(f"DELETE FROM {table} WHERE valid_to IS NULL AND {where}", params)
+
+    def _insert_paygroup(self, conn: sqlite3.Connection, project_id: int, paygroup: Paygroup, version: int):
+        conn.execute(
+            "INSERT INTO paygroups (project_id, id, name, valid_from) VALUES (?, ?, ?, ?)",
+            (project_id, paygroup.id, paygroup.name, version),
+        )
+
+    def _insert_payments(
+        self, conn: sqlite3.Connection, project_id: int, paygroup_id: int, payments: list[Payment], version: int
+    ):
+        conn.executemany(
+            "INSERT INTO payments (project_id, paygroup_id, id, name, date, asset, liability, currency, tags, "
+            "valid_from) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    project_id,
+                    paygroup_id,
+                    pay.id,
+                    pay.name,
+                    pay.date.isoformat(),
+                    pay.asset,
+                    pay.liability,
+                    pay.currency,
+                    json.dumps([tag.model_dump() for tag in pay.tags or []]),
+                    version,
+                )
+                for pay in payments
+            ],
+        )
+
+    def _read_paygroups(self, project_id: int, version: int) -> dict[int, Paygroup]:
+        params = (project_id, version, version)
+        groups = {
+            id: Paygroup(id=id, name=name)
+            for id, name in self._conn.execute(f"SELECT id, name FROM paygroups WHERE {AT_VERSION} ORDER BY id", params)
+        }
+        rows = self._conn.execute(
+            f"SELECT paygroup_id, {PAYMENT_COLUMNS} FROM payments WHERE {AT_VERSION} ORDER BY paygroup_id, id", params
+        )
+        for paygroup_id, *row in rows:
+            groups[paygroup_id].payments.append(_payment_from_row(row))
+        return groups
+
+    def iter_payments(self, project_id: int, paygroup_id: Optional[int] = None) -> Iterator[tuple[Paygroup, Payment]]:
+        """
+        Unless the project is cached anyway, payments are read a page at a time at the current version, so
+        exporting a large project never holds all of it. Each page is a separate query, so the iterator can be
+        advanced from any thread.
+        """
+        version = self._get_version(project_id)
+        cached = _paygroups_cache.get((self._instance, project_id))
+        if cached is not None and cached[0] == version:
+            return super().iter_payments(project_id, paygroup_id)
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        params = (project_id, version, version)
+        groups = {
+            id: Paygroup(id=id, name=name)
+            for id, name in self._conn.execute(f"SELECT id, name FROM paygroups WHERE {AT_VERSION}", params)
+        }
+        if paygroup_id is not None and paygroup_id not in groups:
+            raise ItemNotFoundError
+        in_group, group_params = ("", ()) if paygroup_id is None else (" AND paygroup_id = ?", (paygroup_id,))
+
+        def generate() -> Iterator[tuple[Paygroup, Payment]]:
+            after = (0, 0)
+            while True:
+                rows = self._conn.execute(
+                    f"SELECT paygroup_id, {PAYMENT_COLUMNS} FROM payments WHERE {AT_VERSION}{in_group} "
+                    "AND (paygroup_id, id) > (?, ?) ORDER BY paygroup_id, id LIMIT ?",
+                    (*params, *group_params, *after, EXPORT_PAGE_SIZE),
+                ).fetchall()
+                for paygroup_id, *row in rows:
+                    yield groups[paygroup_id], _payment_from_row(row)
+                if len(rows) < EXPORT_PAGE_SIZE:
+                    return
+                after = (rows[-1][0], rows[-1][1])
+
+        return generate()
+
+    def _get_paygroups_dict(self, project_id: int) -> dict[int, Paygroup]:
+        version = self._get_version(project_id)
+        key = (self._instance, project_id)
+        cached = _paygroups_cache.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, self._read_paygroups(project_id, version))
+            _paygroups_cache.put(key, cached)
+        return dict(cached[1])
+
+    def _read_columns(self, project_id: int, version: int) -> PaymentColumns:
+        rows = self._conn.execute(
+            f"SELECT paygroup_id, {PAYMENT_COLUMNS} FROM payments WHERE {AT_VERSION} ORDER BY paygroup_id, id",
+            (project_id, version, version),
+        )
+        return PaymentColumns.from_records(
+            (paygroup_id, {**dict(zip(_payment_fields, row)), "tags": json.loads(row[-1])})
+            for paygroup_id, *row in rows
+        )
+
+    def _get_columns(self, project_id: int) -> PaymentColumns:
+        if project_id not in self._projects_dict:
+            raise ItemNotFoundError
+        version = self._get_version(project_id)
+        key = (self._instance, project_id)
+        cached = _columns_cache.get(key)
+        if cached is None or cached[0] != version:
+            paygroups = _paygroups_cache.get(key)
+            if paygroups is not None and paygroups[0] == version:
+                cached = (version, PaymentColumns.build(paygroups[1]))
+            else:
+                cached = (version, self._read_columns(project_id, version))
+            _columns_cache.put(key, cached)
+        return cached[1]
+
+    def _get_view(self, cache: LRUCache, build: Callable[[PaymentColumns], Any], project_id: int) -> Any:
+        columns = self._get_columns(project_id)
+        version = self._get_version(project_id)
+        key = (self._instance, project_id)
+        cached = cache.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, build(columns))
+            cache.put(key, cached)
+        return cached[1]
+
+    def _get_payment_index(self, project_id: int) -> PaymentIndex:
+        return self._get_view(_index_cache, PaymentIndex.build, project_id)
+
+    def _get_totals(self, project_id: int) -> PaymentTotals:
+        return self._get_view(_totals_cache, PaymentTotals.build, project_id)
+
+    def _get_rollups(self, project_id: int) -> PaymentRollups:
+        return self._get_view(_rollups_cache, PaymentRollups.build, project_id)
+
+    def _get_tag_catalog(self, project_id: int) -> TagCatalog:
+        return self._get_view(_tags_cache, TagCatalog.build, project_id)
+
+    def _carry_forward(self, project_id: int, old_version: int, new_version: int, changes: list[Change]):
+        key = (self._instance, project_id)
+        for cache in _view_caches:
+            cached = cache.get(key)
+            if cached is not None and cached[0] == old_version:
+                cached[1].apply(changes)
+                cache.put(key, (new_version, cached[1]))
+
+    def _save_paygroups(self, project_id: int, paygroups: dict[int, Paygroup], changes: Optional[list[Change]] = None):
+        with self._write() as conn:
+            version = self._bump_version(conn, project_id)
+            if changes is None:
+                self._retire(conn, "payments", "project_id = ?", (project_id,), version)
+                self._retire(conn, "paygroups", "project_id = ?", (project_id,), version)
+                for group in paygroups.values():
+                    self._insert_paygroup(conn, project_id, group, version)
+                    self._insert_payments(conn, project_id, group.id, group.payments, version)
+            for change in changes or []:
+                if change.payment_id is None:
+                    where, params, table = "project_id = ? AND id = ?", (project_id, change.paygroup_id), "paygroups"
+                else:
+                    where = "project_id = ? AND paygroup_id = ? AND id = ?"
+                    params, table = (project_id, change.paygroup_id, change.payment_id), "payments"
+                if change.before is not None:
+                    self._retire(conn, table, where, params, version)
+                if change.after is not None and change.payment_id is None:
+                    self._insert_paygroup(conn, project_id, change.after, version)
+                elif change.after is not None:
+                    self._insert_payments(conn, project_id, change.paygroup_id, [change.after], version)
+        _paygroups_cache.put((self._instance, project_id), (version, dict(paygroups)))
+        if changes is None:
+            for cache in _view_caches:
+                cache.pop((self._instance, project_id))
+        else:
+            self._carry_forward(project_id, version - 1, version, changes)
+        self._publish_changes(project_id, version, changes)
+
+    def get_version(self, project_id: int) -> int:
+        return self._get_version(project_id)
+
+    def _changed_items(self, project_id: int, since: int) -> tuple[int, Optional[set[tuple[int, Optional[int]]]]]:
+        """Rows record the versions they were current for, so the change log is the tables themselves."""
+        version = self._get_version(project_id)
+        # without history, replaced rows are deleted and deletions leave no trace
+        if since > version or (since < version and not self._keep_history):
+            return version, None
+        params = (project_id, since, since)
+        items = {(id, None) for (id,) in self._conn.execute(f"SELECT id FROM paygroups WHERE {CHANGED_SINCE}", params)}
+        items.update(self._conn.execute(f"SELECT paygroup_id, id FROM payments WHERE {CHANGED_SINCE}", params))
+        items.update(
+            self._conn.execute(f"SELECT paygroup_id, payment_id FROM attachments WHERE {CHANGED_SINCE}", params)
+        )
+        return version, items
+
+    def _attachments_changed(self, project_id: int, paygroup_id: int, payment_id: int):
+        self._record_attachments(project_id, [(paygroup_id, payment_id)])
+
+    def _record_attachments(self, project_id: int, payments: list[tuple[int, int]]):
+        """Stores the current attachment of each (paygroup id, payment id) as one new version."""
+        attachments = self._get_attachments(project_id)
+        with self._write() as conn:
+            version = self._bump_version(conn, project_id)
+            for paygroup_id, payment_id in payments:
+                where = "project_id = ? AND paygroup_id = ? AND payment_id = ?"
+                self._retire(conn, "attachments", where, (project_id, paygroup_id, payment_id), version)
+                file_name = attachments.get(f"{paygroup_id}_{payment_id}")
+                if file_name:
+                    conn.execute(
+                        "INSERT INTO attachments (project_id, paygroup_id, payment_id, file_name, valid_from) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (project_id, paygroup_id, payment_id, file_name, version),
+                    )
+        key = (self._instance, project_id)
+        cached = _paygroups_cache.get(key)
+        if cached is not None and cached[0] == version - 1:
+            _paygroups_cache.put(key, (version, cached[1]))
+        self._carry_forward(project_id, version - 1, version, [])
+        if broadcaster.has_subscribers(project_id):
+            current = [(group_id, pay_id, attachments.get(f"{group_id}_{pay_id}", "")) for group_id, pay_id in payments]
+            broadcaster.publish(project_id, version, attachment_event(version, current))
+
+    def get_project_history(self, project_id: int) -> list[dict]:
+        rows = self._conn.execute(
+            "SELECT version, date FROM revisions WHERE project_id = ? ORDER BY version DESC", (project_id,)
+        )
+        return [{"id": str(version), "date": date} for version, date in rows]
+
+    def get_state_id(self, project_id: int, history_id: str) -> str:
+        """Versions restart in a new database, so the database's instance id is part of the state's."""
+        if project_id not in self._projects_dict or not history_id.isdigit():
+            raise ItemNotFoundError
+        revision = self._conn.execute(
+            "SELECT 1 FROM revisions WHERE project_id = ? AND version = ?", (project_id, int(history_id))
+        ).fetchone()
+        if revision is None:
+            raise ItemNotFoundError
+        return f"{self._instance}.{int(history_id)}"
+
+    def get_project_state(self, project_id: int, history_id: str) -> ProjectState:
+        self.get_state_id(project_id, history_id)
+        version = int(history_id)
+        key = (self._instance, project_id, version)
+        paygroups = _states_cache.get(key)
+        if paygroups is None:
+            rows = self._conn.execute(
+                f"SELECT paygroup_id, payment_id, file_name FROM attachments WHERE {AT_VERSION}",
+                (project_id, version, version),
+            )
+            attachments = {(paygroup_id, payment_id): file_name for paygroup_id, payment_id, file_name in rows}
+            paygroups = self._with_attachments(
+                self._read_paygroups(project_id, version),
+                lambda group_id, pay_id: attachments.get((group_id, pay_id), ""),
+            )
+            _states_cache.put(key, paygroups)
+        return ProjectState(id=project_id, paygroups=paygroups)
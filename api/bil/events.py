@@ -0,0 +1,122 @@
+from typing import Optional
+from bil.datamodels import Change
+import asyncio
+import json
+import os
+import threading
+
+
+def format_event(kind: str, data: dict, id: Optional[int] = None) -> str:
+    """One server-sent event: `event`, optional `id` and single-line json `data` fields."""
+    head = f"event: {kind}\n" + (f"id: {id}\n" if id is not None else "")
+    return f"{head}data: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def sync_event(version: Optional[int] = None) -> str:
+    """Tells a subscriber to catch up through /changes since the last version it has applied."""
+    return format_event("sync", {"version": version}, id=version)
+
+
+def change_event(version: int, changes: list[Change]) -> str:
+    """
+    The changes of one saved version, each as paygroup_id, payment_id and `after`: the paygroup without its
+    payments or the payment without its attachment, or null for a deletion.
+    """
+    items = []
+    for change in changes:
+        if change.after is None:
+            after = None
+        elif change.payment_id is None:
+            after = change.after.model_dump(mode="json", exclude={"payments"})
+        else:
+            after = change.after.model_dump(mode="json", exclude={"attachment"})
+        items.append({"paygroup_id": change.paygroup_id, "payment_id": change.payment_id, "after": after})
+    return format_event("change", {"version": version, "changes": items}, id=version)
+
+
+def attachment_event(version: int, attachments: list[tuple[int, int, str]]) -> str:
+    """The current attachment file name ("" for none) of each (paygroup id, payment id, attachment)."""
+    items = [
+        {"paygroup_id": group_id, "payment_id": pay_id, "attachment": name} for group_id, pay_id, name in attachments
+    ]
+    return format_event("attachments", {"version": version, "attachments": items}, id=version)
+
+
+class Subscription:
+    """
+    Events of one project for one client, queued on the client's event loop. A client that falls
+    `max_queued` events behind loses what it has not read and gets a single sync event instead,
+    so a slow client costs a bounded amount of memory and never holds up the others.
+    """
+
+    def __init__(self, broadcaster: "Broadcaster", project_id: int, max_queued: int):
+        self.project_id = project_id
+        self._broadcaster = broadcaster
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue[tuple[Optional[int], str]] = asyncio.Queue(max_queued)
+
+    def _deliver(self, version: Optional[int], event: str):
+        if self._queue.full():
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            version, event = None, sync_event()
+        self._queue.put_nowait((version, event))
+
+    def send(self, version: Optional[int], event: str):
+        """Queues the event of a project version from any thread."""
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, version, event)
+        except RuntimeError:
+            # the client's event loop is gone
+            self.close()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[tuple[Optional[int], str]]:
+        """
+        The next (version, event), or None if there was none within `timeout` seconds. The version is None
+        for the sync event that replaces the events of a subscriber that fell behind.
+        """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self._broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    """
+    Fans events out to every subscriber of a project in this process. Events are formatted once by the
+    publisher and can be published from any thread, such as the storage threads that save changes.
+    """
+
+    def __init__(self, max_queued: int = 100):
+        self.max_queued = max_queued
+        self._subscribers: dict[int, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, project_id: int) -> Subscription:
+        """Must be called on the event loop the subscription will be read from."""
+        subscription = Subscription(self, project_id, self.max_queued)
+        with self._lock:
+            self._subscribers.setdefault(project_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.project_id, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.project_id, None)
+
+    def has_subscribers(self, project_id: int) -> bool:
+        return project_id in self._subscribers
+
+    def publish(self, project_id: int, version: int, event: str):
+        with self._lock:
+            subscribers = list(self._subscribers.get(project_id, ()))
+        for subscription in subscribers:
+            subscription.send(version, event)
+
+
+broadcaster = Broadcaster(max_queued=int(os.environ.get("BIL_EVENT_QUEUE", 100)))
@@ -0,0 +1,56 @@
+from typing import Iterable, Iterator
+from bil.datamodels import Paygroup, Payment
+from bil.importer import CSV_COLUMNS, format_tags
+import csv
+import io
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+CHUNK_ROWS = 500
+
+
+def _csv_chunks(rows: Iterable[tuple[Paygroup, Payment]], with_paygroup: bool) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([*(["paygroup_id", "paygroup"] if with_paygroup else []), "id", *CSV_COLUMNS])
+    for count, (group, pay) in enumerate(rows, start=1):
+        writer.writerow(
+            [
+                *([group.id, group.name] if with_paygroup else []),
+                pay.id,
+                pay.name,
+                pay.date.isoformat(),
+                pay.asset,
+                pay.liability,
+                pay.currency,
+                format_tags(pay.tags or []),
+            ]
+        )
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows: Iterable[tuple[Paygroup, Payment]], with_paygroup: bool) -> Iterator[str]:
+    lines = []
+    for group, pay in rows:
+        line = pay.model_dump_json(exclude={"attachment"})
+        lines.append(f'{{"paygroup_id":{group.id},{line[1:]}' if with_paygroup else line)
+        if len(lines) == CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def export_payments(rows: Iterable[tuple[Paygroup, Payment]], fmt: str, with_paygroup: bool) -> Iterator[str]:
+    """
+    Serializes (paygroup, payment) pairs lazily, CHUNK_ROWS payments per chunk, in a form `bil import` reads back.
+    Whole-project exports carry each payment's paygroup id (and name, in CSV).
+    """
+    if fmt == "csv":
+        return _csv_chunks(rows, with_paygroup)
+    if fmt == "ndjson":
+        return _ndjson_chunks(rows, with_paygroup)
+    raise ValueError(f"unknown export format: {fmt}")
@@ -0,0 +1,330 @@
+from datetime import datetime
+from typing import Optional
+from bil.cache import FileCache, LRUCache, file_signature
+from bil.locks import FileLocks
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import zlib
+
+_revision_pattern = re.compile(r"^[0-9a-f]{4,40}$")
+# commits to one project are serialized across threads and worker processes sharing the data folder
+_commit_locks = FileLocks()
+_CHUNK_BYTES = 64 * 1024
+
+
+def _shared_prefix(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def format_date(moment: datetime) -> str:
+    # same layout as git's default `%ad`, so clients see one format regardless of backend
+    return f"{moment:%a %b} {moment.day} {moment:%H:%M:%S %Y %z}"
+
+
+class History:
+    """
+    Keeps past states of a project directory. Revisions are listed newest first as {"id", "date"} dicts
+    and individual files can be read back at any listed revision.
+    """
+
+    def init(self, path: str):
+        pass
+
+    def commit(self, path: str):
+        pass
+
+    def log(self, path: str) -> list[dict]:
+        return []
+
+    def version(self, path: str) -> Optional[tuple]:
+        """A value that changes whenever the log of `path` does, without reading the log."""
+        return None
+
+    def resolve(self, path: str, revision: str) -> Optional[str]:
+        return None
+
+    def list_files(self, path: str, revision: str) -> Optional[list[str]]:
+        return None
+
+    def read_file(self, path: str, revision: str, file_name: str) -> Optional[bytes]:
+        return None
+
+    def flush(self, due_only: bool = False):
+        pass
+
+
+class GitHistory(History):
+    """Every project directory is a git repository, driven through the git executable."""
+
+    def _git(self, path: str, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(["git", "-C", path, *args], capture_output=True)
+
+    def init(self, path: str):
+        self._git(path, "init", "-q")
+
+    def commit(self, path: str):
+        with _commit_locks.hold(os.path.join(path, ".git", "bil-commit.lock"), exclusive=True):
+            self._git(path, "add", ".")
+            self._git(path, "commit", "-q", "-m", "updated")
+
+    def log(self, path: str) -> list[dict]:
+        resp = self._git(path, "log", "--format=%h|%ad").stdout.decode().splitlines()
+        return [{"id": x.split("|")[0], "date": x.split("|")[1]} for x in resp]
+
+    def version(self, path: str) -> Optional[tuple]:
+        return file_signature(os.path.join(path, ".git", "logs", "HEAD"))
+
+    def resolve(self, path: str, revision: str) -> Optional[str]:
+        if not _revision_pattern.match(revision):
+            return None
+        resp = self._git(path, "rev-parse", "--verify", "-q", f"{revision}^{{commit}}")
+        if resp.returncode:
+            return None
+        return resp.stdout.decode().strip()
+
+    def list_files(self, path: str, revision: str) -> Optional[list[str]]:
+        if not _revision_pattern.match(revision):
+            return None
+        resp = self._git(path, "ls-tree", "--name-only", revision)
+        if resp.returncode:
+            return None
+        return resp.stdout.decode().splitlines()
+
+    def read_file(self, path: str, revision: str, file_name: str) -> Optional[bytes]:
+        if not _revision_pattern.match(revision):
+            return None
+        resp = self._git(path, "show", f"{revision}:{file_name}")
+        if resp.returncode:
+            return None
+        return resp.stdout
+
+
+class SnapshotHistory(History):
+    """
+    In-process history: file contents are stored once each under `.history/objects`, keyed by their sha1,
+    and every commit appends one line to `.history/log` mapping file names to content hashes. Objects are
+    whole compressed files, so each commit of a changed payments.json adds about its compressed size.
+
+    Project folders that already have a git repository and no `.history` keep using git, so switching
+    backends neither hides their past states nor splits their history in two.
+    """
+
+    _log_cache = FileCache(max_files=32)
+    _hashes = LRUCache(max_size=4096)
+    _git = GitHistory()
+    # ids are listed at least this long, and longer where needed to tell them apart
+    _min_id_length = 7
+
+    def _uses_git(self, path: str) -> bool:
+        return os.path.isdir(os.path.join(path, ".git")) and not os.path.isdir(self._history_path(path))
+
+    def _history_path(self, path: str) -> str:
+        return os.path.join(path, ".history")
+
+    def _log_path(self, path: str) -> str:
+        return os.path.join(self._history_path(path), "log")
+
+    def _object_path(self, path: str, digest: str) -> str:
+        return os.path.join(self._history_path(path), "objects", digest)
+
+    def _read_log(self, path: str) -> list[dict]:
+        def parse(log_path: str) -> list[dict]:
+            with open(log_path, "r") as f:
+                return [json.loads(line) for line in f if line.strip()]
+
+        return self._log_cache.load(self._log_path(path), parse) or []
+
+    def _hash_file(self, file_path: str) -> str:
+        signature = file_signature(file_path)
+        known = self._hashes.get(file_path)
+        if known and known[0] == signature:
+            return known[1]
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            while chunk := f.read(_CHUNK_BYTES):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        self._hashes.put(file_path, (signature, digest))
+        return digest
+
+    def _store_object(self, path: str, file_path: str, digest: str):
+        object_path = self._object_path(path, digest)
+        if os.path.exists(object_path):
+            return
+        # attachments can be large, so they are compressed a chunk at a time rather than read whole
+        compressor = zlib.compressobj()
+        tmp_path = f"{object_path}.tmp"
+        with open(file_path, "rb") as source, open(tmp_path, "wb") as f:
+            while chunk := source.read(_CHUNK_BYTES):
+                f.write(compressor.compress(chunk))
+            f.write(compressor.flush())
+        os.replace(tmp_path, object_path)
+
+    def _find(self, path: str, revision: str) -> Optional[dict]:
+        """The entry whose id starts with `revision`, or None if there is none or more than one."""
+        if not _revision_pattern.match(revision):
+            return None
+        found = None
+        for entry in self._read_log(path):
+            if entry["id"].startswith(revision):
+                if found is not None:
+                    return None
+                found = entry
+        return found
+
+    def init(self, path: str):
+        if self._uses_git(path):
+            return
+        os.makedirs(os.path.join(self._history_path(path), "objects"), exist_ok=True)
+
+    def commit(self, path: str):
+        if self._uses_git(path):
+            return self._git.commit(path)
+        self.init(path)
+        with _commit_locks.hold(os.path.join(self._history_path(path), "lock"), exclusive=True):
+            files = {}
+            for entry in os.scandir(path):
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                digest = self._hash_file(entry.path)
+                self._store_object(path, entry.path, digest)
+                files[entry.name] = digest
+            entries = self._read_log(path)
+            if entries and entries[-1]["files"] == files:
+                return
+            parent = entries[-1]["id"] if entries else ""
+            moment = datetime.now().astimezone()
+            commit_id = hashlib.sha1(json.dumps([parent, moment.isoformat(), files]).encode()).hexdigest()
+            entry = {"id": commit_id, "date": format_date(moment), "files": files}
+            log_path = self._log_path(path)
+            with open(log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._log_cache.store(log_path, [*entries, entry])
+
+    def log(self, path: str) -> list[dict]:
+        if self._uses_git(path):
+            return self._git.log(path)
+        entries = self._read_log(path)
+        # like git's abbreviated ids: a listed id is one prefix of one commit only
+        ids = sorted(entry["id"] for entry in entries)
+        lengths = {}
+        for i, commit_id in enumerate(ids):
+            neighbours = [ids[j] for j in (i - 1, i + 1) if 0 <= j < len(ids)]
+            shared = max((_shared_prefix(commit_id, other) for other in neighbours), default=0)
+            lengths[commit_id] = max(self._min_id_length, shared + 1)
+        return [{"id": entry["id"][: lengths[entry["id"]]], "date": entry["date"]} for entry in reversed(entries)]
+
+    def version(self, path: str) -> Optional[tuple]:
+        if self._uses_git(path):
+            return self._git.version(path)
+        return file_signature(self._log_path(path))
+
+    def resolve(self, path: str, revision: str) -> Optional[str]:
+        if self._uses_git(path):
+            return self._git.resolve(path, revision)
+        entry = self._find(path, revision)
+        return entry["id"] if entry else None
+
+    def list_files(self, path: str, revision: str) -> Optional[list[str]]:
+        if self._uses_git(path):
+            return self._git.list_files(path, revision)
+        entry = self._find(path, revision)
+        if entry is None:
+            return None
+        return list(entry["files"])
+
+    def read_file(self, path: str, revision: str, file_name: str) -> Optional[bytes]:
+        if self._uses_git(path):
+            return self._git.read_file(path, revision, file_name)
+        entry = self._find(path, revision)
+        if entry is None or file_name not in entry["files"]:
+            return None
+        with open(self._object_path(path, entry["files"][file_name]), "rb") as f:
+            return zlib.decompress(f.read())
+
+
+class BatchedHistory(History):
+    """
+    Coalesces commits of another backend: changes to a project are committed once `commit_every` of them
+    have piled up, or once the oldest of them is `interval_ms` old. The latter is checked on every change and
+    by `flush(due_only=True)`, which the app calls periodically. Reading history commits pending changes first.
+    """
+
+    def __init__(self, history: History, interval_ms: int = 0, commit_every: int = 0):
+        self._history = history
+        self._interval = interval_ms / 1000
+        self._commit_every = commit_every
+        self._pending: dict[str, tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def _is_due(self, path: str) -> bool:
+        since, count = self._pending[path]
+        if self._commit_every and count >= self._commit_every:
+            return True
+        return bool(self._interval) and time.monotonic() - since >= self._interval
+
+    def _commit_pending(self, path: str, due_only: bool):
+        """
+        Commits the pending changes of `path`, if any (and due). If the commit fails they stay pending,
+        together with any made meanwhile, so the next flush tries again.
+        """
+        with self._lock:
+            if path not in self._pending or (due_only and not self._is_due(path)):
+                return
+            since, count = self._pending.pop(path)
+        try:
+            self._history.commit(path)
+        except BaseException:
+            with self._lock:
+                later_since, later_count = self._pending.get(path, (since, 0))
+                self._pending[path] = (min(since, later_since), count + later_count)
+            raise
+
+    def init(self, path: str):
+        self._history.init(path)
+
+    def commit(self, path: str):
+        with self._lock:
+            since, count = self._pending.get(path, (time.monotonic(), 0))
+            self._pending[path] = (since, count + 1)
+        self._commit_pending(path, due_only=True)
+
+    def flush(self, due_only: bool = False):
+        with self._lock:
+            paths = list(self._pending)
+        for path in paths:
+            self._commit_pending(path, due_only)
+
+    def log(self, path: str) -> list[dict]:
+        self._commit_pending(path, due_only=False)
+        return self._history.log(path)
+
+    def version(self, path: str) -> Optional[tuple]:
+        # pending changes get committed by the next `log`, so they count as a change already
+        with self._lock:
+            pending = path in self._pending
+        return self._history.version(path), pending
+
+    def resolve(self, path: str, revision: str) -> Optional[str]:
+        return self._history.resolve(path, revision)
+
+    def list_files(self, path: str, revision: str) -> Optional[list[str]]:
+        return self._history.list_files(path, revision)
+
+    def read_file(self, path: str, revision: str, file_name: str) -> Optional[bytes]:
+        return self._history.read_file(path, revision, file_name)
+
+
+def get_history(kind: str, interval_ms: int = 0, commit_every: int = 0) -> History:
+    backends = {"snapshot": SnapshotHistory, "git": GitHistory, "none": History}
+    if kind not in backends:
+        raise ValueError(f"unknown history backend: {kind}")
+    history = backends[kind]()
+    if interval_ms or commit_every > 1:
+        return BatchedHistory(history, interval_ms, commit_every)
+    return history
@@ -0,0 +1,101 @@
+from typing import IO, Iterable, Iterator, Optional
+from pydantic import TypeAdapter, ValidationError
+from bil.datamodels import PaymentInput
+from bil.dbfile import DBAdaptor
+import csv
+import json
+
+FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+CSV_COLUMNS = ["name", "date", "asset", "liability", "currency", "tags"]
+BATCH_SIZE = 1000
+
+_payments_adapter = TypeAdapter(list[PaymentInput])
+
+
+class ImportFailedError(Exception):
+    """Some rows did not validate; `errors` lists them as {"line", "errors"} and nothing was imported."""
+
+    def __init__(self, errors: list[dict]):
+        super().__init__(f"{len(errors)} invalid row(s)")
+        self.errors = errors
+
+
+def format_tags(tags: list) -> str:
+    return ";".join(f"{tag.name}:{tag.color}" for tag in tags)
+
+
+def parse_tags(text: str) -> list[dict]:
+    """Tags in a CSV cell are `name:color` pairs separated by `;`."""
+    tags = []
+    for item in filter(None, (part.strip() for part in text.split(";"))):
+        name, _, color = item.rpartition(":")
+        tags.append({"name": name, "color": color} if name else {"name": color})
+    return tags
+
+
+def read_rows(stream: IO[str], fmt: str) -> Iterator[tuple[int, Optional[dict]]]:
+    """
+    Yields (line number, raw fields) for each record, with None for lines that are not a JSON object.
+    CSV needs a header row naming the CSV_COLUMNS it uses.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            fields = {key: value for key, value in row.items() if key in CSV_COLUMNS and value not in ("", None)}
+            if "tags" in fields:
+                fields["tags"] = parse_tags(fields["tags"])
+            yield reader.line_num, fields
+    elif fmt == "ndjson":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                fields = json.loads(line)
+            except ValueError:
+                fields = None
+            yield line_number, fields if isinstance(fields, dict) else None
+    else:
+        raise ValueError(f"unknown import format: {fmt}")
+
+
+def _batches(rows: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def validate_payments(rows: Iterable[tuple[int, Optional[dict]]], batch_size: int = BATCH_SIZE) -> list[PaymentInput]:
+    """Validates rows `batch_size` at a time and raises ImportFailedError listing every invalid one."""
+    payments, errors = [], []
+    for batch in _batches(rows, batch_size):
+        errors.extend({"line": line, "errors": ["not a JSON object"]} for line, fields in batch if fields is None)
+        batch = [(line, fields) for line, fields in batch if fields is not None]
+        try:
+            payments.extend(_payments_adapter.validate_python([fields for _, fields in batch]))
+        except ValidationError as e:
+            by_position: dict[int, list[str]] = {}
+            for error in e.errors():
+                position, *field = error["loc"]
+                message = f"{'.'.join(map(str, field))}: {error['msg']}" if field else error["msg"]
+                by_position.setdefault(position, []).append(message)
+            errors.extend(
+                {"line": batch[position][0], "errors": messages} for position, messages in by_position.items()
+            )
+    if errors:
+        raise ImportFailedError(sorted(errors, key=lambda error: error["line"]))
+    return payments
+
+
+def import_payments(db: DBAdaptor, project_id: int, paygroup_id: int, stream: IO[str], fmt: str) -> list[int]:
+    """Validates the whole stream first, then adds every payment to the paygroup in one transaction."""
+    payments = validate_payments(read_rows(stream, fmt))
+    return db.add_payments(project_id, paygroup_id, payments)
@@ -0,0 +1,96 @@
+from contextlib import contextmanager
+from typing import Iterator
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where only the in-process locks apply
+    fcntl = None
+
+
+class RWLock:
+    """Many readers or one writer. Waiting writers go first, so a steady stream of readers cannot starve them."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._writer and not self._waiting_writers)
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            self._cond.wait_for(lambda: not self._writer and not self._readers)
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class FileLocks:
+    """
+    Reader/writer locks keyed by lock file path, shared by every adaptor in the process. Each lock is an RWLock
+    between threads plus a flock on the file between processes, so several workers can serve one data folder.
+    A thread already holding a lock passes straight through when it asks for it again.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, RWLock] = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()
+
+    def _get(self, path: str) -> RWLock:
+        with self._lock:
+            return self._locks.setdefault(path, RWLock())
+
+    @contextmanager
+    def hold(self, path: str, exclusive: bool) -> Iterator[None]:
+        held = self._held.__dict__.setdefault("paths", {})
+        if path in held:
+            if exclusive and not held[path]:
+                raise RuntimeError(f"cannot upgrade a read lock on {path}")
+            yield
+            return
+        lock = self._get(path)
+        if exclusive:
+            lock.acquire_write()
+        else:
+            lock.acquire_read()
+        held[path] = exclusive
+        try:
+            with self._flock(path, exclusive):
+                yield
+        finally:
+            del held[path]
+            if exclusive:
+                lock.release_write()
+            else:
+                lock.release_read()
+
+    @contextmanager
+    def _flock(self, path: str, exclusive: bool) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
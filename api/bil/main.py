@@ -1,24 +1,71 @@
-from typing import Callable
-from fastapi import FastAPI, HTTPException, Depends, UploadFile
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import AsyncIterator, Callable, Optional
+from fastapi import FastAPI, HTTPException, Depends, Path, Query, Request, UploadFile
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from bil.datamodels import (
+    AttachmentResponse,
+    ImportResponse,
     PaygroupInput,
     Payment,
     PaymentInput,
+    PaymentPage,
+    ProjectChanges,
     ProjectInput,
     ProjectResponse,
+    ProjectState,
+    ProjectTotals,
+    Report,
     ProjectWithPayments,
     NewItemResponse,
-    TagModel,
+    TagUsage,
 )
+from bil.asyncdb import AsyncDBAdaptor, run_blocking
 from bil.dbfile import DBAdaptor, ItemNotFoundError
+from bil.dbsqlite import SQLiteDBAdaptor
+from bil.events import broadcaster, sync_event
+from bil.exporter import MEDIA_TYPES, export_payments
+from bil.importer import FORMATS, ImportFailedError, import_payments
+from bil.uploads import SNIFF_BYTES, UploadTooLargeError, detect_file_type, detect_type
+import argparse
 import uvicorn
-import magic
+import asyncio
+import io
+import logging
 import os
+import tempfile
 
-app = FastAPI(title="bil-api")
+logger = logging.getLogger(__name__)
+
+HISTORY_FLUSH_PERIOD = 0.25
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get("BIL_EVENT_HEARTBEAT_SECONDS", 10))
+STORAGE = {"json": DBAdaptor, "sqlite": SQLiteDBAdaptor}[os.environ.get("BIL_STORAGE", "json")]
+
+
+async def flush_history_periodically(db: AsyncDBAdaptor):
+    while True:
+        await asyncio.sleep(HISTORY_FLUSH_PERIOD)
+        # a failed flush is retried on the next pass; letting it end the task would stop all background writes
+        for flush in (db.flush_history, db.flush_writes):
+            try:
+                await flush(True)
+            except Exception:
+                logger.exception("background flush failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = AsyncDBAdaptor(app.dependency_overrides.get(get_db, get_db)())
+    flusher = asyncio.create_task(flush_history_periodically(db))
+    yield
+    flusher.cancel()
+    await db.flush_history()
+    await db.flush_writes()
+
+
+app = FastAPI(title="bil-api", lifespan=lifespan)
 
 origins = [
     "*",
@@ -30,20 +77,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# mutable resources may be stored but have to be revalidated; past project states never change
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
 
 def get_db() -> DBAdaptor:
-    db = DBAdaptor("data/")
+    db = STORAGE("data/")
     return db
 
 
+def get_async_db(db: DBAdaptor = Depends(get_db)) -> AsyncDBAdaptor:
+    return AsyncDBAdaptor(db)
+
+
 def only_allow_types(content_types: list[str]) -> Callable[[UploadFile], UploadFile]:
     async def inner(file: UploadFile) -> UploadFile:
-        sample_bytes = await file.read(2048)
+        sample_bytes = await file.read(SNIFF_BYTES)
         await file.seek(0)
-        mime = magic.Magic(mime=True)
-        mime_type = mime.from_buffer(sample_bytes)
+        mime_type = await run_blocking(detect_type, sample_bytes)
         if mime_type not in content_types:
             raise HTTPException(status_code=415, detail="Unsupported media type")
         return file
@@ -51,145 +106,371 @@ def only_allow_types(content_types: list[str]) -> Callable[[UploadFile], UploadF
     return inner
 
 
+def cache_headers(etag: str, cache_control: str = REVALIDATE) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def is_fresh(request: Request, etag: str) -> bool:
+    """Whether the client's copy, named by If-None-Match, is still current."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def current_etag(db: AsyncDBAdaptor, project_id: Optional[int] = None) -> str:
+    return f'"{await db.get_state_tag(project_id)}"'
+
+
 @app.get("/projects", response_model=list[ProjectResponse])
-async def list_projects(db: DBAdaptor = Depends(get_db)):
-    return db.get_projects()
+async def list_projects(request: Request, response: Response, db: AsyncDBAdaptor = Depends(get_async_db)):
+    etag = await current_etag(db)
+    if is_fresh(request, etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    response.headers.update(cache_headers(etag))
+    return await db.get_projects()
 
 
 @app.post("/projects", response_model=NewItemResponse)
-async def add_a_new_project(project: ProjectInput, db: DBAdaptor = Depends(get_db)):
-    new_id = db.add_project(project.name)
+async def add_a_new_project(project: ProjectInput, db: AsyncDBAdaptor = Depends(get_async_db)):
+    new_id = await db.add_project(project.name)
     return {"id": new_id}
 
 
 @app.delete("/projects/{project_id}")
-async def delete_project(project_id: int, db: DBAdaptor = Depends(get_db)):
+async def delete_project(project_id: int, db: AsyncDBAdaptor = Depends(get_async_db)):
     try:
-        return db.delete_project(project_id)
+        return await db.delete_project(project_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
 @app.put("/projects/{project_id}/restore")
-async def restore_deleted_project(project_id: int, db: DBAdaptor = Depends(get_db)):
+async def restore_deleted_project(project_id: int, db: AsyncDBAdaptor = Depends(get_async_db)):
     try:
-        return db.restore_project(project_id)
+        return await db.restore_project(project_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
 @app.get("/projects/{project_id}", response_model=ProjectWithPayments)
-async def get_project(project_id: int, db: DBAdaptor = Depends(get_db)):
+async def get_project(project_id: int, request: Request, db: AsyncDBAdaptor = Depends(get_async_db)):
     try:
-        return db.get_project(project_id)
+        etag = await current_etag(db, project_id)
+        if is_fresh(request, etag):
+            return Response(status_code=304, headers=cache_headers(etag))
+        chunks = await db.stream_project(project_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
+    return StreamingResponse(chunks, media_type="application/json", headers=cache_headers(etag))
 
 
 @app.put("/projects/{project_id}")
-async def update_project(project_id: int, project: ProjectInput, db: DBAdaptor = Depends(get_db)):
+async def update_project(project_id: int, project: ProjectInput, db: AsyncDBAdaptor = Depends(get_async_db)):
     try:
-        return db.update_project(project_id, project.name)
+        return await db.update_project(project_id, project.name)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
 @app.get("/projects/{project_id}/history")
-async def get_project_history(project_id: int, db: DBAdaptor = Depends(get_db)):
+async def get_project_history(
+    project_id: int, request: Request, response: Response, db: AsyncDBAdaptor = Depends(get_async_db)
+):
     try:
-        return db.get_project_history(project_id)
+        etag = await current_etag(db, project_id)
+        if is_fresh(request, etag):
+            return Response(status_code=304, headers=cache_headers(etag))
+        response.headers.update(cache_headers(etag))
+        return await db.get_project_history(project_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
-@app.get("/projects/{project_id}/history/{history_id}", response_model=ProjectWithPayments)
-async def get_past_project_state(project_id: int, history_id: str, db: DBAdaptor = Depends(get_db)):
+@app.get("/projects/{project_id}/history/{history_id}", response_model=ProjectState)
+async def get_past_project_state(
+    project_id: int,
+    history_id: str,
+    request: Request,
+    response: Response,
+    db: AsyncDBAdaptor = Depends(get_async_db),
+):
+    # a past state never changes, so its full id is all the tag needs; the lookup also 404s states that are gone
     try:
-        return db.get_project_state(project_id, history_id)
+        etag = f'"{project_id}.{await db.get_state_id(project_id, history_id)}"'
+        if is_fresh(request, etag):
+            return Response(status_code=304, headers=cache_headers(etag, IMMUTABLE))
+        state = await db.get_project_state(project_id, history_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
+    response.headers.update(cache_headers(etag, IMMUTABLE))
+    return state
 
 
-@app.get("/projects/{project_id}/tags", response_model=list[TagModel])
-async def get_project_tags(project_id: int, db: DBAdaptor = Depends(get_db)):
+@app.get("/projects/{project_id}/tags", response_model=list[TagUsage])
+async def get_project_tags(
+    project_id: int,
+    request: Request,
+    response: Response,
+    prefix: Optional[str] = Query(None, description="Case-insensitive prefix of the tag name"),
+    db: AsyncDBAdaptor = Depends(get_async_db),
+):
     try:
-        return db.get_tags(project_id)
+        etag = await current_etag(db, project_id)
+        if is_fresh(request, etag):
+            return Response(status_code=304, headers=cache_headers(etag))
+        response.headers.update(cache_headers(etag))
+        return await db.get_tags(project_id, prefix)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
+@app.get("/projects/{project_id}/changes", response_model=ProjectChanges)
+async def get_project_changes(
+    project_id: int,
+    since: int = Query(0, ge=0, description="`version` of the last changes applied; 0 to start"),
+    db: AsyncDBAdaptor = Depends(get_async_db),
+):
+    try:
+        return await db.get_changes(project_id, since)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404)
+
+
+async def project_events(db: AsyncDBAdaptor, project_id: int) -> AsyncIterator[str]:
+    """
+    Opens with a sync event carrying the current version, then relays the project's events in version order.
+    Versions are counted across worker processes, so a version skipped in between, or seen only when checking
+    after a quiet heartbeat period, was saved by another worker and turns into a sync event instead.
+    """
+    subscription = broadcaster.subscribe(project_id)
+    try:
+        seen = await db.get_version(project_id)
+        yield sync_event(seen)
+        while True:
+            item = await subscription.get(EVENT_HEARTBEAT_SECONDS)
+            if item is None:
+                current = await db.get_version(project_id)
+                yield sync_event(current) if current > seen else ": keepalive\n\n"
+                seen = max(seen, current)
+                continue
+            version, event = item
+            if version is None:
+                # the subscriber fell behind and its queued events were dropped
+                seen = await db.get_version(project_id)
+                yield sync_event(seen)
+            elif version == seen + 1:
+                seen = version
+                yield event
+            elif version > seen:
+                seen = version
+                yield sync_event(version)
+    except ItemNotFoundError:
+        return
+    finally:
+        subscription.close()
+
+
+@app.get("/projects/{project_id}/events", response_class=StreamingResponse)
+async def get_project_events(project_id: int, db: AsyncDBAdaptor = Depends(get_async_db)):
+    try:
+        await db.get_version(project_id)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404)
+    return StreamingResponse(
+        project_events(db, project_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/projects/{project_id}/totals", response_model=ProjectTotals)
+async def get_project_totals(project_id: int, db: AsyncDBAdaptor = Depends(get_async_db)):
+    try:
+        return await db.get_totals(project_id)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404)
+
+
+@app.get("/projects/{project_id}/reports/{granularity}", response_model=Report)
+async def get_project_report(
+    project_id: int,
+    granularity: str = Path(pattern="^(day|month|year)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    currency: Optional[str] = None,
+    tag: Optional[str] = Query(None, description="Only payments with this tag"),
+    by_tag: bool = Query(False, description="One row per tag instead of one for all payments"),
+    db: AsyncDBAdaptor = Depends(get_async_db),
+):
+    try:
+        rows = await db.get_report(project_id, granularity, date_from, date_to, currency, tag, by_tag)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404)
+    return {"granularity": granularity, "rows": rows}
+
+
+@app.get("/projects/{project_id}/payments", response_model=PaymentPage)
+async def find_payments(
+    project_id: int,
+    name: Optional[str] = Query(None, description="Case-insensitive prefix of the payment name"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    tag: Optional[str] = None,
+    currency: Optional[str] = None,
+    cursor: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}\.\d+\.\d+$"),
+    limit: int = Query(50, ge=1, le=1000),
+    db: AsyncDBAdaptor = Depends(get_async_db),
+):
+    try:
+        return await db.find_payments(project_id, name, date_from, date_to, tag, currency, cursor, limit)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404)
+
+
+def export_response(rows, fmt: str, with_paygroup: bool, file_name: str) -> StreamingResponse:
+    return StreamingResponse(
+        export_payments(rows, fmt, with_paygroup),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{file_name}.{fmt}"'},
+    )
+
+
+@app.get("/projects/{project_id}/export")
+async def export_project(
+    project_id: int,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    db: AsyncDBAdaptor = Depends(get_async_db),
+):
+    try:
+        rows = await db.iter_payments(project_id)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404)
+    return export_response(rows, fmt, True, f"project_{project_id}")
+
+
 @app.post("/projects/{project_id}/paygroups", response_model=NewItemResponse)
-async def add_new_paygroup(project_id: int, group: PaygroupInput, db: DBAdaptor = Depends(get_db)):
+async def add_new_paygroup(project_id: int, group: PaygroupInput, db: AsyncDBAdaptor = Depends(get_async_db)):
     try:
-        group_id = db.add_paygroup(project_id, group.name)
+        group_id = await db.add_paygroup(project_id, group.name)
         return {"id": group_id}
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
 @app.delete("/projects/{project_id}/paygroups/{group_id}")
-async def delete_paygroup(project_id: int, group_id: int, db: DBAdaptor = Depends(get_db)):
+async def delete_paygroup(project_id: int, group_id: int, db: AsyncDBAdaptor = Depends(get_async_db)):
     try:
-        return db.delete_paygroup(project_id, group_id)
+        return await db.delete_paygroup(project_id, group_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
 @app.put("/projects/{project_id}/paygroups/{group_id}")
-async def update_paygroup(project_id: int, group_id: int, group: PaygroupInput, db: DBAdaptor = Depends(get_db)):
+async def update_paygroup(
+    project_id: int, group_id: int, group: PaygroupInput, db: AsyncDBAdaptor = Depends(get_async_db)
+):
+    try:
+        return await db.update_paygroup(project_id, group_id, group.name)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404)
+
+
+@app.get("/projects/{project_id}/paygroups/{group_id}/export")
+async def export_paygroup(
+    project_id: int,
+    group_id: int,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    db: AsyncDBAdaptor = Depends(get_async_db),
+):
     try:
-        return db.update_paygroup(project_id, group_id, group.name)
+        rows = await db.iter_payments(project_id, group_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
+    return export_response(rows, fmt, False, f"paygroup_{group_id}")
 
 
 @app.post("/projects/{project_id}/paygroups/{group_id}/payments", response_model=NewItemResponse)
-async def add_new_payment(project_id: int, group_id: int, payment: PaymentInput, db: DBAdaptor = Depends(get_db)):
+async def add_new_payment(
+    project_id: int, group_id: int, payment: PaymentInput, db: AsyncDBAdaptor = Depends(get_async_db)
+):
     try:
-        payment_id = db.add_payment(project_id, group_id, payment)
+        payment_id = await db.add_payment(project_id, group_id, payment)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
     return {"id": payment_id}
 
 
+@app.post(
+    "/projects/{project_id}/paygroups/{group_id}/payments/import",
+    response_model=ImportResponse,
+    openapi_extra={"requestBody": {"content": {fmt: {"schema": {"type": "string"}} for fmt in FORMATS}}},
+)
+async def import_payments_into_paygroup(
+    project_id: int, group_id: int, request: Request, db: AsyncDBAdaptor = Depends(get_async_db)
+):
+    fmt = FORMATS.get(request.headers.get("content-type", "").split(";")[0].strip())
+    if fmt is None:
+        raise HTTPException(status_code=415, detail=f"Send one of: {', '.join(FORMATS)}")
+    # a real file, since TextIOWrapper cannot wrap a SpooledTemporaryFile before Python 3.11
+    with tempfile.TemporaryFile() as body:
+        async for chunk in request.stream():
+            await run_blocking(body.write, chunk)
+        body.seek(0)
+        # like the CLI: only \n and \r end lines, not the other line breaks str.splitlines knows
+        stream = io.TextIOWrapper(body, encoding="utf-8-sig", newline="")
+        try:
+            ids = await run_blocking(import_payments, db.db, project_id, group_id, stream, fmt)
+        except ItemNotFoundError:
+            raise HTTPException(status_code=404)
+        except ImportFailedError as e:
+            raise HTTPException(status_code=422, detail=e.errors)
+    return {"imported": len(ids), "ids": ids}
+
+
 @app.delete("/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}")
-async def delete_payment(project_id: int, group_id: int, payment_id: int, db: DBAdaptor = Depends(get_db)):
+async def delete_payment(project_id: int, group_id: int, payment_id: int, db: AsyncDBAdaptor = Depends(get_async_db)):
     try:
-        return db.delete_payment(project_id, group_id, payment_id)
+        return await db.delete_payment(project_id, group_id, payment_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
 @app.put("/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}")
 async def update_payment(
-    project_id: int, group_id: int, payment_id: int, payment: PaymentInput, db: DBAdaptor = Depends(get_db)
+    project_id: int, group_id: int, payment_id: int, payment: PaymentInput, db: AsyncDBAdaptor = Depends(get_async_db)
 ):
     try:
-        return db.update_payment(project_id, group_id, Payment(id=payment_id, **payment.model_dump()))
+        return await db.update_payment(project_id, group_id, Payment(id=payment_id, **payment.model_dump()))
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
 
-@app.post("/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files")
+@app.post("/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files", response_model=AttachmentResponse)
 async def add_file_to_payment(
     project_id: int,
     group_id: int,
     payment_id: int,
     file: UploadFile = Depends(only_allow_types(["application/pdf", "image/jpeg"])),
-    db: DBAdaptor = Depends(get_db),
+    db: AsyncDBAdaptor = Depends(get_async_db),
 ):
     try:
-        return db.add_file_to_payment(project_id, group_id, payment_id, file)
+        return await db.add_file_to_payment(project_id, group_id, payment_id, file)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
 
 @app.get("/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files", response_class=FileResponse)
-async def get_files_from_payment(project_id: int, group_id: int, payment_id: int, db: DBAdaptor = Depends(get_db)):
+async def get_files_from_payment(
+    project_id: int, group_id: int, payment_id: int, db: AsyncDBAdaptor = Depends(get_async_db)
+):
     try:
-        file_path = db.get_files_from_payment(project_id, group_id, payment_id)
+        file_path = await db.get_files_from_payment(project_id, group_id, payment_id)
         extension = os.path.splitext(file_path)[1]
-        media_type = magic.from_file(file_path, mime=True)
+        media_type = await run_blocking(detect_file_type, file_path)
         return FileResponse(
             path=file_path,
             filename=f"payment_{payment_id}{extension}",
@@ -201,9 +482,11 @@ async def get_files_from_payment(project_id: int, group_id: int, payment_id: int
 
 
 @app.delete("/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files")
-async def delete_file_from_payment(project_id: int, group_id: int, payment_id: int, db: DBAdaptor = Depends(get_db)):
+async def delete_file_from_payment(
+    project_id: int, group_id: int, payment_id: int, db: AsyncDBAdaptor = Depends(get_async_db)
+):
     try:
-        return db.delete_file_from_payment(project_id, group_id, payment_id)
+        return await db.delete_file_from_payment(project_id, group_id, payment_id)
     except ItemNotFoundError:
         raise HTTPException(status_code=404)
 
@@ -217,4 +500,21 @@ app.mount("/", StaticFiles(directory="static", html=True, check_dir=False), name
 
 
 def start_app():
-    uvicorn.run("bil.main:app", host="0.0.0.0", port=8000, reload=True)
+    """
+    Production by default: BIL_WORKERS (or --workers) processes serve the same data folder, each with its
+    own caches, which check file signatures and so pick up writes made by the others. --reload is for development.
+    """
+    parser = argparse.ArgumentParser(description="Run the bil api")
+    parser.add_argument("--host", default=os.environ.get("BIL_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("BIL_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BIL_WORKERS", 1)))
+    parser.add_argument("--reload", action="store_true", help="restart on code changes, single worker")
+    args = parser.parse_args()
+    if args.reload:
+        uvicorn.run("bil.main:app", host=args.host, port=args.port, reload=True)
+    else:
+        uvicorn.run("bil.main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    start_app()
@@ -0,0 +1,45 @@
+"""
+Copies a json data folder into the SQLite storage in the same folder:
+
+    poetry run python -m bil.migrate data/
+
+Projects keep their ids and current contents, and each migrated project starts its SQLite history with the
+current payments and one more revision registering its attachments, which stay where they are.
+Earlier json history is left untouched on disk but is not carried over.
+"""
+
+from bil.dbfile import DBAdaptor
+from bil.dbsqlite import SQLiteDBAdaptor
+import argparse
+import os
+
+
+def migrate(path: str) -> int:
+    source = DBAdaptor(path, keep_history=False)
+    target = SQLiteDBAdaptor(path)
+    if target.get_projects(include_deleted=True):
+        raise SystemExit(f"{target._sqlite_path} already has projects, not migrating into it")
+    projects = source.get_projects(include_deleted=True)
+    target._save_projects({project.id: project for project in projects})
+    for project in projects:
+        payfile_path = source._get_payfile_path(project.id)
+        if os.path.exists(payfile_path):
+            target._save_paygroups(project.id, source._read_paygroups_file(project.id))
+        if os.path.isdir(source._get_project_path(project.id)):
+            attachments = source._get_attachments(project.id)
+            if attachments:
+                keys = [tuple(int(part) for part in key.split("_")) for key in attachments]
+                target._record_attachments(project.id, keys)
+    return len(projects)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate a json data folder to SQLite storage")
+    parser.add_argument("path", nargs="?", default="data/")
+    args = parser.parse_args()
+    count = migrate(args.path)
+    print(f"migrated {count} project(s) into {os.path.join(args.path, 'bil.sqlite3')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from typing import Iterable, Iterator, Optional
+from bil.columns import NULL_AMOUNT, PaymentColumns
+from bil.datamodels import Change, Payment
+from bil.totals import Sums, add_to_sums, apply_payment_changes, payment_amounts
+
+try:
+    import numpy as np
+except ImportError:  # optional, only speeds up building rollups from scratch
+    np = None
+
+# length of the period key cut from an iso date: "2024-01-05", "2024-01", "2024"
+GRANULARITIES = {"day": 10, "month": 7, "year": 4}
+# numpy's names for the same periods
+_numpy_units = {"day": "D", "month": "M", "year": "Y"}
+# bucket key within a period: (currency, tag), where the tag "" stands for all payments regardless of tags
+BucketKey = tuple[str, str]
+
+
+def _bucket_keys(currency: str, tags: set[str]) -> Iterator[BucketKey]:
+    yield currency, ""
+    for tag in tags:
+        yield currency, tag
+
+
+class PaymentRollups:
+    """
+    Payment counts and amounts (in microcents) summed per day, month and year, per currency, for all payments and
+    per tag. Periods are kept sorted for range queries and every bucket is kept current by applying changes,
+    so a report reads only the buckets in its range. Building from scratch uses numpy when it is installed.
+    """
+
+    def __init__(self):
+        self._buckets: dict[str, dict[str, dict[BucketKey, Sums]]] = {name: {} for name in GRANULARITIES}
+        self._periods: dict[str, list[str]] = {name: [] for name in GRANULARITIES}
+
+    @classmethod
+    def build(cls, columns: PaymentColumns) -> "PaymentRollups":
+        if np is not None and len(columns):
+            return cls._build_vectorized(columns)
+        rollups = cls()
+        days = columns.day_labels()
+        for row in columns.rows():
+            rollups._add(
+                days[row],
+                columns.currency(row),
+                columns.tag_names(row),
+                columns.asset(row) or 0,
+                columns.liability(row) or 0,
+                1,
+            )
+        return rollups
+
+    @classmethod
+    def _build_vectorized(cls, columns: PaymentColumns) -> "PaymentRollups":
+        keys: dict[BucketKey, int] = {}
+        alive = np.frombuffer(columns.alive, dtype=np.uint8).astype(bool)
+        rows = np.flatnonzero(alive)
+        epoch = date(1970, 1, 1).toordinal()
+        days = np.frombuffer(columns.days, dtype=np.int64)[alive] - epoch
+        # currency ids are already dense, so the per-currency keys come first and share them
+        for currency in columns.currencies:
+            keys[(currency, "")] = len(keys)
+        key_ids = np.frombuffer(columns.currency_ids, dtype=np.dtype(columns.currency_ids.typecode))[alive]
+        key_ids = key_ids.astype(np.int64)
+        amounts = np.ones((len(rows), 3), dtype=np.int64)
+        for column, amount in ((1, columns.assets), (2, columns.liabilities)):
+            values = np.frombuffer(amount, dtype=np.int64)[alive]
+            amounts[:, column] = np.where(values == NULL_AMOUNT, 0, values)
+        tagged = [
+            (i, keys.setdefault(key, len(keys)))
+            for i, row in enumerate(rows.tolist())
+            if columns.tag_ids[row]
+            for key in _bucket_keys(columns.currency(row), columns.tag_names(row))
+            if key[1]
+        ]
+        if tagged:
+            tag_rows, tag_key_ids = np.array(tagged, dtype=np.int64).T
+            days = np.concatenate([days, days[tag_rows]])
+            key_ids = np.concatenate([key_ids, tag_key_ids])
+            amounts = np.concatenate([amounts, amounts[tag_rows]])
+        key_list = list(keys)
+
+        rollups = cls()
+        for name, unit in _numpy_units.items():
+            periods = days.astype("datetime64[D]").astype(f"datetime64[{unit}]").astype(np.int64)
+            combined = periods * len(key_list) + key_ids
+            order = np.argsort(combined, kind="stable")
+            ordered = combined[order]
+            starts = np.flatnonzero(np.concatenate([[True], ordered[1:] != ordered[:-1]]))
+            sums = np.add.reduceat(amounts[order], starts, axis=0)
+            unique = ordered[starts]
+            labels = np.datetime_as_string((unique // len(key_list)).astype(f"datetime64[{unit}]"), unit=unit)
+            buckets = rollups._buckets[name]
+            for label, key_id, row in zip(labels.tolist(), (unique % len(key_list)).tolist(), sums.tolist()):
+                buckets.setdefault(label, {})[key_list[key_id]] = row
+            rollups._periods[name] = sorted(buckets)
+        return rollups
+
+    def _add(self, day: str, currency: str, tags: set[str], asset: int, liability: int, sign: int):
+        for name, length in GRANULARITIES.items():
+            period = day[:length]
+            buckets = self._buckets[name]
+            if period not in buckets:
+                buckets[period] = {}
+                insort(self._periods[name], period)
+            add_to_sums(buckets[period], _bucket_keys(currency, tags), asset, liability, sign)
+            if not buckets[period]:
+                del buckets[period]
+                del self._periods[name][bisect_left(self._periods[name], period)]
+
+    def _add_payment(self, paygroup_id: int, pay: Payment, sign: int):
+        tags, asset, liability = payment_amounts(pay)
+        self._add(pay.date.isoformat(), pay.currency, tags, asset, liability, sign)
+
+    def apply(self, changes: Iterable[Change]):
+        apply_payment_changes(changes, self._add_payment)
+
+    def query(
+        self,
+        granularity: str,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        currency: Optional[str] = None,
+        tag: Optional[str] = None,
+        by_tag: bool = False,
+    ) -> list[dict]:
+        """
+        Rows of {"period", "currency", "tag", "count", "asset", "liability"} for every period of `granularity`
+        overlapping the date range, oldest first. Rows cover all payments, with tag None, unless `tag` picks the
+        payments with that tag or `by_tag` asks for a row per tag.
+        """
+        length = GRANULARITIES[granularity]
+        periods = self._periods[granularity]
+        start = bisect_left(periods, date_from.isoformat()[:length]) if date_from else 0
+        end = bisect_right(periods, date_to.isoformat()[:length]) if date_to else len(periods)
+        rows = []
+        for period in periods[start:end]:
+            for (row_currency, row_tag), (count, asset, liability) in sorted(
+                self._buckets[granularity][period].items()
+            ):
+                if currency is not None and row_currency.upper() != currency.upper():
+                    continue
+                if by_tag and (not row_tag or (tag is not None and row_tag != tag)):
+                    continue
+                if not by_tag and row_tag != (tag or ""):
+                    continue
+                rows.append(
+                    {
+                        "period": period,
+                        "currency": row_currency,
+                        "tag": row_tag or None,
+                        "count": count,
+                        "asset": asset,
+                        "liability": liability,
+                    }
+                )
+        return rows
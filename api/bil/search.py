@@ -0,0 +1,162 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from typing import Iterable, Optional
+from bil.atomic import SyncPolicy, atomic_write
+from bil.columns import PaymentColumns
+from bil.datamodels import Change, Payment
+import json
+import os
+import re
+
+# payments are ordered by (iso date, paygroup id, payment id), which doubles as the pagination cursor
+PaymentKey = tuple[str, int, int]
+INDEX_FORMAT = 1
+
+_token_pattern = re.compile(r"\w+")
+# indexes are rebuilt whenever they are missing or stale, so they are never worth an fsync
+_no_sync = SyncPolicy("none")
+
+
+def encode_cursor(key: PaymentKey) -> str:
+    return ".".join(str(part) for part in key)
+
+
+def decode_cursor(cursor: str) -> PaymentKey:
+    day, group_id, pay_id = cursor.split(".")
+    return day, int(group_id), int(pay_id)
+
+
+def tokenize(text: str) -> list[str]:
+    return _token_pattern.findall(text.lower())
+
+
+class PaymentIndex:
+    """
+    Secondary indexes over all payments of a project: keys sorted by date, a sorted (token, key) list
+    for prefix search on payment names, and inverted indexes on tag name and currency.
+    The indexes can be saved next to the data and are kept current by applying changes as they are made.
+    They hold keys only; the payments behind them are read from the project's columns.
+    """
+
+    def __init__(self):
+        self._keys: list[PaymentKey] = []
+        self._tokens: list[tuple[str, PaymentKey]] = []
+        self._by_tag: dict[str, set[PaymentKey]] = {}
+        self._by_currency: dict[str, set[PaymentKey]] = {}
+
+    @classmethod
+    def build(cls, columns: PaymentColumns) -> "PaymentIndex":
+        index = cls()
+        days = columns.day_labels()
+        for row in columns.rows():
+            key = (days[row], columns.paygroup_ids[row], columns.ids[row])
+            index._add_lookups(key, columns.names[row], columns.tag_names(row), columns.currency(row), sort=False)
+        index._keys.sort()
+        index._tokens.sort()
+        return index
+
+    @classmethod
+    def load(cls, path: str, signature: list) -> Optional["PaymentIndex"]:
+        """Reads indexes saved by `save`, or returns None if there are none or they were saved for other data."""
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get("format") != INDEX_FORMAT or data.get("signature") != signature:
+            return None
+        index = cls()
+        index._keys = [tuple(key) for key in data["keys"]]
+        index._tokens = [(token, (day, group_id, pay_id)) for token, day, group_id, pay_id in data["tokens"]]
+        index._by_tag = {tag: {tuple(key) for key in keys} for tag, keys in data["tags"].items()}
+        index._by_currency = {currency: {tuple(key) for key in keys} for currency, keys in data["currencies"].items()}
+        return index
+
+    def save(self, path: str, signature: list):
+        data = {
+            "format": INDEX_FORMAT,
+            "signature": signature,
+            "keys": self._keys,
+            "tokens": [(token, *key) for token, key in self._tokens],
+            "tags": {tag: sorted(keys) for tag, keys in self._by_tag.items()},
+            "currencies": {currency: sorted(keys) for currency, keys in self._by_currency.items()},
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path, _no_sync) as f:
+            json.dump(data, f)
+
+    def _add_lookups(self, key: PaymentKey, name: str, tags: set[str], currency: str, sort: bool = True):
+        add = insort if sort else list.append
+        add(self._keys, key)
+        for token in set(tokenize(name)):
+            add(self._tokens, (token, key))
+        for tag in tags:
+            self._by_tag.setdefault(tag, set()).add(key)
+        self._by_currency.setdefault(currency.upper(), set()).add(key)
+
+    def _remove_lookups(self, key: PaymentKey, pay: Payment):
+        del self._keys[bisect_left(self._keys, key)]
+        for token in set(tokenize(pay.name)):
+            del self._tokens[bisect_left(self._tokens, (token, key))]
+        for tag in pay.tags or []:
+            self._by_tag.get(tag.name, set()).discard(key)
+        self._by_currency.get(pay.currency.upper(), set()).discard(key)
+
+    def apply(self, changes: Iterable[Change]):
+        for change in changes:
+            if change.payment_id is None:
+                continue
+            if change.before is not None:
+                key = (change.before.date.isoformat(), change.paygroup_id, change.payment_id)
+                self._remove_lookups(key, change.before)
+            if change.after is not None:
+                pay = change.after
+                key = (pay.date.isoformat(), change.paygroup_id, change.payment_id)
+                self._add_lookups(key, pay.name, {tag.name for tag in pay.tags or []}, pay.currency)
+
+    def _with_token_prefix(self, prefix: str) -> set[PaymentKey]:
+        start = bisect_left(self._tokens, (prefix,))
+        keys = set()
+        for token, key in self._tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            keys.add(key)
+        return keys
+
+    def find(
+        self,
+        name: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        tag: Optional[str] = None,
+        currency: Optional[str] = None,
+        after: Optional[PaymentKey] = None,
+        limit: int = 50,
+    ) -> tuple[list[PaymentKey], Optional[PaymentKey]]:
+        """
+        Returns the keys of up to `limit` matching payments in key order, starting after the `after` key,
+        and the key to continue from if there are more. Every word of `name` has to start some word of the name.
+        """
+        start = bisect_left(self._keys, (date_from.isoformat(),)) if date_from else 0
+        if after:
+            start = max(start, bisect_right(self._keys, after))
+        end = bisect_right(self._keys, (date_to.isoformat(), float("inf"))) if date_to else len(self._keys)
+
+        filters = [self._with_token_prefix(token) for token in tokenize(name or "")]
+        if tag is not None:
+            filters.append(self._by_tag.get(tag, set()))
+        if currency:
+            filters.append(self._by_currency.get(currency.upper(), set()))
+
+        if start >= end:
+            return [], None
+        if filters:
+            filters.sort(key=len)
+            low, high = self._keys[start], self._keys[end - 1]
+            keys = sorted(key for key in set.intersection(*filters) if low <= key <= high)[: limit + 1]
+        else:
+            stop = min(end, start + limit + 1)
+            keys = self._keys[start:stop]
+
+        next_key = keys[limit - 1] if len(keys) > limit else None
+        return keys[:limit], next_key
@@ -0,0 +1,63 @@
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+from bil.columns import PaymentColumns
+from bil.datamodels import Change, Payment
+
+Tag = tuple[str, str]
+
+
+def _payment_tags(pay: Payment) -> set[Tag]:
+    return {(tag.name, tag.color) for tag in pay.tags or []}
+
+
+class TagCatalog:
+    """
+    The distinct tags (name and color) used by a project's payments, with the number of payments using each.
+    Tags are kept sorted by lowercased name for prefix lookup, so listing them never walks the payments,
+    and the catalog is kept current by applying changes. Tags no payment uses any more are dropped.
+    """
+
+    def __init__(self):
+        self._counts: dict[Tag, int] = {}
+        self._sorted: list[tuple[str, str, str]] = []
+
+    @classmethod
+    def build(cls, columns: PaymentColumns) -> "TagCatalog":
+        catalog = cls()
+        for row in columns.rows():
+            for tag_id in set(columns.tag_ids[row]):
+                tag = columns.tags[tag_id]
+                catalog._counts[tag] = catalog._counts.get(tag, 0) + 1
+        catalog._sorted = sorted((name.lower(), name, color) for name, color in catalog._counts)
+        return catalog
+
+    def _add(self, tag: Tag, sign: int):
+        count = self._counts.get(tag, 0) + sign
+        entry = (tag[0].lower(), *tag)
+        if not count:
+            del self._counts[tag]
+            del self._sorted[bisect_left(self._sorted, entry)]
+            return
+        if tag not in self._counts:
+            insort(self._sorted, entry)
+        self._counts[tag] = count
+
+    def apply(self, changes: Iterable[Change]):
+        for change in changes:
+            if change.payment_id is None:
+                continue
+            for tag in _payment_tags(change.before) if change.before is not None else ():
+                self._add(tag, -1)
+            for tag in _payment_tags(change.after) if change.after is not None else ():
+                self._add(tag, 1)
+
+    def find(self, prefix: Optional[str] = None) -> list[dict]:
+        """{"name", "color", "count"} of every tag, or of the tags whose name starts with `prefix` in any case."""
+        prefix = (prefix or "").lower()
+        start = bisect_left(self._sorted, (prefix,))
+        found = []
+        for key, name, color in self._sorted[start:]:
+            if not key.startswith(prefix):
+                break
+            found.append({"name": name, "color": color, "count": self._counts[(name, color)]})
+        return found
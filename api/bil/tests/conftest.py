@@ -2,7 +2,9 @@ import pytest
 from fastapi.testclient import TestClient
 from bil.main import app
 from bil.main import get_db
+from bil import dbfile
 from bil.dbfile import DBAdaptor
+from bil.dbsqlite import SQLiteDBAdaptor
 import os
 import shutil
 import base64
@@ -39,12 +41,12 @@ def small_jpeg() -> bytearray:
     )
 
 
-@pytest.fixture
-def client() -> TestClient:
+@pytest.fixture(params=[DBAdaptor, SQLiteDBAdaptor], ids=["json", "sqlite"])
+def client(request) -> TestClient:
     test_data_path = os.path.join("/tmp/ramdisk", "test_data")
 
     def temp_db():
-        return DBAdaptor(test_data_path)
+        return request.param(test_data_path)
 
     app.dependency_overrides[get_db] = temp_db
     yield TestClient(app)
@@ -108,3 +110,21 @@ def client_with_tags(client_with_paygroup, mock_payment, mocked_tags) -> tuple[T
     mock_payment["tags"] = mocked_tags[2:3]
     client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=mock_payment)
     return client, project_id, group_id
+
+
+@pytest.fixture
+def db(tmp_path) -> DBAdaptor:
+    return DBAdaptor(str(tmp_path), keep_history=False)
+
+
+@pytest.fixture
+def parse_counter(monkeypatch) -> dict[str, int]:
+    counts = {"paygroups": 0}
+    original = dbfile._parse_paygroups
+
+    def counting_parser(path):
+        counts["paygroups"] += 1
+        return original(path)
+
+    monkeypatch.setattr(dbfile, "_parse_paygroups", counting_parser)
+    return counts
@@ -0,0 +1,31 @@
+import asyncio
+import time
+import httpx
+from bil.dbfile import DBAdaptor
+from bil.main import app, get_db
+
+
+def test_slow_storage_call_does_not_block_other_requests(tmp_path, monkeypatch):
+    class SlowHistoryDB(DBAdaptor):
+        def get_project_history(self, project_id: int) -> list[dict]:
+            time.sleep(0.5)
+            return []
+
+    monkeypatch.setitem(app.dependency_overrides, get_db, lambda: SlowHistoryDB(str(tmp_path), keep_history=False))
+    SlowHistoryDB(str(tmp_path), keep_history=False).add_project("Test Project")
+    finished = []
+
+    async def request(client: httpx.AsyncClient, url: str):
+        await client.get(url)
+        finished.append(url)
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            slow = asyncio.create_task(request(client, "/projects/1/history"))
+            await asyncio.sleep(0.05)
+            await request(client, "/projects")
+            await slow
+
+    asyncio.run(main())
+    assert finished == ["/projects", "/projects/1/history"]
@@ -0,0 +1,62 @@
+import os
+import pytest
+from bil import atomic
+from bil.atomic import SyncPolicy, atomic_write
+
+
+@pytest.fixture
+def fsyncs(monkeypatch) -> list[int]:
+    calls = []
+    original = os.fsync
+    monkeypatch.setattr(atomic.os, "fsync", lambda fd: calls.append(fd) or original(fd))
+    return calls
+
+
+def test_interrupted_write_keeps_previous_contents(tmp_path):
+    path = str(tmp_path / "data.json")
+    with atomic_write(path, SyncPolicy("none")) as f:
+        f.write("old")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, SyncPolicy("none")) as f:
+            f.write("half of the new")
+            raise RuntimeError
+    with open(path, "r") as f:
+        assert f.read() == "old"
+    assert os.listdir(tmp_path) == ["data.json"]
+
+
+@pytest.mark.parametrize("mode, expected", [("always", 2), ("interval", 1), ("none", 0)])
+def test_fsyncs_per_write(tmp_path, fsyncs, mode, expected):
+    with atomic_write(str(tmp_path / "data.json"), SyncPolicy(mode, interval_ms=60000)) as f:
+        f.write("{}")
+    assert len(fsyncs) == expected
+
+
+def test_interval_policy_syncs_pending_writes_on_flush(tmp_path, fsyncs):
+    sync = SyncPolicy("interval", interval_ms=60000)
+    for name in ("a.json", "b.json", "a.json"):
+        with atomic_write(str(tmp_path / name), sync) as f:
+            f.write("{}")
+    assert len(fsyncs) == 3  # each new file before it replaces the old one
+    sync.flush(due_only=True)
+    assert len(fsyncs) == 3
+    sync.flush()
+    assert len(fsyncs) == 4  # their directory
+    sync.flush()
+    assert len(fsyncs) == 4
+
+
+@pytest.mark.parametrize("mode", ["always", "interval"])
+def test_new_contents_reach_the_disk_before_replacing_the_file(tmp_path, monkeypatch, mode):
+    events = []
+    monkeypatch.setattr(atomic.os, "fsync", lambda fd: events.append("fsync"))
+    replace = os.replace
+    monkeypatch.setattr(atomic.os, "replace", lambda src, dst: events.append("replace") or replace(src, dst))
+    with atomic_write(str(tmp_path / "data.json"), SyncPolicy(mode, interval_ms=60000)) as f:
+        f.write("{}")
+    assert events[:2] == ["fsync", "replace"]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        SyncPolicy("sometimes")
@@ -0,0 +1,70 @@
+import json
+from bil import dbfile
+from bil.cache import FileCache
+
+
+def test_repeated_reads_do_not_reparse_payments(db, parse_counter):
+    project_id = db.add_project("Test Project")
+    db.add_paygroup(project_id, "Test Paygroup")
+    dbfile._payments_cache.clear()
+    for _ in range(5):
+        db.get_project(project_id)
+    assert parse_counter["paygroups"] == 1
+
+
+def test_writes_go_through_to_cache(db, parse_counter):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    db.update_paygroup(project_id, group_id, "Renamed")
+    assert db.get_paygroups(project_id)[0].name == "Renamed"
+    assert parse_counter["paygroups"] == 0
+
+
+def test_project_changes_do_not_touch_projects_already_handed_out(db):
+    project_id = db.add_project("Test Project")
+    deleted_id = db.add_project("Deleted Project")
+    db.delete_project(deleted_id)
+    handed_out = db.get_projects()[0]
+    db.update_project(project_id, "Renamed")
+    db.delete_project(project_id)
+    assert (handed_out.name, handed_out.is_deleted) == ("Test Project", False)
+    db.restore_project(project_id)
+    assert [(p.name, p.is_deleted) for p in db.get_projects(include_deleted=True)] == [
+        ("Renamed", False),
+        ("Deleted Project", True),
+    ]
+
+
+def test_external_changes_to_files_are_picked_up(db):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    db.get_paygroups(project_id)
+    payfile_path = db._get_payfile_path(project_id)
+    with open(payfile_path, "w") as f:
+        json.dump({group_id: {"id": group_id, "name": "Edited elsewhere", "payments": []}}, f)
+    assert db.get_paygroups(project_id)[0].name == "Edited elsewhere"
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    cache = FileCache(max_files=2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.txt"
+        path.write_text(str(i))
+        paths.append(str(path))
+    cache.load(paths[0], lambda p: open(p).read())
+    cache.load(paths[1], lambda p: open(p).read())
+    cache.load(paths[0], lambda p: open(p).read())
+    cache.load(paths[2], lambda p: open(p).read())
+    assert len(cache) == 2
+    assert cache.load(paths[0], lambda p: "reparsed") == "0"
+    assert cache.load(paths[1], lambda p: "reparsed") == "reparsed"
+
+
+def test_attachments_added_outside_the_app_are_picked_up(db):
+    project_id = db.add_project("Test Project")
+    db.add_paygroup(project_id, "Test Paygroup")
+    assert db._get_attachments(project_id) == {}
+    with open(f"{db._get_project_path(project_id)}/1_1.pdf", "wb") as f:
+        f.write(b"%PDF")
+    assert db._get_attachments(project_id) == {"1_1": "1_1.pdf"}
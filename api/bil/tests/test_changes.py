@@ -0,0 +1,94 @@
+from datetime import date
+from bil import dbfile
+from bil.datamodels import PaymentInput
+
+
+def changes(client, project_id: int, since: int) -> dict:
+    resp = client.get(f"/projects/{project_id}/changes", params={"since": since})
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_changes_since_a_version_name_only_what_changed(client_with_paygroup, mock_payment):
+    client, project_id, group_id = client_with_paygroup
+    payments_url = f"/projects/{project_id}/paygroups/{group_id}/payments"
+    kept, edited, deleted = (client.post(payments_url, json=mock_payment).json()["id"] for _ in range(3))
+    old_group = client.post(f"/projects/{project_id}/paygroups", json={"name": "Old"}).json()["id"]
+    client.post(f"/projects/{project_id}/paygroups/{old_group}/payments", json=mock_payment)
+    version = changes(client, project_id, 0)["version"]
+
+    client.put(f"{payments_url}/{edited}", json={**mock_payment, "name": "Edited"})
+    added = client.post(payments_url, json=mock_payment).json()["id"]
+    client.delete(f"{payments_url}/{deleted}")
+    client.put(f"/projects/{project_id}/paygroups/{group_id}", json={"name": "Renamed"})
+    client.delete(f"/projects/{project_id}/paygroups/{old_group}")
+
+    delta = changes(client, project_id, version)
+    assert delta["version"] > version
+    assert delta["reset"] is False
+    assert delta["paygroups"] == [{"id": group_id, "name": "Renamed"}]
+    assert [(p["paygroup_id"], p["id"], p["name"]) for p in delta["payments"]] == [
+        (group_id, edited, "Edited"),
+        (group_id, added, mock_payment["name"]),
+    ]
+    assert kept not in [p["id"] for p in delta["payments"]]
+    assert delta["deleted_paygroups"] == [old_group]
+    assert delta["deleted_payments"] == [{"paygroup_id": group_id, "id": deleted}]
+    assert changes(client, project_id, delta["version"]) == {
+        "version": delta["version"],
+        "reset": False,
+        "paygroups": [],
+        "payments": [],
+        "deleted_paygroups": [],
+        "deleted_payments": [],
+    }
+
+
+def test_attachments_show_as_changed_payments(client_with_payment, small_pdf):
+    client, project_id, group_id, payment_id = client_with_payment
+    version = changes(client, project_id, 0)["version"]
+    url = f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files"
+    client.post(url, files={"file": ("test.pdf", small_pdf, "application/pdf")})
+    delta = changes(client, project_id, version)
+    assert [(p["id"], p["attachment"]) for p in delta["payments"]] == [(payment_id, f"{group_id}_{payment_id}.pdf")]
+
+
+def test_unknown_versions_ask_for_a_reset(client_with_payment):
+    client, project_id, _, _ = client_with_payment
+    version = changes(client, project_id, 0)["version"]
+    delta = changes(client, project_id, version + 1)
+    assert delta["reset"] is True
+    assert delta["version"] == version
+    assert delta["payments"] == []
+
+
+def test_cannot_get_changes_of_missing_project(client):
+    assert client.get("/projects/42/changes").status_code == 404
+    assert client.get("/projects/42/changes?since=-1").status_code == 422
+
+
+def test_change_log_keeps_recent_versions_only(db, monkeypatch):
+    monkeypatch.setattr(dbfile, "_change_log_entries", 3)
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    first = db.get_changes(project_id, 0)["version"]
+    for i in range(8):
+        db.add_payment(project_id, group_id, PaymentInput(name=f"pay {i}", date=date.today(), currency="USD"))
+    with open(db._get_change_log_path(project_id)) as f:
+        assert len(f.readlines()) <= 6
+    assert db.get_changes(project_id, first)["reset"] is True
+    latest = db.get_changes(project_id, first + 8)
+    assert [p.name for p in latest["payments"]] == []
+    assert [p.name for p in db.get_changes(project_id, first + 6)["payments"]] == ["pay 6", "pay 7"]
+
+
+def test_torn_change_log_record_asks_for_a_reset(db):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    version = db.get_changes(project_id, 0)["version"]
+    with open(db._get_change_log_path(project_id), "a") as f:
+        f.write('{"version": ')
+    dbfile._change_log_cache.clear()
+    assert db.get_changes(project_id, version)["reset"] is True
+    db.add_payment(project_id, group_id, PaymentInput(name="pay", date=date.today(), currency="USD"))
+    assert db.get_changes(project_id, version)["reset"] is True
@@ -0,0 +1,86 @@
+import json
+import pytest
+from datetime import date
+from bil import dbfile
+from bil.columns import PaymentColumns
+from bil.datamodels import Change, Payment, Paygroup, PaymentInput, TagModel
+
+FOOD = TagModel(name="food", color="red")
+RENT = TagModel(name="rent", color="blue")
+
+
+@pytest.fixture
+def paygroups() -> dict[int, Paygroup]:
+    payments = [
+        Payment(id=1, name="Groceries", date=date(2024, 1, 5), asset=100, currency="USD", tags=[FOOD]),
+        Payment(id=2, name="Rent", date=date(2024, 1, 1), liability=900, currency="CAD", tags=[RENT, FOOD]),
+        Payment(id=3, name="Refund", date=date(2023, 12, 30), asset=None, liability=None, currency="USD"),
+    ]
+    return {
+        1: Paygroup(id=1, name="Home", payments=payments[:2]),
+        4: Paygroup(id=4, name="Other", payments=payments[2:]),
+    }
+
+
+def materialized(columns: PaymentColumns) -> list[tuple[int, Payment]]:
+    return [(columns.paygroup_ids[row], columns.payment(row)) for row in columns.rows()]
+
+
+def test_rows_materialize_as_the_payments_they_were_built_from(paygroups):
+    columns = PaymentColumns.build(paygroups)
+    assert len(columns) == 3
+    assert materialized(columns) == [(group.id, pay) for group in paygroups.values() for pay in group.payments]
+    assert columns.currencies == ["USD", "CAD"]
+    assert columns.tags == [("food", "red"), ("rent", "blue")]
+    assert columns.tag_names(1) == {"food", "rent"}
+
+
+def test_json_records_give_the_same_columns_as_models(paygroups):
+    records = json.loads(json.dumps(paygroups, cls=dbfile.ProjectEncoder))
+    columns = PaymentColumns.from_records((group["id"], pay) for group in records.values() for pay in group["payments"])
+    assert materialized(columns) == materialized(PaymentColumns.build(paygroups))
+
+
+def test_changes_are_applied_to_the_columns(paygroups):
+    columns = PaymentColumns.build(paygroups)
+    groceries, rent = paygroups[1].payments
+    cheaper = groceries.model_copy(update={"asset": 50})
+    added = Payment(id=3, name="Gas", date=date(2024, 2, 1), currency="EUR")
+    columns.apply(
+        [
+            Change(paygroup_id=1, payment_id=1, before=groceries, after=cheaper),
+            Change(paygroup_id=1, payment_id=2, before=rent),
+            Change(paygroup_id=1, payment_id=3, after=added),
+            Change(paygroup_id=5, after=Paygroup(id=5, name="Empty")),
+        ]
+    )
+    assert materialized(columns) == [(4, paygroups[4].payments[0]), (1, cheaper), (1, added)]
+    assert columns.find_row(1, 2) is None
+    assert columns.payment(columns.find_row(1, 3)) == added
+
+
+def test_changed_rows_are_compacted_away(paygroups):
+    columns = PaymentColumns.build(paygroups)
+    groceries = paygroups[1].payments[0]
+    for asset in range(2000):
+        before = groceries
+        groceries = groceries.model_copy(update={"asset": asset})
+        columns.apply([Change(paygroup_id=1, payment_id=1, before=before, after=groceries)])
+    assert len(columns.ids) < 2000
+    assert len(columns) == 3
+    assert columns.payment(columns.find_row(1, 1)) == groceries
+
+
+def test_read_only_requests_do_not_parse_payments_into_models(db, parse_counter):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    for i in range(3):
+        payment = PaymentInput(name=f"pay {i}", date=date(2024, 1, 1 + i), asset=i, currency="USD", tags=[FOOD])
+        db.add_payment(project_id, group_id, payment)
+    for cache in (dbfile._payments_cache, dbfile._columns_cache, dbfile._search_cache, *dbfile._view_caches):
+        cache.clear()
+    parse_counter["paygroups"] = 0
+    assert [pay.name for pay in db.find_payments(project_id, tag="food").payments] == ["pay 0", "pay 1", "pay 2"]
+    assert db.get_totals(project_id)["currencies"]["USD"] == {"count": 3, "asset": 3, "liability": 0}
+    assert db.get_report(project_id, "day")[-1]["period"] == "2024-01-03"
+    assert parse_counter["paygroups"] == 0
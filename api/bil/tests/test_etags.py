@@ -0,0 +1,97 @@
+import pytest
+from bil import dbfile
+
+
+def get(client, url: str, etag: str = None):
+    return client.get(url, headers={"If-None-Match": etag} if etag else {})
+
+
+def test_project_list_is_not_sent_again_while_unchanged(client):
+    client.post("/projects", json={"name": "Test Project"})
+    resp = get(client, "/projects")
+    etag = resp.headers["ETag"]
+    assert resp.headers["Cache-Control"] == "no-cache"
+    unchanged = get(client, "/projects", etag)
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["ETag"] == etag
+    client.put("/projects/1", json={"name": "Renamed"})
+    changed = get(client, "/projects", etag)
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("path", ["", "/tags", "/history"])
+def test_project_resources_are_not_sent_again_while_unchanged(client_with_payment, mock_payment, path):
+    client, project_id, group_id, _ = client_with_payment
+    url = f"/projects/{project_id}{path}"
+    etag = get(client, url).headers["ETag"]
+    assert get(client, url, etag).status_code == 304
+    assert get(client, url, f'W/{etag}, "other"').status_code == 304
+    client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=mock_payment)
+    resp = get(client, url, etag)
+    assert resp.status_code == 200
+    assert get(client, url, resp.headers["ETag"]).status_code == 304
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda client, project_id, group_id, payment_id: client.put(f"/projects/{project_id}", json={"name": "New"}),
+        lambda client, project_id, group_id, payment_id: client.post(
+            f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files",
+            files={"file": ("test.pdf", b"%PDF-1.1\n%%EOF\n", "application/pdf")},
+        ),
+    ],
+    ids=["rename", "attachment"],
+)
+def test_project_etag_covers_its_name_and_attachments(client_with_payment, change):
+    client, project_id, group_id, payment_id = client_with_payment
+    etag = get(client, f"/projects/{project_id}").headers["ETag"]
+    assert change(client, project_id, group_id, payment_id).status_code == 200
+    assert get(client, f"/projects/{project_id}", etag).status_code == 200
+
+
+def test_unchanged_project_is_not_read_to_answer_a_conditional_get(client_with_payment, parse_counter):
+    client, project_id, _, _ = client_with_payment
+    etag = get(client, f"/projects/{project_id}").headers["ETag"]
+    dbfile._payments_cache.clear()
+    parse_counter["paygroups"] = 0
+    assert get(client, f"/projects/{project_id}", etag).status_code == 304
+    assert parse_counter["paygroups"] == 0
+
+
+def test_past_states_are_cached_as_immutable(client_with_payment):
+    client, project_id, _, _ = client_with_payment
+    history_id = client.get(f"/projects/{project_id}/history").json()[0]["id"]
+    resp = get(client, f"/projects/{project_id}/history/{history_id}")
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert get(client, f"/projects/{project_id}/history/{history_id}", resp.headers["ETag"]).status_code == 304
+
+
+def test_past_states_hold_nothing_that_can_change_later(client_with_payment):
+    client, project_id, _, _ = client_with_payment
+    history_id = client.get(f"/projects/{project_id}/history").json()[0]["id"]
+    resp = get(client, f"/projects/{project_id}/history/{history_id}")
+    assert "name" not in resp.json()
+    # the full state id, which also names the database for sqlite versions, rather than the listed id
+    assert resp.headers["ETag"] != f'"{project_id}.{history_id}"'
+    client.put(f"/projects/{project_id}", json={"name": "Renamed"})
+    assert get(client, f"/projects/{project_id}/history/{history_id}").json() == resp.json()
+
+
+def test_past_states_of_deleted_projects_are_not_revalidated(client_with_payment):
+    client, project_id, _, _ = client_with_payment
+    history_id = client.get(f"/projects/{project_id}/history").json()[0]["id"]
+    etag = get(client, f"/projects/{project_id}/history/{history_id}").headers["ETag"]
+    client.delete(f"/projects/{project_id}")
+    assert get(client, f"/projects/{project_id}/history/{history_id}", etag).status_code == 404
+    assert get(client, f"/projects/{project_id}/history/abcdef0", "*").status_code == 404
+
+
+def test_missing_projects_have_no_etag(client):
+    for path in ["", "/tags", "/history"]:
+        resp = get(client, f"/projects/42{path}", "*")
+        assert resp.status_code == 404
+        assert "ETag" not in resp.headers
@@ -0,0 +1,100 @@
+import asyncio
+import json
+from datetime import date
+from bil import dbfile, main
+from bil.asyncdb import AsyncDBAdaptor
+from bil.datamodels import PaymentInput
+from bil.events import Broadcaster, broadcaster, format_event
+
+PAYMENT = PaymentInput(name="Groceries", date=date(2024, 1, 5), asset=100, currency="USD")
+
+
+def parse(event: str) -> tuple[str, dict]:
+    fields = dict(line.split(": ", 1) for line in event.strip().splitlines())
+    return fields["event"], json.loads(fields["data"])
+
+
+def test_subscribers_get_the_changes_saved_after_they_connect(db):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+
+    async def run():
+        adb = AsyncDBAdaptor(db)
+        first, second = main.project_events(adb, project_id), main.project_events(adb, project_id)
+        opened = [parse(await anext(first)), parse(await anext(second))]
+        payment_id = await adb.add_payment(project_id, group_id, PAYMENT)
+        received = [parse(await anext(first)), parse(await anext(second))]
+        await first.aclose()
+        await second.aclose()
+        return opened, payment_id, received
+
+    opened, payment_id, received = asyncio.run(run())
+    version = db.get_version(project_id)
+    assert opened == [("sync", {"version": version - 1})] * 2
+    after = {**PAYMENT.model_dump(mode="json"), "id": payment_id}
+    change = {"paygroup_id": group_id, "payment_id": payment_id, "after": after}
+    assert received == [("change", {"version": version, "changes": [change]})] * 2
+    assert not broadcaster.has_subscribers(project_id)
+
+
+def test_changes_saved_by_other_workers_turn_into_sync_events(db, monkeypatch):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    monkeypatch.setattr(main, "EVENT_HEARTBEAT_SECONDS", 0.01)
+
+    async def run():
+        adb = AsyncDBAdaptor(db)
+        stream = main.project_events(adb, project_id)
+        events = [await anext(stream), await anext(stream)]
+        # as if saved by another process: versions move on without an event here
+        monkeypatch.setattr(dbfile.broadcaster, "has_subscribers", lambda project_id: False)
+        await adb.add_payment(project_id, group_id, PAYMENT)
+        events.append(await anext(stream))
+        monkeypatch.undo()
+        await adb.add_payment(project_id, group_id, PAYMENT)
+        events.append(await anext(stream))
+        await stream.aclose()
+        return events
+
+    opened, idle, missed, next_change = asyncio.run(run())
+    assert idle == ": keepalive\n\n"
+    assert parse(missed) == ("sync", {"version": db.get_version(project_id) - 1})
+    assert parse(next_change)[0] == "change"
+
+
+def test_skipped_versions_turn_into_sync_events(db):
+    project_id = db.add_project("Test Project")
+    db.add_paygroup(project_id, "Test Paygroup")
+
+    async def run():
+        stream = main.project_events(AsyncDBAdaptor(db), project_id)
+        version = parse(await anext(stream))[1]["version"]
+        broadcaster.publish(project_id, version + 2, format_event("change", {"version": version + 2}))
+        event = parse(await anext(stream))
+        await stream.aclose()
+        return version, event
+
+    version, event = asyncio.run(run())
+    assert event == ("sync", {"version": version + 2})
+
+
+def test_slow_subscribers_get_one_sync_event_instead_of_a_backlog():
+    async def run():
+        events = Broadcaster(max_queued=3)
+        slow, fast = events.subscribe(1), events.subscribe(1)
+        received = []
+        for version in range(1, 6):
+            events.publish(1, version, f"event {version}")
+            await asyncio.sleep(0)
+            received.append(await fast.get())
+        return [await slow.get(), await slow.get(timeout=0.01)], received
+
+    slow, fast = asyncio.run(run())
+    assert slow[0][0] is None
+    assert parse(slow[0][1]) == ("sync", {"version": None})
+    assert slow[1] == (5, "event 5")
+    assert fast == [(version, f"event {version}") for version in range(1, 6)]
+
+
+def test_cannot_subscribe_to_missing_project(client):
+    assert client.get("/projects/42/events").status_code == 404
@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+from datetime import date
+from bil import dbsqlite
+from bil.datamodels import PaymentInput
+from bil.dbsqlite import SQLiteDBAdaptor
+
+
+def test_paygroup_csv_export_can_be_imported_back(client_with_tags):
+    client, project_id, group_id = client_with_tags
+    resp = client.get(f"/projects/{project_id}/paygroups/{group_id}/export")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+    assert resp.headers["content-disposition"] == f'attachment; filename="paygroup_{group_id}.csv"'
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert [row["id"] for row in rows] == ["1", "2"]
+    assert rows[0]["tags"] == "tag1:red;tag2:blue"
+
+    copy_id = client.post(f"/projects/{project_id}/paygroups", json={"name": "Copy"}).json()["id"]
+    client.post(
+        f"/projects/{project_id}/paygroups/{copy_id}/payments/import",
+        content=resp.text,
+        headers={"Content-Type": "text/csv"},
+    )
+    groups = {g["id"]: g["payments"] for g in client.get(f"/projects/{project_id}").json()["paygroups"]}
+    assert groups[copy_id] == groups[group_id]
+
+
+def test_project_json_lines_export_lists_every_payment_with_its_paygroup(client_with_payment, mock_payment):
+    client, project_id, group_id, pay_id = client_with_payment
+    other_id = client.post(f"/projects/{project_id}/paygroups", json={"name": "Other"}).json()["id"]
+    client.post(f"/projects/{project_id}/paygroups/{other_id}/payments", json=mock_payment)
+    resp = client.get(f"/projects/{project_id}/export", params={"format": "ndjson"})
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert [(line["paygroup_id"], line["id"], line["name"]) for line in lines] == [
+        (group_id, pay_id, mock_payment["name"]),
+        (other_id, 1, mock_payment["name"]),
+    ]
+
+
+def test_cannot_export_missing_items(client_with_paygroup):
+    client, project_id, group_id = client_with_paygroup
+    assert client.get(f"/projects/{project_id + 1}/export").status_code == 404
+    assert client.get(f"/projects/{project_id}/paygroups/{group_id + 1}/export").status_code == 404
+    assert client.get(f"/projects/{project_id}/export", params={"format": "xml"}).status_code == 422
+
+
+def test_sqlite_export_reads_payments_page_by_page(tmp_path, monkeypatch):
+    db = SQLiteDBAdaptor(str(tmp_path))
+    project_id = db.add_project("Test Project")
+    first_id = db.add_paygroup(project_id, "First")
+    second_id = db.add_paygroup(project_id, "Second")
+    for group_id in (first_id, second_id):
+        payments = [PaymentInput(name=f"pay {i}", date=date(2024, 1, 1), currency="USD") for i in range(5)]
+        db.add_payments(project_id, group_id, payments)
+    monkeypatch.setattr(dbsqlite, "EXPORT_PAGE_SIZE", 2)
+    dbsqlite._paygroups_cache.clear()
+    pairs = [(group.id, pay.id) for group, pay in db.iter_payments(project_id)]
+    assert pairs == [(group_id, pay_id) for group_id in (first_id, second_id) for pay_id in range(1, 6)]
+    assert [pay.id for _, pay in db.iter_payments(project_id, second_id)] == [1, 2, 3, 4, 5]
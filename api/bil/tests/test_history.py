@@ -0,0 +1,205 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import pytest
+import time
+from fastapi.testclient import TestClient
+from bil.dbfile import DBAdaptor
+from bil.history import BatchedHistory, GitHistory, SnapshotHistory
+from bil import main
+from bil.main import app, get_db
+
+
+@pytest.fixture(params=[SnapshotHistory, GitHistory])
+def history(request):
+    return request.param()
+
+
+@pytest.fixture
+def repo(tmp_path, history) -> str:
+    path = str(tmp_path)
+    history.init(path)
+    return path
+
+
+def write(path: str, name: str, content: str):
+    with open(f"{path}/{name}", "w") as f:
+        f.write(content)
+
+
+def test_commits_are_listed_newest_first(repo, history):
+    write(repo, "payments.json", "{}")
+    history.commit(repo)
+    write(repo, "payments.json", '{"1": {}}')
+    history.commit(repo)
+    states = history.log(repo)
+    assert len(states) == 2
+    assert history.read_file(repo, states[0]["id"], "payments.json") == b'{"1": {}}'
+    assert history.read_file(repo, states[1]["id"], "payments.json") == b"{}"
+
+
+def test_unchanged_tree_is_not_committed_again(repo, history):
+    write(repo, "payments.json", "{}")
+    history.commit(repo)
+    history.commit(repo)
+    assert len(history.log(repo)) == 1
+
+
+def test_files_are_listed_per_revision(repo, history):
+    write(repo, "payments.json", "{}")
+    history.commit(repo)
+    write(repo, "1_1.pdf", "pdf")
+    history.commit(repo)
+    newest, oldest = [state["id"] for state in history.log(repo)]
+    assert history.list_files(repo, oldest) == ["payments.json"]
+    assert sorted(history.list_files(repo, newest)) == ["1_1.pdf", "payments.json"]
+
+
+def test_unknown_revisions_are_not_found(repo, history):
+    write(repo, "payments.json", "{}")
+    history.commit(repo)
+    assert history.list_files(repo, "abcdef0") is None
+    assert history.read_file(repo, "--help", "payments.json") is None
+
+
+def test_listed_snapshot_ids_are_long_enough_to_be_unique(tmp_path):
+    history = SnapshotHistory()
+    repo = str(tmp_path)
+    history.init(repo)
+    ids = ["abcdef1" + "0" * 33, "abcdef1" + "1" * 33, "0123456" + "0" * 33]
+    with open(os.path.join(repo, ".history", "log"), "w") as f:
+        for commit_id in ids:
+            f.write(json.dumps({"id": commit_id, "date": "", "files": {}}) + "\n")
+    assert [state["id"] for state in history.log(repo)] == ["0123456", "abcdef11", "abcdef10"]
+    assert history.resolve(repo, "abcdef11") == ids[1]
+    assert history.resolve(repo, "abcdef1") is None
+    assert history.list_files(repo, "abcdef1") is None
+
+
+def test_snapshot_history_keeps_reading_existing_git_history(tmp_path):
+    repo = str(tmp_path)
+    GitHistory().init(repo)
+    write(repo, "payments.json", "{}")
+    GitHistory().commit(repo)
+    history = SnapshotHistory()
+    history.init(repo)
+    write(repo, "payments.json", '{"1": {}}')
+    history.commit(repo)
+    states = history.log(repo)
+    assert states == GitHistory().log(repo)
+    assert len(states) == 2
+    assert history.read_file(repo, states[1]["id"], "payments.json") == b"{}"
+    assert not os.path.exists(os.path.join(repo, ".history"))
+
+
+def test_cannot_get_project_at_unknown_state(client_with_paygroup):
+    client, project_id, _ = client_with_paygroup
+    resp = client.get(f"/projects/{project_id}/history/abcdef0")
+    assert resp.status_code == 404
+
+
+def test_batched_history_commits_every_n_changes(tmp_path):
+    repo = str(tmp_path)
+    history = BatchedHistory(SnapshotHistory(), commit_every=3)
+    history.init(repo)
+    for i in range(4):
+        write(repo, "payments.json", str(i))
+        history.commit(repo)
+    assert len(SnapshotHistory().log(repo)) == 1
+    assert len(history.log(repo)) == 2
+
+
+def test_failed_batched_commits_stay_pending(tmp_path, monkeypatch):
+    repo = str(tmp_path)
+    inner = SnapshotHistory()
+    history = BatchedHistory(inner, commit_every=100)
+    history.init(repo)
+    write(repo, "payments.json", "{}")
+    history.commit(repo)
+    commit = inner.commit
+    monkeypatch.setattr(inner, "commit", lambda path: (_ for _ in ()).throw(OSError("disk full")))
+    with pytest.raises(OSError):
+        history.flush()
+    monkeypatch.setattr(inner, "commit", commit)
+    history.flush()
+    assert len(inner.log(repo)) == 1
+
+
+def test_background_flushes_go_on_after_a_failure(monkeypatch):
+    calls = []
+
+    class FailingOnce:
+        async def flush_history(self, due_only: bool):
+            calls.append("history")
+            if calls.count("history") == 1:
+                raise OSError("disk full")
+
+        async def flush_writes(self, due_only: bool):
+            calls.append("writes")
+
+    async def run():
+        task = asyncio.create_task(main.flush_history_periodically(FailingOnce()))
+        while calls.count("history") < 2:
+            await asyncio.sleep(0.001)
+        task.cancel()
+
+    monkeypatch.setattr(main, "HISTORY_FLUSH_PERIOD", 0.001)
+    asyncio.run(run())
+    assert calls[:4] == ["history", "writes", "history", "writes"]
+
+
+def test_batched_history_commits_after_interval(tmp_path):
+    repo = str(tmp_path)
+    history = BatchedHistory(SnapshotHistory(), interval_ms=20)
+    history.init(repo)
+    write(repo, "payments.json", "{}")
+    history.commit(repo)
+    history.flush(due_only=True)
+    assert SnapshotHistory().log(repo) == []
+    time.sleep(0.03)
+    history.flush(due_only=True)
+    assert len(SnapshotHistory().log(repo)) == 1
+
+
+def test_pending_commits_are_flushed_on_shutdown(tmp_path, monkeypatch):
+    db = DBAdaptor(str(tmp_path), history=BatchedHistory(SnapshotHistory(), commit_every=100))
+    monkeypatch.setitem(app.dependency_overrides, get_db, lambda: db)
+    with TestClient(app) as client:
+        project_id = client.post("/projects", json={"name": "Test Project"}).json()["id"]
+        client.post(f"/projects/{project_id}/paygroups", json={"name": "Test Paygroup"})
+        assert SnapshotHistory().log(db._get_project_path(project_id)) == []
+    assert len(SnapshotHistory().log(db._get_project_path(project_id))) == 1
+
+
+def test_past_states_are_read_once(tmp_path, history, monkeypatch):
+    db = DBAdaptor(str(tmp_path), history=history)
+    project_id = db.add_project("Test Project")
+    db.add_paygroup(project_id, "Test Paygroup")
+    db.add_paygroup(project_id, "Another Paygroup")
+    reads = []
+    original_read = history.read_file
+    monkeypatch.setattr(history, "read_file", lambda *args: reads.append(args) or original_read(*args))
+    oldest = db.get_project_history(project_id)[-1]["id"]
+    for _ in range(3):
+        state = db.get_project_state(project_id, oldest)
+        assert [group.name for group in state.paygroups] == ["Test Paygroup"]
+    assert len(reads) == 1
+    assert db.get_project_state(project_id, oldest).paygroups == state.paygroups
+    assert os.path.exists(db._get_payfile_path(project_id))
+    assert len(db.get_paygroups(project_id)) == 2
+
+
+def test_commits_from_several_processes_are_serialized(repo, history):
+    def commit_one(name: str):
+        write(repo, name, name)
+        history.commit(repo)
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=commit_one, args=(f"{i}.json",)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    latest = history.log(repo)[0]["id"]
+    assert sorted(history.list_files(repo, latest)) == ["0.json", "1.json", "2.json", "3.json"]
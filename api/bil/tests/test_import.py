@@ -0,0 +1,134 @@
+import json
+import sys
+import pytest
+from importlib.metadata import entry_points
+from bil import cli
+from bil.dbfile import DBAdaptor
+
+CSV = (
+    "name,date,asset,liability,currency,tags\n"
+    "Salary,2024-01-31,500000000,,USD,income:green\n"
+    '"Rent, January",2024-01-01,,150000000,USD,home:blue;fixed:grey\n'
+)
+
+
+def test_can_import_csv(client_with_paygroup):
+    client, project_id, group_id = client_with_paygroup
+    resp = client.post(
+        f"/projects/{project_id}/paygroups/{group_id}/payments/import",
+        content=CSV,
+        headers={"Content-Type": "text/csv"},
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {"imported": 2, "ids": [1, 2]}
+    payments = client.get(f"/projects/{project_id}").json()["paygroups"][0]["payments"]
+    assert [(p["name"], p["asset"], p["liability"]) for p in payments] == [
+        ("Salary", 500000000, 0),
+        ("Rent, January", 0, 150000000),
+    ]
+    assert [t["name"] for t in payments[1]["tags"]] == ["home", "fixed"]
+
+
+def test_can_import_json_lines(client_with_payment, mock_payment):
+    client, project_id, group_id, _ = client_with_payment
+    history_before = len(client.get(f"/projects/{project_id}/history").json())
+    lines = "\n".join(json.dumps({**mock_payment, "name": f"pay {i}"}) for i in range(1500))
+    resp = client.post(
+        f"/projects/{project_id}/paygroups/{group_id}/payments/import",
+        content=lines,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 200
+    assert resp.json()["ids"] == list(range(2, 1502))
+    assert len(client.get(f"/projects/{project_id}").json()["paygroups"][0]["payments"]) == 1501
+    assert len(client.get(f"/projects/{project_id}/history").json()) == history_before + 1
+
+
+def test_invalid_rows_are_reported_and_nothing_is_imported(client_with_paygroup, mock_payment):
+    client, project_id, group_id = client_with_paygroup
+    lines = [json.dumps(mock_payment), json.dumps({**mock_payment, "date": "soon"}), "{oops", json.dumps(mock_payment)]
+    resp = client.post(
+        f"/projects/{project_id}/paygroups/{group_id}/payments/import",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 422
+    assert [error["line"] for error in resp.json()["detail"]] == [2, 3]
+    assert client.get(f"/projects/{project_id}").json()["paygroups"][0]["payments"] == []
+
+
+def test_imported_amounts_have_to_fit_the_storage(client_with_paygroup, mock_payment):
+    client, project_id, group_id = client_with_paygroup
+    lines = [json.dumps(mock_payment), json.dumps({**mock_payment, "asset": 2**63})]
+    resp = client.post(
+        f"/projects/{project_id}/paygroups/{group_id}/payments/import",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 422
+    assert [error["line"] for error in resp.json()["detail"]] == [2]
+    assert client.get(f"/projects/{project_id}/payments").json()["payments"] == []
+
+
+@pytest.mark.parametrize(
+    "content_type, body, name",
+    [
+        (
+            "application/x-ndjson",
+            '{"name": "Rent\u2028January", "date": "2024-01-01", "currency": "USD"}',
+            "Rent\u2028January",
+        ),
+        ("text/csv", 'name,date,currency\n"Rent\x0cJanuary\x85",2024-01-01,USD\n', "Rent\x0cJanuary\x85"),
+    ],
+    ids=["ndjson", "csv"],
+)
+def test_unusual_line_breaks_inside_records_are_kept(client_with_paygroup, content_type, body, name):
+    client, project_id, group_id = client_with_paygroup
+    resp = client.post(
+        f"/projects/{project_id}/paygroups/{group_id}/payments/import",
+        content=body.encode(),
+        headers={"Content-Type": content_type},
+    )
+    assert resp.status_code == 200
+    assert client.get(f"/projects/{project_id}/payments").json()["payments"][0]["name"] == name
+
+
+def test_import_needs_a_known_format(client_with_paygroup):
+    client, project_id, group_id = client_with_paygroup
+    resp = client.post(
+        f"/projects/{project_id}/paygroups/{group_id}/payments/import",
+        content="{}",
+        headers={"Content-Type": "application/json"},
+    )
+    assert resp.status_code == 415
+
+
+def test_cannot_import_into_missing_paygroup(client_with_paygroup):
+    client, project_id, group_id = client_with_paygroup
+    resp = client.post(
+        f"/projects/{project_id}/paygroups/{group_id + 1}/payments/import",
+        content=CSV,
+        headers={"Content-Type": "text/csv"},
+    )
+    assert resp.status_code == 404
+
+
+def test_cli_imports_file(tmp_path, monkeypatch, capsys):
+    data = str(tmp_path / "data")
+    db = DBAdaptor(data, keep_history=False)
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    statement = tmp_path / "statement.csv"
+    statement.write_text(CSV)
+    monkeypatch.setattr(sys, "argv", ["bil", "--data", data, "import", str(project_id), str(group_id), str(statement)])
+    with pytest.raises(SystemExit) as exit:
+        cli.main()
+    assert exit.value.code == 0
+    assert capsys.readouterr().out == "imported 2 payment(s)\n"
+    assert [p.name for p in db.get_paygroups(project_id)[0].payments] == ["Salary", "Rent, January"]
+
+
+def test_cli_is_installed_as_bil_command():
+    scripts = {script.name: script for script in entry_points(group="console_scripts")}
+    assert scripts["bil"].value == "bil.cli:main"
+    assert scripts["bil"].load() is cli.main
@@ -0,0 +1,93 @@
+import os
+import pytest
+from datetime import date
+from bil import dbfile
+from bil.datamodels import PaymentInput
+from bil.dbfile import DBAdaptor
+from bil.history import SnapshotHistory
+
+
+@pytest.fixture
+def journal_db(tmp_path) -> tuple[DBAdaptor, int, int]:
+    db = DBAdaptor(str(tmp_path), keep_history=False, journal=True)
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    return db, project_id, group_id
+
+
+def read(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def test_changes_are_appended_to_journal(journal_db):
+    db, project_id, group_id = journal_db
+    snapshot = read(db._get_payfile_path(project_id))
+    for i in range(3):
+        db.add_payment(project_id, group_id, PaymentInput(name=f"pay {i}", date=date(2024, 1, 1), currency="USD"))
+    assert read(db._get_payfile_path(project_id)) == snapshot
+    assert len(read(db._get_journal_path(project_id)).splitlines()) == 3
+
+
+def test_journal_is_replayed_on_load(journal_db):
+    db, project_id, group_id = journal_db
+    other_id = db.add_paygroup(project_id, "Other")
+    db.add_payment(project_id, group_id, PaymentInput(name="kept", date=date(2024, 1, 1), currency="USD"))
+    db.add_payment(project_id, group_id, PaymentInput(name="gone", date=date(2024, 1, 2), currency="USD"))
+    db.delete_payment(project_id, group_id, 2)
+    payment = db.get_paygroups(project_id)[0].payments[0]
+    payment.name = "edited"
+    db.update_payment(project_id, group_id, payment)
+    db.update_paygroup(project_id, group_id, "Renamed")
+    db.delete_paygroup(project_id, other_id)
+    expected = db.get_paygroups(project_id)
+    dbfile._payments_cache.clear()
+    assert DBAdaptor(db._base, keep_history=False).get_paygroups(project_id) == expected
+    assert [(g.name, [p.name for p in g.payments]) for g in expected] == [("Renamed", ["edited"])]
+
+
+def test_journal_is_compacted_once_it_grows(journal_db, monkeypatch):
+    db, project_id, group_id = journal_db
+    monkeypatch.setattr(dbfile, "_journal_compact_bytes", 1)
+    db.add_payment(project_id, group_id, PaymentInput(name="first", date=date(2024, 1, 1), currency="USD"))
+    assert os.path.exists(db._get_journal_path(project_id))
+    db.add_payment(project_id, group_id, PaymentInput(name="second", date=date(2024, 1, 1), currency="USD"))
+    assert not os.path.exists(db._get_journal_path(project_id))
+    dbfile._payments_cache.clear()
+    assert [p.name for p in db.get_paygroups(project_id)[0].payments] == ["first", "second"]
+
+
+def test_past_states_include_journal(tmp_path):
+    db = DBAdaptor(str(tmp_path), history=SnapshotHistory(), journal=True)
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    db.add_payment(project_id, group_id, PaymentInput(name="pay", date=date(2024, 1, 1), currency="USD"))
+    db.update_paygroup(project_id, group_id, "Renamed")
+    previous = db.get_project_history(project_id)[1]["id"]
+    state = db.get_project_state(project_id, previous)
+    assert [(g.name, [p.name for p in g.payments]) for g in state.paygroups] == [("Test Paygroup", ["pay"])]
+
+
+def test_torn_last_record_is_ignored(journal_db):
+    db, project_id, group_id = journal_db
+    db.add_payment(project_id, group_id, PaymentInput(name="pay", date=date(2024, 1, 1), currency="USD"))
+    with open(db._get_journal_path(project_id), "a") as f:
+        f.write('[{"paygroup_id": 1, "payment_id": 2, "bef')
+    dbfile._payments_cache.clear()
+    assert [p.name for p in db.get_paygroups(project_id)[0].payments] == ["pay"]
+
+
+def test_journal_replays_over_compacted_snapshot(journal_db):
+    db, project_id, group_id = journal_db
+    other_id = db.add_paygroup(project_id, "Other")
+    db.add_payment(project_id, other_id, PaymentInput(name="pay", date=date(2024, 1, 1), currency="USD"))
+    db.delete_payment(project_id, other_id, 1)
+    db.delete_paygroup(project_id, other_id)
+    expected = db.get_paygroups(project_id)
+    with open(db._get_journal_path(project_id), "r") as f:
+        journal = f.read()
+    db._save_paygroups(project_id, db._get_paygroups_dict(project_id))
+    with open(db._get_journal_path(project_id), "w") as f:
+        f.write(journal)
+    dbfile._payments_cache.clear()
+    assert db.get_paygroups(project_id) == expected
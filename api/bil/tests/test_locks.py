@@ -0,0 +1,99 @@
+import multiprocessing
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from bil import dbfile
+from bil.datamodels import PaymentInput
+from bil.dbfile import DBAdaptor
+from bil.locks import FileLocks
+
+
+def add_payments(base: str, project_id: int, count: int):
+    db = DBAdaptor(base, keep_history=False)
+    for i in range(count):
+        db.add_payment(project_id, 1, PaymentInput(name=f"pay {i}", date=date(2024, 1, 1), currency="USD"))
+
+
+@pytest.fixture
+def project(db) -> int:
+    project_id = db.add_project("Test Project")
+    db.add_paygroup(project_id, "Test Paygroup")
+    return project_id
+
+
+def test_concurrent_threads_do_not_lose_writes(db, project):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: add_payments(db._base, project, 10), range(8)))
+    assert sorted(p.id for p in db.get_paygroups(project)[0].payments) == list(range(1, 81))
+
+
+def test_concurrent_processes_do_not_lose_writes(db, project):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=add_payments, args=(db._base, project, 20)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    dbfile._payments_cache.clear()
+    assert sorted(p.id for p in db.get_paygroups(project)[0].payments) == list(range(1, 61))
+
+
+def test_concurrent_projects_are_added_once_each(db):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ids = list(pool.map(lambda i: db.add_project(f"project {i}"), range(16)))
+    assert sorted(ids) == list(range(1, 17))
+
+
+def test_renaming_projects_does_not_lose_added_ones(db, monkeypatch):
+    project_id = db.add_project("Renamed 0")
+    save_projects = DBAdaptor._save_projects
+
+    def slow_save(self, projects):
+        time.sleep(0.001)
+        save_projects(self, projects)
+
+    monkeypatch.setattr(DBAdaptor, "_save_projects", slow_save)
+
+    def change(i: int):
+        if i % 2:
+            db.add_project(f"project {i}")
+        else:
+            db.update_project(project_id, f"Renamed {i}")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(change, range(64)))
+    projects = db.get_projects()
+    assert len(projects) == 33
+    assert projects[0].name.startswith("Renamed")
+
+
+def test_writer_waits_for_readers(tmp_path):
+    locks = FileLocks()
+    path = str(tmp_path / "locks" / "1.lock")
+    events = []
+
+    def write():
+        with locks.hold(path, exclusive=True):
+            events.append("w")
+
+    with locks.hold(path, exclusive=False):
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join(timeout=0.2)
+        events.append("r")
+    writer.join()
+    assert events == ["r", "w"]
+
+
+def test_nested_locks_pass_through(tmp_path):
+    locks = FileLocks()
+    path = str(tmp_path / "locks" / "1.lock")
+    with locks.hold(path, exclusive=True):
+        with locks.hold(path, exclusive=False):
+            pass
+    with locks.hold(path, exclusive=False):
+        with pytest.raises(RuntimeError):
+            with locks.hold(path, exclusive=True):
+                pass
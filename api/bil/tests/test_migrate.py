@@ -0,0 +1,30 @@
+from bil.dbfile import DBAdaptor
+from bil.dbsqlite import SQLiteDBAdaptor
+from bil.datamodels import PaymentInput, TagModel
+from bil.migrate import migrate
+from datetime import date
+
+
+def test_json_data_can_be_migrated_to_sqlite(tmp_path):
+    source = DBAdaptor(str(tmp_path))
+    project_id = source.add_project("Test Project")
+    deleted_id = source.add_project("Deleted Project")
+    group_id = source.add_paygroup(project_id, "Test Paygroup")
+    source.add_paygroup(project_id, "Empty Paygroup")
+    tags = [TagModel(name="food", color="red")]
+    for i in range(3):
+        payment = PaymentInput(name=f"pay {i}", date=date(2024, 1, i + 1), currency="USD", asset=i, tags=tags)
+        source.add_payment(project_id, group_id, payment)
+    source.delete_payment(project_id, group_id, 2)
+    with open(f"{source._get_project_path(project_id)}/{group_id}_3.pdf", "wb") as f:
+        f.write(b"%PDF")
+    source.delete_project(deleted_id)
+
+    assert migrate(str(tmp_path)) == 2
+
+    target = SQLiteDBAdaptor(str(tmp_path))
+    assert target.get_projects(include_deleted=True) == source.get_projects(include_deleted=True)
+    assert target.get_project(project_id) == source.get_project(project_id)
+    oldest = target.get_project_history(project_id)[-1]["id"]
+    assert target.get_project_state(project_id, oldest).paygroups[0].payments[-1].attachment == ""
+    assert target.get_files_from_payment(project_id, group_id, 3).endswith(f"{group_id}_3.pdf")
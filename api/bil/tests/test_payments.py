@@ -1,3 +1,4 @@
+import pytest
 import random
 
 
@@ -116,6 +117,18 @@ def test_can_add_tags_to_payment(client_with_payment):
     assert payment["tags"][0]["color"] == tags[0]["color"]
 
 
+@pytest.mark.parametrize("field", ["asset", "liability"])
+def test_out_of_range_amounts_are_rejected(client_with_payment, mock_payment, field):
+    client, project_id, group_id, payment_id = client_with_payment
+    payments_url = f"/projects/{project_id}/paygroups/{group_id}/payments"
+    for amount in (2**63, -(2**63)):
+        assert client.post(payments_url, json={**mock_payment, field: amount}).status_code == 422
+        assert client.put(f"{payments_url}/{payment_id}", json={**mock_payment, field: amount}).status_code == 422
+    assert client.post(payments_url, json={**mock_payment, field: 2**63 - 1}).status_code == 200
+    for path in ["/payments", "/totals", "/tags", "/reports/month", ""]:
+        assert client.get(f"/projects/{project_id}{path}").status_code == 200
+
+
 def test_cannot_add_payment_to_nonexistent_paygroup(client_with_project, mock_payment):
     client, project_id = client_with_project
     resp = client.post(f"/projects/{project_id}/paygroups/42/payments", json=mock_payment)
@@ -160,3 +173,25 @@ def test_cannot_upload_files_of_invalid_type(client_with_payment):
 
     adding_fake_pdf_resp = client.post(url, files={"file": ("test.pdf", b"test-data", "application/pdf")})
     assert adding_fake_pdf_resp.status_code == 415
+
+
+def test_attachment_of_one_payment_is_not_served_for_another(client_with_paygroup, mock_payment, small_pdf):
+    client, project_id, group_id = client_with_paygroup
+    for _ in range(10):
+        client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=mock_payment)
+    url = f"/projects/{project_id}/paygroups/{group_id}/payments/10/files"
+    client.post(url, files={"file": ("test.pdf", small_pdf, "application/pdf")})
+    resp = client.get(f"/projects/{project_id}/paygroups/{group_id}/payments/1/files")
+    assert resp.status_code == 404
+
+
+def test_newest_file_is_the_attachment(client_with_payment, small_pdf, small_jpeg):
+    client, project_id, group_id, payment_id = client_with_payment
+    url = f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files"
+    client.post(url, files={"file": ("test.pdf", small_pdf, "application/pdf")})
+    client.post(url, files={"file": ("test.jpeg", small_jpeg, "image/jpeg")})
+    project = client.get(f"/projects/{project_id}").json()
+    assert project["paygroups"][0]["payments"][0]["attachment"] == f"{group_id}_{payment_id}.jpeg"
+    client.delete(url)
+    project = client.get(f"/projects/{project_id}").json()
+    assert project["paygroups"][0]["payments"][0]["attachment"] == f"{group_id}_{payment_id}.pdf"
@@ -1,4 +1,6 @@
+import json
 import random
+from bil.main import app, get_db
 
 
 def test_can_add_new_project(client):
@@ -79,7 +81,7 @@ def test_can_get_all_tags_from_project(client_with_tags, mocked_tags):
     client, project_id, _ = client_with_tags
     resp = client.get(f"/projects/{project_id}/tags")
     assert resp.status_code == 200
-    assert resp.json() == mocked_tags
+    assert resp.json() == [{**tag, "count": 1} for tag in mocked_tags]
 
 
 def test_getting_projects_from_blank_db_returns_empty_list(client):
@@ -114,3 +116,29 @@ def test_cannot_get_nonexistent_project(client):
 def test_cannot_restore_nonexistent_project(client):
     resp = client.put("/projects/42/restore")
     assert resp.status_code == 404
+
+
+def test_project_state_shows_attachments_present_at_that_time(client_with_payment, small_pdf):
+    client, project_id, group_id, payment_id = client_with_payment
+    url = f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files"
+    client.post(url, files={"file": ("test.pdf", small_pdf, "application/pdf")})
+    client.delete(url)
+    without_file, with_file = client.get(f"/projects/{project_id}/history").json()[:2]
+    state = client.get(f"/projects/{project_id}/history/{with_file['id']}").json()
+    assert state["paygroups"][0]["payments"][0]["attachment"] == f"{group_id}_{payment_id}.pdf"
+    state = client.get(f"/projects/{project_id}/history/{without_file['id']}").json()
+    assert not state["paygroups"][0]["payments"][0]["attachment"]
+
+
+def test_streamed_project_matches_project_model(client_with_tags, small_pdf):
+    client, project_id, group_id = client_with_tags
+    client.post(f"/projects/{project_id}/paygroups", json={"name": "Ünïcode group"})
+    url = f"/projects/{project_id}/paygroups/{group_id}/payments/2/files"
+    client.post(url, files={"file": ("test.pdf", small_pdf, "application/pdf")})
+    db = app.dependency_overrides[get_db]()
+    expected = db.get_project(project_id).model_dump(mode="json")
+    assert json.loads("".join(db.stream_project(project_id, chunk_size=1))) == expected
+    resp = client.get(f"/projects/{project_id}")
+    assert resp.headers["content-type"] == "application/json"
+    assert resp.json() == expected
+    assert resp.json()["paygroups"][0]["payments"][1]["attachment"] == f"{group_id}_2.pdf"
@@ -0,0 +1,102 @@
+import pytest
+from datetime import date
+from bil import dbfile, rollups
+from bil.datamodels import PaymentInput, Paygroup, TagModel
+from bil.columns import PaymentColumns
+from bil.rollups import PaymentRollups
+
+FOOD = TagModel(name="food", color="red")
+RENT = TagModel(name="rent", color="blue")
+
+
+@pytest.fixture
+def client_with_spending(client_with_paygroup, mock_payment) -> tuple:
+    client, project_id, group_id = client_with_paygroup
+    for day, liability, tags in [
+        ("2023-12-30", 5, [FOOD]),
+        ("2024-01-05", 10, [FOOD]),
+        ("2024-01-20", 20, [FOOD, RENT]),
+        ("2024-02-01", 40, []),
+    ]:
+        payment = {
+            **mock_payment,
+            "date": day,
+            "asset": 0,
+            "liability": liability,
+            "tags": [t.model_dump() for t in tags],
+        }
+        client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=payment)
+    return client, project_id
+
+
+def report(client, project_id: int, granularity: str, **params) -> list[tuple]:
+    resp = client.get(f"/projects/{project_id}/reports/{granularity}", params=params)
+    assert resp.status_code == 200
+    return [(row["period"], row["tag"], row["count"], row["liability"]) for row in resp.json()["rows"]]
+
+
+def test_spending_is_reported_per_period(client_with_spending):
+    client, project_id = client_with_spending
+    assert report(client, project_id, "year") == [("2023", None, 1, 5), ("2024", None, 3, 70)]
+    assert report(client, project_id, "month", date_from="2024-01-15") == [
+        ("2024-01", None, 2, 30),
+        ("2024-02", None, 1, 40),
+    ]
+    assert report(client, project_id, "day", date_to="2024-01-05") == [
+        ("2023-12-30", None, 1, 5),
+        ("2024-01-05", None, 1, 10),
+    ]
+
+
+def test_spending_is_reported_per_tag(client_with_spending):
+    client, project_id = client_with_spending
+    assert report(client, project_id, "month", by_tag=True) == [
+        ("2023-12", "food", 1, 5),
+        ("2024-01", "food", 2, 30),
+        ("2024-01", "rent", 1, 20),
+    ]
+    assert report(client, project_id, "year", tag="rent") == [("2024", "rent", 1, 20)]
+    assert report(client, project_id, "year", currency="EUR") == []
+
+
+def test_cannot_report_on_missing_project_or_unknown_period(client_with_project):
+    client, project_id = client_with_project
+    assert client.get(f"/projects/{project_id + 1}/reports/month").status_code == 404
+    assert client.get(f"/projects/{project_id}/reports/week").status_code == 422
+
+
+def test_rollups_are_kept_current_without_rebuilding(db, monkeypatch):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    for day in (date(2024, 1, 1), date(2024, 1, 2), date(2024, 2, 1)):
+        db.add_payment(project_id, group_id, PaymentInput(name="pay", date=day, liability=10, currency="USD"))
+    db.get_report(project_id, "month")
+    builds = []
+    monkeypatch.setattr(PaymentRollups, "build", classmethod(lambda cls, columns: builds.append(1)))
+    payment = db.get_paygroups(project_id)[0].payments[0].model_copy(update={"date": date(2025, 3, 1), "tags": [FOOD]})
+    db.update_payment(project_id, group_id, payment)
+    db.delete_payment(project_id, group_id, 3)
+    reports = {granularity: db.get_report(project_id, granularity, by_tag=True) for granularity in ("day", "year")}
+    assert builds == []
+    monkeypatch.undo()
+    dbfile._rollups_cache.clear()
+    assert reports == {granularity: db.get_report(project_id, granularity, by_tag=True) for granularity in reports}
+    assert [row["period"] for row in db.get_report(project_id, "month")] == ["2024-01", "2025-03"]
+
+
+def test_vectorized_build_matches_incremental_one(monkeypatch):
+    pytest.importorskip("numpy")
+    payments = [
+        PaymentInput(
+            name="pay", date=date(1969 + i % 60, 1 + i % 12, 1 + i % 28), asset=i, currency="USD" if i % 3 else "CAD"
+        ).model_dump()
+        | {"id": i, "tags": [FOOD, RENT][: i % 3]}
+        for i in range(1, 500)
+    ]
+    columns = PaymentColumns.build({1: Paygroup(id=1, name="group", payments=payments)})
+    vectorized = PaymentRollups.build(columns)
+    monkeypatch.setattr(rollups, "np", None)
+    incremental = PaymentRollups.build(columns)
+    for granularity in rollups.GRANULARITIES:
+        assert vectorized.query(granularity, by_tag=True) == incremental.query(granularity, by_tag=True)
+        assert vectorized.query(granularity) == incremental.query(granularity)
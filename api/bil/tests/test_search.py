@@ -0,0 +1,171 @@
+import json
+import pytest
+from datetime import date
+from bil import dbfile
+from bil.datamodels import Payment, PaymentInput
+from bil.columns import PaymentColumns
+from bil.search import PaymentIndex
+
+
+@pytest.fixture
+def client_with_ledger(client_with_paygroup, mock_payment) -> tuple:
+    client, project_id, group_id = client_with_paygroup
+    other_group_id = client.post(f"/projects/{project_id}/paygroups", json={"name": "Other"}).json()["id"]
+    ledger = [
+        (
+            group_id,
+            {"name": "Groceries", "date": "2024-01-05", "currency": "USD", "tags": [{"name": "food", "color": "red"}]},
+        ),
+        (group_id, {"name": "Rent", "date": "2024-02-01", "currency": "USD"}),
+        (other_group_id, {"name": "grocery run", "date": "2024-02-10", "currency": "CAD"}),
+        (
+            other_group_id,
+            {"name": "Restaurant", "date": "2024-03-15", "currency": "cad", "tags": [{"name": "food", "color": "red"}]},
+        ),
+        (group_id, {"name": "Gas", "date": "2024-04-01", "currency": "USD"}),
+    ]
+    for paygroup_id, payment in ledger:
+        client.post(f"/projects/{project_id}/paygroups/{paygroup_id}/payments", json={**mock_payment, **payment})
+    return client, project_id
+
+
+def find(client, project_id, **params) -> list[str]:
+    resp = client.get(f"/projects/{project_id}/payments", params=params)
+    assert resp.status_code == 200
+    return [payment["name"] for payment in resp.json()["payments"]]
+
+
+def test_payments_are_listed_by_date(client_with_ledger):
+    client, project_id = client_with_ledger
+    assert find(client, project_id) == ["Groceries", "Rent", "grocery run", "Restaurant", "Gas"]
+
+
+def test_can_search_payments_by_name_prefix(client_with_ledger):
+    client, project_id = client_with_ledger
+    assert find(client, project_id, name="groc") == ["Groceries", "grocery run"]
+    assert find(client, project_id, name="re") == ["Rent", "Restaurant"]
+
+
+def test_can_filter_payments(client_with_ledger):
+    client, project_id = client_with_ledger
+    assert find(client, project_id, date_from="2024-02-01", date_to="2024-03-15") == [
+        "Rent",
+        "grocery run",
+        "Restaurant",
+    ]
+    assert find(client, project_id, tag="food") == ["Groceries", "Restaurant"]
+    assert find(client, project_id, currency="CAD") == ["grocery run", "Restaurant"]
+    assert find(client, project_id, currency="usd", date_from="2024-01-06", name="r") == ["Rent"]
+
+
+def test_can_page_through_payments(client_with_ledger):
+    client, project_id = client_with_ledger
+    names, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get(f"/projects/{project_id}/payments", params=params).json()
+        assert len(page["payments"]) <= 2
+        names += [payment["name"] for payment in page["payments"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert names == ["Groceries", "Rent", "grocery run", "Restaurant", "Gas"]
+
+
+def test_found_payments_include_paygroup_and_attachment(client_with_payment, small_pdf):
+    client, project_id, group_id, payment_id = client_with_payment
+    url = f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files"
+    client.post(url, files={"file": ("test.pdf", small_pdf, "application/pdf")})
+    payment = client.get(f"/projects/{project_id}/payments").json()["payments"][0]
+    assert payment["paygroup_id"] == group_id
+    assert payment["attachment"] == f"{group_id}_{payment_id}.pdf"
+
+
+def test_search_sees_new_payments(client_with_payment, mock_payment):
+    client, project_id, group_id, _ = client_with_payment
+    assert len(find(client, project_id)) == 1
+    client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=mock_payment)
+    assert len(find(client, project_id)) == 2
+
+
+def test_cannot_search_payments_of_nonexistent_project(client):
+    assert client.get("/projects/42/payments").status_code == 404
+
+
+def test_invalid_cursor_is_rejected(client_with_project):
+    client, project_id = client_with_project
+    assert client.get(f"/projects/{project_id}/payments", params={"cursor": "nope"}).status_code == 422
+
+
+def test_can_search_payments_by_any_word(client_with_ledger):
+    client, project_id = client_with_ledger
+    assert find(client, project_id, name="run") == ["grocery run"]
+    assert find(client, project_id, name="groc ru") == ["grocery run"]
+
+
+@pytest.fixture
+def db_with_ledger(db) -> tuple:
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    for i, name in enumerate(["Groceries", "Rent", "Gas"]):
+        db.add_payment(project_id, group_id, PaymentInput(name=name, date=date(2024, 1, 10 - i), currency="USD"))
+    return db, project_id, group_id
+
+
+def test_indexes_are_updated_on_changes_without_rebuilding(db_with_ledger, monkeypatch):
+    db, project_id, group_id = db_with_ledger
+    assert [p.name for p in db.find_payments(project_id).payments] == ["Gas", "Rent", "Groceries"]
+    builds = []
+    monkeypatch.setattr(PaymentIndex, "build", lambda columns: builds.append(columns))
+    db.add_payment(project_id, group_id, PaymentInput(name="Rental car", date=date(2023, 12, 1), currency="EUR"))
+    rent = db.find_payments(project_id, name="rent").payments[1]
+    db.update_payment(project_id, group_id, Payment(**rent.model_dump(exclude={"name"}), name="Mortgage"))
+    db.delete_payment(project_id, group_id, 3)
+    db.add_paygroup(project_id, "Second Paygroup")
+    assert [p.name for p in db.find_payments(project_id).payments] == ["Rental car", "Mortgage", "Groceries"]
+    assert [p.name for p in db.find_payments(project_id, name="ren").payments] == ["Rental car"]
+    assert [p.name for p in db.find_payments(project_id, currency="EUR").payments] == ["Rental car"]
+    assert builds == []
+
+
+def test_saved_indexes_match_rebuilt_ones(db_with_ledger):
+    db, project_id, group_id = db_with_ledger
+    db.find_payments(project_id)
+    db.delete_paygroup(project_id, group_id)
+    db.add_payment(
+        project_id, db.add_paygroup(project_id, "New"), PaymentInput(name="a", date=date.today(), currency="USD")
+    )
+    db.flush_writes()
+    signature = db._get_payments_signature(project_id)
+    saved = PaymentIndex.load(db._get_index_path(project_id), signature)
+    rebuilt = PaymentIndex.build(PaymentColumns.build(db._get_paygroups_dict(project_id)))
+    assert vars(saved) == vars(rebuilt)
+
+
+def test_changes_do_not_rewrite_saved_indexes_until_flushed(tmp_path, monkeypatch):
+    db = dbfile.DBAdaptor(str(tmp_path), keep_history=False, journal=True)
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    db.add_payment(project_id, group_id, PaymentInput(name="Rent", date=date(2024, 1, 1), currency="USD"))
+    db.find_payments(project_id)
+    saves = []
+    monkeypatch.setattr(PaymentIndex, "save", lambda index, path, signature: saves.append(path))
+    for i in range(5):
+        db.add_payment(project_id, group_id, PaymentInput(name=f"pay {i}", date=date.today(), currency="USD"))
+    assert saves == []
+    db.flush_writes(due_only=True)
+    assert saves == []
+    db.flush_writes()
+    assert saves == [db._get_index_path(project_id)]
+    db.flush_writes()
+    assert len(saves) == 1
+
+
+def test_stale_indexes_are_rebuilt(db_with_ledger):
+    db, project_id, group_id = db_with_ledger
+    db.find_payments(project_id)
+    payfile_path = db._get_payfile_path(project_id)
+    with open(payfile_path, "w") as f:
+        json.dump({group_id: {"id": group_id, "name": "Edited elsewhere", "payments": []}}, f)
+    dbfile._search_cache.clear()
+    assert db.find_payments(project_id).payments == []
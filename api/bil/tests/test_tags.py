@@ -0,0 +1,48 @@
+import pytest
+from datetime import date
+from bil.datamodels import PaymentInput, TagModel
+from bil.tags import TagCatalog
+
+FOOD = TagModel(name="food", color="red")
+FUEL = TagModel(name="Fuel", color="black")
+RENT = TagModel(name="rent", color="blue")
+
+
+def test_tags_are_listed_once_with_counts(client_with_paygroup, mock_payment):
+    client, project_id, group_id = client_with_paygroup
+    for tags in [[FOOD], [FOOD, RENT], [FOOD, FOOD], []]:
+        payment = {**mock_payment, "tags": [tag.model_dump() for tag in tags]}
+        client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=payment)
+    resp = client.get(f"/projects/{project_id}/tags")
+    assert resp.status_code == 200
+    assert resp.json() == [{"name": "food", "color": "red", "count": 3}, {"name": "rent", "color": "blue", "count": 1}]
+
+
+def test_tags_can_be_looked_up_by_prefix(client_with_paygroup, mock_payment):
+    client, project_id, group_id = client_with_paygroup
+    payment = {**mock_payment, "tags": [tag.model_dump() for tag in [FOOD, FUEL, RENT]]}
+    client.post(f"/projects/{project_id}/paygroups/{group_id}/payments", json=payment)
+    assert [tag["name"] for tag in client.get(f"/projects/{project_id}/tags?prefix=F").json()] == ["food", "Fuel"]
+    assert [tag["name"] for tag in client.get(f"/projects/{project_id}/tags?prefix=fu").json()] == ["Fuel"]
+    assert client.get(f"/projects/{project_id}/tags?prefix=x").json() == []
+
+
+def test_cannot_get_tags_of_missing_project(client):
+    assert client.get("/projects/1/tags").status_code == 404
+
+
+def test_tag_catalog_is_kept_current_without_rebuilding(db, monkeypatch):
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    for tags in [[FOOD], [FOOD, RENT]]:
+        db.add_payment(project_id, group_id, PaymentInput(name="pay", date=date.today(), currency="USD", tags=tags))
+    assert [tag["count"] for tag in db.get_tags(project_id)] == [2, 1]
+    monkeypatch.setattr(TagCatalog, "build", classmethod(lambda cls, columns: pytest.fail("catalog rebuilt")))
+    payment = db.get_paygroups(project_id)[0].payments[1].model_copy(update={"tags": [FUEL]})
+    db.update_payment(project_id, group_id, payment)
+    db.delete_payment(project_id, group_id, 1)
+    db.add_payment(project_id, group_id, PaymentInput(name="pay", date=date.today(), currency="USD", tags=[RENT]))
+    assert db.get_tags(project_id) == [
+        {"name": "Fuel", "color": "black", "count": 1},
+        {"name": "rent", "color": "blue", "count": 1},
+    ]
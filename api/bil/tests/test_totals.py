@@ -0,0 +1,88 @@
+import pytest
+from datetime import date
+from bil import dbfile
+from bil.datamodels import PaymentInput, TagModel
+from bil.totals import PaymentTotals, add_to_sums
+
+FOOD = TagModel(name="food", color="red")
+
+
+def test_totals_are_summed_per_currency_paygroup_tag_and_month(client_with_paygroup, mock_payment):
+    client, project_id, group_id = client_with_paygroup
+    other_id = client.post(f"/projects/{project_id}/paygroups", json={"name": "Other"}).json()["id"]
+    food = {"tags": [FOOD.model_dump()]}
+    for paygroup_id, payment in [
+        (group_id, {"date": "2024-01-05", "asset": 100, "liability": 10, **food}),
+        (group_id, {"date": "2024-02-01", "asset": 200, "liability": 0}),
+        (other_id, {"date": "2024-02-10", "asset": 5, "liability": 7, "currency": "CAD", **food}),
+    ]:
+        client.post(f"/projects/{project_id}/paygroups/{paygroup_id}/payments", json={**mock_payment, **payment})
+    resp = client.get(f"/projects/{project_id}/totals")
+    assert resp.status_code == 200
+    totals = resp.json()
+    assert totals["currencies"] == {
+        "CAD": {"count": 1, "asset": 5, "liability": 7},
+        "USD": {"count": 2, "asset": 300, "liability": 10},
+    }
+    assert totals["paygroups"][str(group_id)] == {"USD": {"count": 2, "asset": 300, "liability": 10}}
+    assert totals["tags"]["food"] == {
+        "CAD": {"count": 1, "asset": 5, "liability": 7},
+        "USD": {"count": 1, "asset": 100, "liability": 10},
+    }
+    assert list(totals["months"]) == ["2024-01", "2024-02"]
+    assert totals["months"]["2024-02"]["USD"] == {"count": 1, "asset": 200, "liability": 0}
+
+
+def test_cannot_get_totals_of_missing_project(client):
+    assert client.get("/projects/1/totals").status_code == 404
+
+
+@pytest.fixture
+def db_with_totals(db) -> tuple:
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    for i in range(3):
+        db.add_payment(project_id, group_id, PaymentInput(name=f"pay {i}", date=date(2024, 1, 1), currency="USD"))
+    db.get_totals(project_id)
+    return db, project_id, group_id
+
+
+def test_totals_are_kept_current_without_rebuilding(db_with_totals, monkeypatch):
+    db, project_id, group_id = db_with_totals
+    builds = []
+    monkeypatch.setattr(PaymentTotals, "build", classmethod(lambda cls, columns: builds.append(1)))
+    payment = db.get_paygroups(project_id)[0].payments[0].model_copy(update={"asset": 50, "tags": [FOOD]})
+    db.update_payment(project_id, group_id, payment)
+    db.delete_payment(project_id, group_id, 2)
+    other_id = db.add_paygroup(project_id, "Other")
+    db.add_payment(project_id, other_id, PaymentInput(name="x", date=date(2024, 3, 1), asset=1, currency="EUR"))
+    db.delete_paygroup(project_id, other_id)
+    totals = db.get_totals(project_id)
+    assert builds == []
+    monkeypatch.undo()
+    dbfile._totals_cache.clear()
+    assert totals == db.get_totals(project_id)
+    assert totals["currencies"] == {"USD": {"count": 2, "asset": 50, "liability": 0}}
+
+
+def test_sums_drop_keys_that_run_out_of_payments():
+    sums = {}
+    add_to_sums(sums, ["a", "b"], 5, 2, 1)
+    add_to_sums(sums, ["a"], 3, 0, 1)
+    add_to_sums(sums, ["b"], 5, 2, -1)
+    assert sums == {"a": [2, 8, 2]}
+
+
+def test_totals_and_rollups_agree_after_changes(db_with_totals):
+    db, project_id, group_id = db_with_totals
+    db.get_report(project_id, "month")
+    payment = db.get_paygroups(project_id)[0].payments[0].model_copy(update={"asset": 50, "liability": 4})
+    db.update_payment(project_id, group_id, payment)
+    db.delete_payment(project_id, group_id, 2)
+    db.add_payment(project_id, group_id, PaymentInput(name="x", date=date(2024, 3, 1), asset=1, currency="EUR"))
+    months = db.get_totals(project_id)["months"]
+    report = {
+        (row["period"], row["currency"]): {key: row[key] for key in ("count", "asset", "liability")}
+        for row in db.get_report(project_id, "month")
+    }
+    assert report == {(month, currency): sums for month in months for currency, sums in months[month].items()}
@@ -0,0 +1,54 @@
+import pytest
+from datetime import date
+from bil import dbfile
+from bil.datamodels import PaymentInput
+from bil.dbfile import ItemNotFoundError
+
+
+@pytest.fixture
+def db_with_payments(db) -> tuple:
+    project_id = db.add_project("Test Project")
+    group_id = db.add_paygroup(project_id, "Test Paygroup")
+    for i in range(3):
+        db.add_payment(project_id, group_id, PaymentInput(name=f"pay {i}", date=date(2024, 1, 1), currency="USD"))
+    return db, project_id, group_id
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda db, p, g: db.add_payment(p, g, PaymentInput(name="new", date=date(2024, 1, 2), currency="USD")),
+        lambda db, p, g: db.delete_payment(p, g, 2),
+        lambda db, p, g: db.update_payment(p, g, db.get_paygroups(p)[0].payments[0]),
+        lambda db, p, g: db.update_paygroup(p, g, "Renamed"),
+    ],
+)
+def test_mutations_parse_payments_once(db_with_payments, parse_counter, mutate):
+    db, project_id, group_id = db_with_payments
+    dbfile._payments_cache.clear()
+    mutate(db, project_id, group_id)
+    assert parse_counter["paygroups"] == 1
+
+
+def test_transaction_persists_all_mutations_in_one_write(db_with_payments, monkeypatch):
+    db, project_id, group_id = db_with_payments
+    writes = []
+    original_save = db._save_paygroups
+    monkeypatch.setattr(db, "_save_paygroups", lambda *args: writes.append(args) or original_save(*args))
+    with db._transaction(project_id) as tx:
+        new_group_id = tx.add_paygroup("Another Paygroup")
+        tx.add_payment(new_group_id, PaymentInput(name="moved", date=date(2024, 2, 1), currency="CAD"))
+        tx.delete_payment(group_id, 1)
+    assert len(writes) == 1
+    groups = {g.id: g for g in db.get_paygroups(project_id)}
+    assert [p.name for p in groups[new_group_id].payments] == ["moved"]
+    assert [p.id for p in groups[group_id].payments] == [2, 3]
+
+
+def test_failed_transaction_leaves_data_untouched(db_with_payments):
+    db, project_id, group_id = db_with_payments
+    with pytest.raises(ItemNotFoundError):
+        with db._transaction(project_id) as tx:
+            tx.delete_payment(group_id, 1)
+            tx.delete_payment(group_id, 42)
+    assert [p.id for p in db.get_paygroups(project_id)[0].payments] == [1, 2, 3]
@@ -0,0 +1,65 @@
+import hashlib
+import io
+import os
+import pytest
+from bil import dbfile, uploads
+from bil.atomic import SyncPolicy
+from bil.uploads import UploadTooLargeError, stage_upload
+
+
+def upload(client, project_id: int, group_id: int, payment_id: int, content: bytes, name: str = "test.pdf"):
+    url = f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files"
+    return client.post(url, files={"file": (name, content, "application/pdf")})
+
+
+def test_upload_reports_size_and_hash_of_stored_file(client_with_payment, small_pdf):
+    client, project_id, group_id, payment_id = client_with_payment
+    resp = upload(client, project_id, group_id, payment_id, small_pdf)
+    assert resp.json() == {
+        "file_name": f"{group_id}_{payment_id}.pdf",
+        "size": len(small_pdf),
+        "sha256": hashlib.sha256(small_pdf).hexdigest(),
+    }
+    stored = client.get(f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files")
+    assert stored.content == small_pdf
+
+
+def test_uploads_over_the_limit_are_rejected_and_keep_the_current_file(client_with_payment, small_pdf, monkeypatch):
+    client, project_id, group_id, payment_id = client_with_payment
+    upload(client, project_id, group_id, payment_id, small_pdf)
+    monkeypatch.setattr(dbfile, "_max_upload_bytes", len(small_pdf) + 10)
+    resp = upload(client, project_id, group_id, payment_id, small_pdf + b"\0" * (uploads.CHUNK_BYTES + 1))
+    assert resp.status_code == 413
+    stored = client.get(f"/projects/{project_id}/paygroups/{group_id}/payments/{payment_id}/files")
+    assert stored.content == small_pdf
+    assert os.listdir(os.path.join("/tmp/ramdisk", "test_data", "uploads")) == []
+
+
+def test_upload_types_are_told_by_one_shared_detector(client_with_payment, small_pdf, monkeypatch):
+    client, project_id, group_id, payment_id = client_with_payment
+    samples = []
+    monkeypatch.setattr(uploads._detector, "from_buffer", lambda sample: samples.append(sample) or "text/plain")
+    resp = upload(client, project_id, group_id, payment_id, small_pdf)
+    assert resp.status_code == 415
+    assert samples == [bytes(small_pdf[: uploads.SNIFF_BYTES])]
+
+
+def test_staged_uploads_are_copied_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_BYTES", 4)
+    source = io.BytesIO(b"0123456789")
+    reads = []
+    read = source.read
+    source.read = lambda size: reads.append(size) or read(size)
+    staged = stage_upload(source, str(tmp_path / "uploads"), str(tmp_path / "1_1.pdf"), SyncPolicy("none"), 10)
+    assert reads == [4, 4, 4, 4]
+    with open(staged["path"], "rb") as f:
+        assert f.read() == b"0123456789"
+    assert staged["size"] == 10
+    assert staged["sha256"] == hashlib.sha256(b"0123456789").hexdigest()
+
+
+def test_staging_too_large_upload_leaves_nothing_behind(tmp_path):
+    directory = str(tmp_path / "uploads")
+    with pytest.raises(UploadTooLargeError):
+        stage_upload(io.BytesIO(b"0123456789"), directory, str(tmp_path / "1_1.pdf"), SyncPolicy("none"), 9)
+    assert os.listdir(directory) == []
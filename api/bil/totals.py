@@ -0,0 +1,90 @@
+from typing import Callable, Iterable, Iterator
+from bil.columns import PaymentColumns
+from bil.datamodels import Change, Payment
+
+# count, asset, liability
+Sums = list[int]
+
+
+def add_to_sums(sums_by_key: dict, keys: Iterable, asset: int, liability: int, sign: int):
+    """
+    Adds one payment to the sums under each of `keys`, or takes it out again with a `sign` of -1.
+    Sums left with no payments are dropped. Shared by totals and rollups, so both count the same way.
+    """
+    for key in keys:
+        sums = sums_by_key.setdefault(key, [0, 0, 0])
+        sums[0] += sign
+        sums[1] += sign * asset
+        sums[2] += sign * liability
+        if not sums[0]:
+            del sums_by_key[key]
+
+
+def payment_amounts(pay: Payment) -> tuple[set[str], int, int]:
+    """Tag names, asset and liability of a payment as they are summed, with missing amounts as 0."""
+    return {tag.name for tag in pay.tags or []}, pay.asset or 0, pay.liability or 0
+
+
+def apply_payment_changes(changes: Iterable[Change], add_payment: Callable[[int, Payment, int], None]):
+    """Takes out the payments changes replaced or deleted and adds the new ones, through `add_payment`."""
+    for change in changes:
+        if change.payment_id is None:
+            continue
+        if change.before is not None:
+            add_payment(change.paygroup_id, change.before, -1)
+        if change.after is not None:
+            add_payment(change.paygroup_id, change.after, 1)
+
+
+class PaymentTotals:
+    """
+    Running sums of payment amounts (in microcents) per currency: overall, per paygroup, per tag and per month.
+    Built once from a project's payment columns and kept current by applying changes as they are made,
+    so reading them never walks the payments again. Buckets that run out of payments are dropped.
+    """
+
+    def __init__(self):
+        self._sums: dict[tuple, Sums] = {}
+
+    @classmethod
+    def build(cls, columns: PaymentColumns) -> "PaymentTotals":
+        totals = cls()
+        days = columns.day_labels()
+        for row in columns.rows():
+            totals._add(
+                columns.paygroup_ids[row],
+                columns.currency(row),
+                days[row][:7],
+                columns.tag_names(row),
+                columns.asset(row) or 0,
+                columns.liability(row) or 0,
+                1,
+            )
+        return totals
+
+    def _keys(self, paygroup_id: int, currency: str, month: str, tags: set[str]) -> Iterator[tuple]:
+        yield "currencies", currency
+        yield "paygroups", paygroup_id, currency
+        yield "months", month, currency
+        for tag in tags:
+            yield "tags", tag, currency
+
+    def _add(self, paygroup_id: int, currency: str, month: str, tags: set[str], asset: int, liability: int, sign: int):
+        add_to_sums(self._sums, self._keys(paygroup_id, currency, month, tags), asset, liability, sign)
+
+    def _add_payment(self, paygroup_id: int, pay: Payment, sign: int):
+        tags, asset, liability = payment_amounts(pay)
+        self._add(paygroup_id, pay.currency, pay.date.isoformat()[:7], tags, asset, liability, sign)
+
+    def apply(self, changes: Iterable[Change]):
+        apply_payment_changes(changes, self._add_payment)
+
+    def as_dict(self) -> dict:
+        """{"currencies": {currency: sums}, "paygroups"/"tags"/"months": {key: {currency: sums}}}"""
+        result = {"currencies": {}, "paygroups": {}, "tags": {}, "months": {}}
+        for (kind, *key), (count, asset, liability) in sorted(self._sums.items()):
+            bucket = result[kind]
+            for part in key[:-1]:
+                bucket = bucket.setdefault(part, {})
+            bucket[key[-1]] = {"count": count, "asset": asset, "liability": liability}
+        return result
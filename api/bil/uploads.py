@@ -0,0 +1,56 @@
+from typing import IO
+from bil.atomic import SyncPolicy
+import hashlib
+import magic
+import os
+import tempfile
+import threading
+
+CHUNK_BYTES = 64 * 1024
+# the type is told from this much of the start of a file
+SNIFF_BYTES = 2048
+
+# opening libmagic loads its whole database, so one handle is kept; it is not safe to share between threads
+_detector = magic.Magic(mime=True)
+_detector_lock = threading.Lock()
+
+
+class UploadTooLargeError(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"uploads are limited to {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+def detect_type(sample: bytes) -> str:
+    with _detector_lock:
+        return _detector.from_buffer(sample)
+
+
+def detect_file_type(path: str) -> str:
+    with _detector_lock:
+        return _detector.from_file(path)
+
+
+def stage_upload(source: IO[bytes], directory: str, path: str, sync: SyncPolicy, max_bytes: int) -> dict:
+    """
+    Copies an upload meant for `path` into a new temporary file in `directory`, CHUNK_BYTES at a time, hashing
+    it on the way and giving up as soon as it grows past `max_bytes`. Returns {"path", "size", "sha256"} of the
+    temporary file; renaming it to `path` is up to the caller, and nothing is left behind if the copy fails.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := source.read(CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                digest.update(chunk)
+                f.write(chunk)
+            sync.written(path, f, replaces=True)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return {"path": tmp_path, "size": size, "sha256": digest.hexdigest()}
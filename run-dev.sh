@@ -1,6 +1,6 @@
 #!/bin/bash
 cd api
-LOG_LEVEL=info poetry run start &
+LOG_LEVEL=info poetry run start --reload &
 pid1=$!
 cd ..
 sleep 1